@@ -0,0 +1,118 @@
+"""
+out_of_core.py
+---------------
+Measures the time and peak memory of the out-of-core steps (modules/out_of_core.py) on England-wide synthetic data
+at the 10 million row scale, each loaded all at once ("eager") and streamed in chunks ("streaming").
+
+Run from the repository root:
+
+    python -m benchmarks.out_of_core --data /tmp/bikepoint_large --output memory.json
+
+The data is generated the first time (see benchmarks/synthetic.write_large_dataset) and reused afterwards. Every step
+runs in a fresh process, so each peak memory figure is that step's alone.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import polars as pl
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_PATH)
+
+import clean_data
+from benchmarks.synthetic import CHUNK_ROWS, LARGE_INDICATOR_ROWS, LARGE_STATIONS, write_large_dataset
+from modules import data_store, instrumentation
+from modules.out_of_core import count_stations, scan_la_indicator_means
+
+MODES = ["eager", "streaming"]
+
+
+def run_count_stations(data_path, streaming, chunk_rows):
+    centroids = data_store.load(data_path + "lsoa_centroids.csv")
+    return count_stations(data_path + "stations", centroids, chunk_rows if streaming else None).height
+
+
+def run_indicator_means(data_path, streaming, chunk_rows):
+    lsoas = clean_data.scan_deprivation(data_path)
+    means = scan_la_indicator_means(data_path + "lsoa_indicators", lsoas)
+    return means.collect(engine = "streaming" if streaming else "in-memory").height
+
+
+def run_clean(data_path, streaming, chunk_rows):
+    queries = [clean_data.build_model_data(data_path), clean_data.scan_indicator_panel(data_path), clean_data.build_rollup_cube(data_path)]
+    return sum(frame.height for frame in pl.collect_all(queries, engine = "streaming" if streaming else "in-memory"))
+
+
+STEPS = {
+    "count_stations": run_count_stations,
+    "indicator_means": run_indicator_means,
+    "clean": run_clean,
+}
+
+
+def measure(data_path, step, mode, chunk_rows):
+    """
+    Runs one step in this process and returns its time, output rows and the process' peak memory.
+    """
+    start = time.perf_counter()
+    rows = STEPS[step](data_path, mode == "streaming", chunk_rows)
+    return {"seconds": time.perf_counter() - start, "rows": rows, "peak_memory_mb": round(instrumentation.peak_memory() / 2 ** 20, 1)}
+
+
+def run(data_path, steps, chunk_rows):
+    """
+    Runs every step in both modes, each in a fresh process.
+
+    Returns
+    --------
+    results: dict
+        Keyed by "<step>@<mode>".
+    """
+    results = {}
+    env = dict(os.environ, PYTHONPATH = REPO_PATH)
+    for step in steps:
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.out_of_core", "--data", data_path, "--chunk-rows", str(chunk_rows), "--measure", step, mode],
+                cwd = REPO_PATH, env = env, capture_output = True, text = True, check = True,
+            ).stdout
+            results[f"{step}@{mode}"] = json.loads(output.strip().splitlines()[-1])
+            result = results[f"{step}@{mode}"]
+            print(f"{step}@{mode}: {result['seconds']:.1f} s, peak {result['peak_memory_mb']:,.0f} MB", file = sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Measure the peak memory of the out-of-core steps, eager and streaming.")
+    parser.add_argument("--data", required = True, help = "Folder for the synthetic data. Generated if it doesn't exist.")
+    parser.add_argument("--stations", type = int, default = LARGE_STATIONS)
+    parser.add_argument("--indicator-rows", type = int, default = LARGE_INDICATOR_ROWS)
+    parser.add_argument("--chunk-rows", type = int, default = CHUNK_ROWS, help = "Rows per chunk, when generating and streaming.")
+    parser.add_argument("--only", nargs = "+", choices = list(STEPS), default = list(STEPS), help = "Steps to run.")
+    parser.add_argument("--output", help = "Write the JSON results here instead of to stdout.")
+    parser.add_argument("--measure", nargs = 2, metavar = ("STEP", "MODE"), help = argparse.SUPPRESS)
+    args = parser.parse_args()
+    data_path = os.path.join(args.data, "")
+
+    if args.measure:
+        print(json.dumps(measure(data_path, *args.measure, args.chunk_rows)))
+        return
+    if not os.path.exists(data_path + "stations"):
+        start = time.perf_counter()
+        sizes = write_large_dataset(data_path, args.stations, args.indicator_rows, chunk_rows = args.chunk_rows)
+        print(f"Generated {sizes} in {time.perf_counter() - start:.0f} s", file = sys.stderr)
+    results = run(data_path, args.only, args.chunk_rows)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 1)
+    else:
+        json.dump(results, sys.stdout, indent = 1)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+"""
+run_benchmarks.py
+------------------
+Times each stage of the project against synthetic data and local stand-in APIs, and writes the results as JSON
+so runs on different commits can be compared.
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks --scales 1 10 --output before.json
+    python -m benchmarks.run_benchmarks --scales 1 10 --compare before.json
+
+--compare exits with status 1 if any benchmark's median got slower by more than --threshold.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import polars as pl
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_PATH)
+
+import clean_data
+import get_data
+from benchmarks.stand_in_servers import PostcodesHandler, StandInServer, TflHandler
+from benchmarks.synthetic import synthetic_feed, synthetic_occupancy, write_dataset
+from modules import data_store, occupancy
+
+
+def timed(function, repeats, setup = None):
+    """
+    Runs function repeats times, calling setup (untimed) before each run, and returns the times in seconds.
+    """
+    times = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+@contextlib.contextmanager
+def get_data_path(path):
+    """
+    Points get_data.py's data folder at path for the duration, and back to where it was afterwards.
+    """
+    previous = get_data.file_path
+    get_data.file_path = path
+    try:
+        yield
+    finally:
+        get_data.file_path = previous
+
+
+def remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def bench_fetch(data_path, repeats, latency):
+    """
+    get_bikepoints against the stand-in TfL API: a full download, then a conditional one answered with a 304.
+    """
+    bikepoints = pl.read_csv(data_path + "bikepoints.csv")
+    with get_data_path(data_path), StandInServer(TflHandler, feed = synthetic_feed(bikepoints)) as server:
+        api = server.url + "/BikePoint/"
+        full = timed(
+            lambda: get_data.get_bikepoints(api), repeats,
+            setup = lambda: [remove(data_path + "bikepoints_meta.json"), remove(data_path + "bikepoints.csv")],
+        )
+        get_data.get_bikepoints(api)
+        not_modified = timed(lambda: get_data.get_bikepoints(api), repeats)
+    return {"fetch_full": full, "fetch_not_modified": not_modified}
+
+
+def bench_geocode(data_path, repeats, latency):
+    """
+    lat_long_translate against the stand-in postcodes API, which adds latency seconds to every batch.
+    """
+    bikepoints = pl.read_csv(data_path + "bikepoints.csv")
+    with get_data_path(data_path), StandInServer(PostcodesHandler, latency = latency) as server:
+        api = server.url + "/postcodes"
+        return {"geocode": timed(lambda: get_data.lat_long_translate(api, bikepoints), repeats)}
+
+
+def bench_clean(data_path, repeats, latency):
+    """
+    The clean_data.py query, with the typed copies in data/store/ built from scratch (cold) and reused (warm).
+    """
+    run = lambda: clean_data.build_model_data(data_path).collect()
+    cold = timed(run, repeats, setup = lambda: remove(data_path + "store"))
+    warm = timed(run, repeats)
+    return {"clean_cold": cold, "clean_warm": warm}
+
+
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import run_model
+client = run_model.create_app(clientside = {clientside}).server.test_client()
+for path in ["/", "/_dash-layout", "/_dash-dependencies"]:
+    assert client.get(path).status_code == 200
+print(time.perf_counter() - start)
+"""
+
+
+def bench_startup(work_path, repeats, latency):
+    """
+    A fresh Python process importing run_model, creating the app from its artifacts and serving the first page.
+    Reports both the time inside the process and the wall time including interpreter start-up.
+    """
+    env = dict(os.environ, PYTHONPATH = REPO_PATH)
+    results = {}
+    for clientside in [True, False]:
+        inside = []
+        wall = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, "-c", STARTUP_SCRIPT.format(clientside = clientside)],
+                cwd = work_path, env = env, capture_output = True, text = True, check = True,
+            )
+            wall.append(time.perf_counter() - start)
+            inside.append(float(output.stdout.strip().splitlines()[-1]))
+        mode = "clientside" if clientside else "server"
+        results[f"startup_{mode}"] = inside
+        results[f"startup_{mode}_wall"] = wall
+    return results
+
+
+def bench_callbacks(work_path, repeats, latency, users = 16):
+    """
+    The bar graph callbacks run on the server, one request at a time and from many concurrent users: each graph
+    for every choice of its dropdowns (the obesity graph in every time period), and the time period choices for
+    each obesity measure. Each time is the latency of a single request.
+    """
+    import run_model
+    from modules.indicator_panel import LATEST, indicator_periods
+
+    with working_directory(work_path):
+        app = run_model.create_app(clientside = False)
+        aggregates = pl.read_ipc(run_model.artifact_path + "aggregates.arrow")
+        periods = indicator_periods(pl.read_ipc(run_model.artifact_path + "period_aggregates.arrow"))
+    options = run_model.bar_graph_options(aggregates)
+
+    def request(output, inputs):
+        component, prop = output.split(".")
+        return {
+            "output": output,
+            "outputs": {"id": component, "property": prop},
+            "inputs": [{"id": control, "property": "value", "value": value} for control, value in inputs],
+            "changedPropIds": [f"{inputs[0][0]}.value"],
+        }
+
+    figures = [
+        request("obesity_bar_graph.figure", [("obesity_bar_graph_control", col), ("obesity_period_control", period)])
+        for col in options["obesity_bar_graph"]
+        for period in [LATEST] + periods.get(col, [])
+    ] + [request("change_bar_graph.figure", [("cange_bar_graph_control", col)]) for col in options["change_bar_graph"]]
+    period_choices = [request("obesity_period_control.options", [("obesity_bar_graph_control", col)]) for col in options["obesity_bar_graph"]]
+
+    def call(payload):
+        client = app.server.test_client()
+        start = time.perf_counter()
+        response = client.post("/_dash-update-component", json = payload)
+        assert response.status_code == 200, response.status_code
+        return time.perf_counter() - start
+
+    sequential = [call(payload) for _ in range(repeats) for payload in figures]
+    period_options = [call(payload) for _ in range(repeats) for payload in period_choices]
+    with ThreadPoolExecutor(max_workers = users) as pool:
+        concurrent = list(pool.map(call, (figures + period_choices) * repeats * users))
+    return {"callback": sequential, "callback_period_options": period_options, f"callback_{users}_users": concurrent}
+
+
+def bench_occupancy(data_path, repeats, latency, days = 2):
+    """
+    The occupancy collector polling the stand-in TfL API once a (simulated) minute for days days, with 5% of
+    stations changing between polls, then time-window queries over what it stored.
+    """
+    bikepoints = pl.read_csv(data_path + "bikepoints.csv")
+    store_path = data_path + "occupancy"
+    remove(store_path)
+    start = datetime(2024, 1, 1, tzinfo = timezone.utc)
+    polls = synthetic_occupancy(len(bikepoints), days * 24 * 60)
+    poll_times = []
+    with StandInServer(TflHandler, feed = b"[]") as server, occupancy.OccupancyStore(store_path) as store:
+        validators = {}
+        for minute, (docks, bikes) in enumerate(polls):
+            server.httpd.feed = synthetic_feed(bikepoints, docks = docks, bikes = bikes)
+            poll_start = time.perf_counter()
+            store.append(occupancy.fetch_occupancy(server.url + "/BikePoint/", validators), start + timedelta(minutes = minute))
+            poll_times.append(time.perf_counter() - poll_start)
+    end = start + timedelta(days = days) - timedelta(minutes = 1)
+    day = (end - timedelta(days = 1), end)
+    stored = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(store_path) for name in names)
+    print(f"occupancy store: {stored / 1e6:.1f} MB for {len(poll_times)} polls of {len(bikepoints)} stations", file = sys.stderr)
+    return {
+        "occupancy_poll": poll_times,
+        "occupancy_snapshot": timed(lambda: occupancy.snapshot(store_path, end), repeats),
+        "occupancy_day_summary": timed(lambda: occupancy.station_summary(store_path, *day), repeats),
+        "occupancy_day_totals": timed(lambda: occupancy.network_totals(store_path, *day), repeats),
+    }
+
+
+BENCHMARKS = {
+    "fetch": bench_fetch,
+    "geocode": bench_geocode,
+    "clean": bench_clean,
+    "startup": bench_startup,
+    "callbacks": bench_callbacks,
+    "occupancy": bench_occupancy,
+}
+
+
+def prepare(work_path, scale):
+    """
+    Writes a synthetic data/ folder and builds what clean_data.py would from it (model_data.csv, indicator_panel.csv
+    and rollup_cube.csv), then the dashboard artifacts.
+    """
+    import run_model
+
+    data_path = os.path.join(work_path, "data") + "/"
+    sizes = write_dataset(data_path, scale)
+    model_data, panel, cube = pl.collect_all([
+        clean_data.build_model_data(data_path), clean_data.scan_indicator_panel(data_path), clean_data.build_rollup_cube(data_path),
+    ])
+    data_store.write(model_data, data_path + "model_data.csv")
+    data_store.write(panel, data_path + "indicator_panel.csv")
+    data_store.write(cube, data_path + "rollup_cube.csv")
+    os.makedirs(os.path.join(work_path, "maps"), exist_ok = True)
+    with working_directory(work_path):
+        run_model.build_artifacts()
+    return data_path, sizes
+
+
+def summarise(times):
+    ordered = sorted(times)
+    return {
+        "n": len(times),
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+        "mean": statistics.fmean(ordered),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd = REPO_PATH, capture_output = True, text = True, check = True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scales, benchmarks, repeats, latency):
+    """
+    Runs the chosen benchmarks at every scale.
+
+    Returns
+    --------
+    report: dict
+        Metadata about the run and a "results" dict keyed by "<benchmark>@<scale>x".
+    """
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "polars": pl.__version__,
+        "platform": platform.platform(),
+        "latency": latency,
+        "results": {},
+    }
+    for scale in scales:
+        work_path = tempfile.mkdtemp(prefix = f"bikepoint_bench_{scale}x_")
+        try:
+            data_path, sizes = prepare(work_path, scale)
+            for name in benchmarks:
+                path = work_path if name in ("startup", "callbacks") else data_path
+                for result_name, times in BENCHMARKS[name](path, repeats, latency).items():
+                    report["results"][f"{result_name}@{scale}x"] = dict(summarise(times), scale = scale, **sizes)
+                    print(f"{result_name}@{scale}x: median {statistics.median(times) * 1000:.1f} ms", file = sys.stderr)
+        finally:
+            shutil.rmtree(work_path, ignore_errors = True)
+    return report
+
+
+def compare(report, baseline, threshold):
+    """
+    Prints each benchmark's median against the baseline's and returns the names of those slower than threshold times.
+    """
+    regressions = []
+    for name, result in report["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before = baseline["results"][name]["median"]
+        ratio = result["median"] / before if before else float("inf")
+        flag = "REGRESSION" if ratio > threshold else ""
+        print(f"{name:40} {before * 1000:10.1f} ms -> {result['median'] * 1000:10.1f} ms  x{ratio:5.2f} {flag}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark the BikePoint pipeline and dashboard.")
+    parser.add_argument("--scales", type = float, nargs = "+", default = [1, 10], help = "Multiples of the real data size.")
+    parser.add_argument("--only", nargs = "+", choices = list(BENCHMARKS), default = list(BENCHMARKS), help = "Benchmarks to run.")
+    parser.add_argument("--repeats", type = int, default = 5)
+    parser.add_argument("--latency", type = float, default = 0.02, help = "Seconds the stand-in postcodes API adds to each batch.")
+    parser.add_argument("--output", help = "Write the JSON report here instead of to stdout.")
+    parser.add_argument("--compare", help = "A previous JSON report to compare against.")
+    parser.add_argument("--threshold", type = float, default = 1.2, help = "Slowdown ratio counted as a regression.")
+    args = parser.parse_args()
+
+    report = run([int(s) if s == int(s) else s for s in args.scales], args.only, args.repeats, args.latency)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent = 1)
+    else:
+        json.dump(report, sys.stdout, indent = 1)
+        print()
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
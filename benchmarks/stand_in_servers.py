@@ -0,0 +1,127 @@
+"""
+stand_in_servers.py
+--------------------
+Local stand-ins for the TfL BikePoint API and the postcodes.io reverse geocoding API,
+so the fetch and geocoding steps can be benchmarked without touching the real services.
+
+Both run in a background thread on a free port:
+
+    with StandInServer(TflHandler, feed = body) as server:
+        get_bikepoints(server.url + "/BikePoint/")
+"""
+import gzip
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandInServer:
+    """
+    Runs a request handler class on 127.0.0.1 in a background thread. Keyword arguments become
+    attributes of the server, which handlers read through self.server.
+    """
+
+    def __init__(self, handler, **settings):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self.httpd.requests = 0
+        self.httpd.lock = threading.Lock()
+        for key, value in settings.items():
+            setattr(self.httpd, key, value)
+        self.thread = threading.Thread(target = self.httpd.serve_forever, daemon = True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _count(self):
+        """
+        Counts this request, returning how many there have been including it. Requests are handled on
+        several threads at once, so the count is taken under the server's lock.
+        """
+        with self.server.lock:
+            self.server.requests += 1
+            return self.server.requests
+
+    def _send(self, status, body = b"", headers = None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TflHandler(_Handler):
+    """
+    Serves server.feed (bytes) at any path, gzipped when asked, with an ETag and Last-Modified,
+    and answers 304 to a matching If-None-Match.
+    """
+
+    def do_GET(self):
+        self._count()
+        feed = self.server.feed
+        etag = '"' + hashlib.sha256(feed).hexdigest()[:16] + '"'
+        headers = {"ETag": etag, "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT", "Content-Type": "application/json"}
+        if self.headers.get("If-None-Match") == etag:
+            self._send(304, headers = headers)
+            return
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+            feed = gzip.compress(feed, compresslevel = 1)
+        self._send(200, feed, headers)
+
+
+def stand_in_lsoa(lat, lon):
+    """
+    The made-up LSOA code PostcodesHandler gives a point.
+    """
+    cell = (int(lat * 200), int(lon * 200))
+    return f"E01{abs(hash(cell)) % 10 ** 6:06d}"
+
+
+class PostcodesHandler(_Handler):
+    """
+    Answers postcodes.io bulk reverse geocoding requests. Each point gets a made-up LSOA code derived from
+    its coordinates (stand_in_lsoa). server.latency seconds are added to every response to stand in for the
+    network, and every server.fail_every-th request (if set) gets a server.fail_status (default 503) with a
+    Retry-After of server.retry_after (default "0", None for no header) to exercise retries.
+    Every request's batch size is recorded in server.batch_sizes.
+    """
+
+    def do_POST(self):
+        request_number = self._count()
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(getattr(self.server, "latency", 0))
+        fail_every = getattr(self.server, "fail_every", 0)
+        if fail_every and request_number % fail_every == 0:
+            retry_after = getattr(self.server, "retry_after", "0")
+            self._send(getattr(self.server, "fail_status", 503), headers = {"Retry-After": retry_after} if retry_after is not None else {})
+            return
+        if hasattr(self.server, "batch_sizes"):
+            self.server.batch_sizes.append(len(body["geolocations"]))
+        results = []
+        for query in body["geolocations"]:
+            codes = {
+                "lsoa": stand_in_lsoa(query["latitude"], query["longitude"]),
+                "parliamentary_constituency": "E14000000",
+            }
+            results.append({"query": query, "result": [{"postcode": "AA1 1AA", "codes": codes}]})
+        self._send(200, json.dumps({"status": 200, "result": results}).encode(), {"Content-Type": "application/json"})
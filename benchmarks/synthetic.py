@@ -0,0 +1,319 @@
+"""
+synthetic.py
+-------------
+Synthetic versions of every input in data/, scaled up from the real sizes, for benchmarking.
+
+At scale 1 there are as many stations, LSOAs and local authorities as the real data
+(~800 BikePoints, ~33k LSOAs in ~320 local authorities, 33 of them in London).
+Column names and formats match the real files, e.g. the deprivation rank keeps its thousands separators.
+
+write_large_dataset adds England-wide tables at the 10 million row scale of trip-level or national bike share
+data, for the out-of-core benchmark (benchmarks/out_of_core.py). They are generated and written a chunk at a
+time, so making them needs no more memory than reading them should.
+"""
+import json
+import os
+
+import numpy as np
+import polars as pl
+
+STATIONS = 800
+LSOAS = 32_844
+LAS = 317
+LONDON_LAS = 33
+# London local authorities synthetic_la_counts puts no stations in
+UNSERVED_LONDON_LAS = 8
+
+# Roughly Greater London
+LAT_RANGE = (51.28, 51.69)
+LON_RANGE = (-0.51, 0.33)
+
+CHILDREN_INDICATORS = [
+    "Reception prevalence of overweight (including obesity)",
+    "Reception prevalence of obesity (including severe obesity)",
+    "Year 6 prevalence of overweight (including obesity)",
+    "Year 6 prevalence of obesity (including severe obesity)",
+]
+ADULT_INDICATORS = [93088, 93881]
+
+# Roughly England, for write_large_dataset
+ENGLAND_LAT_RANGE = (50.2, 55.6)
+ENGLAND_LON_RANGE = (-5.5, 1.7)
+LARGE_STATIONS = 10_000_000
+LARGE_INDICATOR_ROWS = 10_000_000
+CHUNK_ROWS = 1_000_000
+LSOA_INDICATORS = [
+    "5_yearolds_overweight", "5_yearolds_obese", "11_yearolds_overweight", "11_yearolds_obese",
+    "adults_overweight", "adults_obese",
+]
+
+
+def synthetic_bikepoints(n_stations, seed = 0):
+    """
+    BikePoints in the layout of bikepoints.csv, scattered over London.
+    """
+    rng = np.random.default_rng(seed)
+    ids = [f"BikePoints_{i}" for i in range(1, n_stations + 1)]
+    return pl.DataFrame({
+        "$type": ["Tfl.Api.Presentation.Entities.Place, Tfl.Api.Presentation.Entities"] * n_stations,
+        "id": ids,
+        "url": ["/Place/" + station_id for station_id in ids],
+        "commonName": [f"Street {i}, Area {i % 97}" for i in range(1, n_stations + 1)],
+        "placeType": ["BikePoint"] * n_stations,
+        "lat": np.round(rng.uniform(*LAT_RANGE, n_stations), 6),
+        "lon": np.round(rng.uniform(*LON_RANGE, n_stations), 6),
+    })
+
+
+def synthetic_feed(bikepoints, seed = 0, docks = None, bikes = None):
+    """
+    The BikePoint API response for the given stations, including the additionalProperties the real feed carries.
+    The dock and bike counts are random unless given (e.g. from synthetic_occupancy).
+    """
+    rng = np.random.default_rng(seed)
+    if docks is None:
+        docks = rng.integers(10, 40, len(bikepoints))
+    if bikes is None:
+        bikes = rng.integers(0, docks + 1)
+    stations = []
+    for row, n_docks, n_bikes in zip(bikepoints.iter_rows(named = True), docks.tolist(), bikes.tolist()):
+        properties = {
+            "TerminalName": row["id"].split("_")[-1],
+            "Installed": "true",
+            "Locked": "false",
+            "InstallDate": "1278947280000",
+            "RemovalDate": "",
+            "Temporary": "false",
+            "NbBikes": n_bikes,
+            "NbEmptyDocks": n_docks - n_bikes,
+            "NbDocks": n_docks,
+            "NbStandardBikes": n_bikes,
+            "NbEBikes": 0,
+        }
+        stations.append({
+            "$type": row["$type"],
+            "id": row["id"],
+            "url": row["url"],
+            "commonName": row["commonName"],
+            "placeType": row["placeType"],
+            "additionalProperties": [
+                {
+                    "$type": "Tfl.Api.Presentation.Entities.AdditionalProperties, Tfl.Api.Presentation.Entities",
+                    "category": "Description",
+                    "key": key,
+                    "sourceSystemKey": "BikePoints",
+                    "value": str(value),
+                    "modified": "2024-01-01T00:00:00.000Z",
+                }
+                for key, value in properties.items()
+            ],
+            "children": [],
+            "childrenUrls": [],
+            "lat": row["lat"],
+            "lon": row["lon"],
+        })
+    return json.dumps(stations).encode()
+
+
+def synthetic_occupancy(n_stations, polls, change_fraction = 0.05, seed = 0):
+    """
+    Yields the dock and bike counts of every station for each of polls polls, with change_fraction of the
+    stations gaining or losing a few bikes between one poll and the next.
+    """
+    rng = np.random.default_rng(seed)
+    docks = rng.integers(10, 40, n_stations)
+    bikes = rng.integers(0, docks + 1)
+    for _ in range(polls):
+        yield docks, bikes
+        changed = rng.random(n_stations) < change_fraction
+        bikes = np.where(changed, np.clip(bikes + rng.integers(-3, 4, n_stations), 0, docks), bikes)
+
+
+def synthetic_local_authorities(n_las):
+    """
+    Local authority codes and names. The first LONDON_LAS / LAS of them are London boroughs (E09 codes).
+    """
+    n_london = max(1, round(n_las * LONDON_LAS / LAS))
+    codes = [f"E09{i:06d}" if i < n_london else f"E06{i:06d}" for i in range(n_las)]
+    names = [f"Local Authority {i}" for i in range(n_las)]
+    return codes, names
+
+
+def synthetic_deprivation(n_lsoas, n_las, seed = 0):
+    """
+    LSOAs in the layout of deprivation.csv, spread evenly over the local authorities.
+    """
+    rng = np.random.default_rng(seed)
+    codes, names = synthetic_local_authorities(n_las)
+    la = np.arange(n_lsoas) % n_las
+    rank = rng.permutation(n_lsoas) + 1
+    return pl.DataFrame({
+        "LSOA code (2011)": [f"E{i:08d}" for i in range(n_lsoas)],
+        "LSOA name (2011)": [f"{names[j]} {i // n_las:03d}A" for i, j in enumerate(la.tolist())],
+        "Local Authority District code (2019)": [codes[j] for j in la.tolist()],
+        "Local Authority District name (2019)": [names[j] for j in la.tolist()],
+        "Index of Multiple Deprivation (IMD) Rank": [f"{r:,}" for r in rank.tolist()],
+        "Index of Multiple Deprivation (IMD) Decile": (rank * 10 // (n_lsoas + 1) + 1).tolist(),
+    })
+
+
+def synthetic_la_counts(deprivation, n_stations, seed = 0):
+    """
+    BikePoint counts in the layout of la_counts.csv, for LSOAs in London local authorities.
+    Like the real scheme, the stations are only in some of them (all but the last UNSERVED_LONDON_LAS), so both
+    groups the model compares have local authorities in them.
+    """
+    rng = np.random.default_rng(seed)
+    london = deprivation.filter(pl.col("Local Authority District code (2019)").str.starts_with("E09"))
+    london_las = london["Local Authority District code (2019)"].unique().sort()
+    served = london_las.head(max(1, len(london_las) - UNSERVED_LONDON_LAS))
+    london = london.filter(pl.col("Local Authority District code (2019)").is_in(served.implode()))["LSOA code (2011)"]
+    lsoas = london.to_numpy()[rng.integers(0, len(london), n_stations)]
+    return pl.DataFrame({"lsoa": lsoas}).group_by("lsoa", maintain_order = True).agg(pl.len().alias("count"))
+
+
+def synthetic_fingertips(indicators, indicator_column, area_type, periods, n_las, seed = 0):
+    """
+    An obesity indicator export in the Fingertips layout, with an England row and one row per local authority,
+    indicator and period.
+    """
+    rng = np.random.default_rng(seed)
+    codes, names = synthetic_local_authorities(n_las)
+    columns = {"Indicator ID": [], "Indicator Name": [], "Area Code": [], "Area Name": [], "Area Type": [], "Time period": [], "Value": []}
+    for indicator_number, indicator in enumerate(indicators):
+        for period in periods:
+            areas = [("E92000001", "England", "England")] + [(code, name, area_type) for code, name in zip(codes, names)]
+            for code, name, this_area_type in areas:
+                columns["Indicator ID"].append(indicator if indicator_column == "Indicator ID" else 90000 + indicator_number)
+                columns["Indicator Name"].append(indicator if indicator_column == "Indicator Name" else f"Indicator {indicator}")
+                columns["Area Code"].append(code)
+                columns["Area Name"].append(name)
+                columns["Area Type"].append(this_area_type)
+                columns["Time period"].append(period)
+    columns["Value"] = np.round(rng.uniform(5, 70, len(columns["Area Code"])), 5).tolist()
+    return pl.DataFrame(columns)
+
+
+def write_dataset(directory, scale = 1, seed = 0):
+    """
+    A function which writes a full synthetic data/ folder (bikepoints.csv, la_counts.csv, deprivation.csv,
+    childhood_obesity.csv and adult_obesity.csv) at scale times the real size.
+
+    Returns
+    --------
+    sizes: dict
+        The number of stations, LSOAs and local authorities generated.
+    """
+    n_stations = int(STATIONS * scale)
+    n_lsoas = int(LSOAS * scale)
+    n_las = int(LAS * scale)
+    os.makedirs(directory, exist_ok = True)
+
+    synthetic_bikepoints(n_stations, seed).write_csv(os.path.join(directory, "bikepoints.csv"))
+    deprivation = synthetic_deprivation(n_lsoas, n_las, seed)
+    deprivation.write_csv(os.path.join(directory, "deprivation.csv"))
+    synthetic_la_counts(deprivation, n_stations, seed).write_csv(os.path.join(directory, "la_counts.csv"))
+    synthetic_fingertips(
+        CHILDREN_INDICATORS, "Indicator Name", "Districts & UAs (from Apr 2023)", ["2021/22", "2022/23"], n_las, seed
+    ).write_csv(os.path.join(directory, "childhood_obesity.csv"))
+    synthetic_fingertips(
+        ADULT_INDICATORS, "Indicator ID", "Districts & UAs (2020/21)", ["2015/16", "2021/22"], n_las, seed
+    ).write_csv(os.path.join(directory, "adult_obesity.csv"))
+    return {"stations": n_stations, "lsoas": n_lsoas, "las": n_las}
+
+
+def synthetic_centroids(n_lsoas, n_las, seed = 0):
+    """
+    LSOA centroids in the layout of lsoa_centroids.csv, for the LSOAs of synthetic_deprivation. Each local authority's
+    LSOAs are gathered around a town centre, in London for the London boroughs and anywhere in England for the rest.
+    """
+    rng = np.random.default_rng(seed)
+    codes, _ = synthetic_local_authorities(n_las)
+    london = np.array([code.startswith("E09") for code in codes])
+    centre_lat = np.where(london, rng.uniform(*LAT_RANGE, n_las), rng.uniform(*ENGLAND_LAT_RANGE, n_las))
+    centre_lon = np.where(london, rng.uniform(*LON_RANGE, n_las), rng.uniform(*ENGLAND_LON_RANGE, n_las))
+    la = np.arange(n_lsoas) % n_las
+    # A few kilometres across
+    return pl.DataFrame({
+        "lsoa": [f"E{i:08d}" for i in range(n_lsoas)],
+        "lat": np.round(centre_lat[la] + rng.normal(0, 0.02, n_lsoas), 6),
+        "lon": np.round(centre_lon[la] + rng.normal(0, 0.03, n_lsoas), 6),
+    })
+
+
+def synthetic_station_chunks(centroids, n_stations, chunk_rows = CHUNK_ROWS, seed = 0):
+    """
+    Yields n_stations stations (columns id, lat and lon) chunk_rows at a time. Each is a few hundred metres from an
+    LSOA centroid, with the LSOAs' popularity heavy-tailed so stations bunch up in some areas, as they do in cities.
+    """
+    rng = np.random.default_rng(seed)
+    lats = centroids["lat"].to_numpy()
+    lons = centroids["lon"].to_numpy()
+    popularity = rng.pareto(1.5, len(lats)) + 0.01
+    popularity /= popularity.sum()
+    for start in range(0, n_stations, chunk_rows):
+        size = min(chunk_rows, n_stations - start)
+        lsoa = rng.choice(len(lats), size, p = popularity)
+        yield pl.DataFrame({
+            "id": np.arange(start, start + size, dtype = np.int64),
+            "lat": lats[lsoa] + rng.normal(0, 0.003, size),
+            "lon": lons[lsoa] + rng.normal(0, 0.004, size),
+        })
+
+
+def synthetic_lsoa_indicator_chunks(lsoa_codes, n_rows, chunk_rows = CHUNK_ROWS, seed = 0):
+    """
+    Yields an LSOA level indicator panel (columns lsoa, indicator, period, year and value) of at least n_rows rows,
+    about chunk_rows at a time: every indicator for every LSOA, in as many yearly periods back from 2023/24 as it takes.
+    """
+    rng = np.random.default_rng(seed)
+    lsoa_codes = pl.Series("lsoa", lsoa_codes, dtype = pl.Utf8)
+    indicators = pl.Series("indicator", LSOA_INDICATORS, dtype = pl.Utf8)
+    period_rows = len(lsoa_codes) * len(indicators)
+    n_periods = max(1, -(-n_rows // period_rows))
+    periods_per_chunk = max(1, chunk_rows // period_rows)
+    # Each LSOA has its own level of each indicator, which drifts a little from year to year
+    base = rng.uniform(5, 60, period_rows)
+    for first in range(0, n_periods, periods_per_chunk):
+        years = np.arange(2023 - first, 2023 - min(first + periods_per_chunk, n_periods), -1)
+        rows = np.tile(np.arange(period_rows), len(years))
+        year = np.repeat(years, period_rows)
+        yield pl.DataFrame({
+            "lsoa": lsoa_codes.gather(rows // len(indicators)),
+            "indicator": indicators.gather(rows % len(indicators)),
+            "period": pl.Series(year).cast(pl.Utf8) + "/" + pl.Series((year + 1) % 100).cast(pl.Utf8).str.zfill(2),
+            "year": year.astype(np.int32),
+            "value": np.round(base[rows] + rng.normal(0, 1, len(rows)), 5),
+        })
+
+
+def write_large_dataset(directory, n_stations = LARGE_STATIONS, indicator_rows = LARGE_INDICATOR_ROWS, scale = 1, chunk_rows = CHUNK_ROWS, seed = 0):
+    """
+    A function which writes a synthetic England-wide data/ folder for the out-of-core benchmark: deprivation.csv,
+    la_counts.csv, lsoa_centroids.csv and the obesity exports (see write_dataset), and the large tables as folders of
+    Arrow IPC files of chunk_rows rows each:
+
+    - stations/: n_stations stations (id, lat, lon) spread over England's LSOAs.
+    - lsoa_indicators/: an LSOA level indicator panel of at least indicator_rows rows.
+
+    Returns
+    --------
+    sizes: dict
+        The number of stations, lsoa_indicators rows, LSOAs and local authorities generated.
+    """
+    sizes = write_dataset(directory, scale, seed)
+    n_lsoas = sizes["lsoas"]
+    centroids = synthetic_centroids(n_lsoas, sizes["las"], seed)
+    centroids.write_csv(os.path.join(directory, "lsoa_centroids.csv"))
+
+    for name, chunks in [
+        ("stations", synthetic_station_chunks(centroids, n_stations, chunk_rows, seed)),
+        ("lsoa_indicators", synthetic_lsoa_indicator_chunks(centroids["lsoa"], indicator_rows, chunk_rows, seed)),
+    ]:
+        os.makedirs(os.path.join(directory, name), exist_ok = True)
+        rows = 0
+        for part, chunk in enumerate(chunks):
+            chunk.write_ipc(os.path.join(directory, name, f"part-{part:05d}.arrow"))
+            rows += chunk.height
+        sizes[name] = rows
+    return sizes
@@ -5,135 +5,248 @@ This script takes the files that were not downloaded by API and cleans them and
 Takes spreadsheets from the raw_data folder
 Outputs into the inputs folder for use in the model.
 
+The whole clean is built as one lazy Polars query over the typed copies kept by modules/data_store.py,
+so each file is scanned once and only the columns and rows the model needs are read. Run with --explain to print the optimised plan
+or --timing to time it. --streaming runs it on Polars' streaming engine, for inputs too big to hold in memory
+(see modules/out_of_core.py).
+
+The obesity exports are gathered into one long panel of every indicator, time period and local authority
+(modules/indicator_panel.py), saved as indicator_panel.csv. model_data.csv takes the most recent period of each
+indicator from it, so new years of data need no code changes.
+
+BikePoint counts, deprivation and obesity are also summed up from LSOAs to MSOAs, local authorities and London
+(modules/rollup_cube.py) and saved as rollup_cube.csv, for the dashboard to drill down through.
+
+If data/lsoa_centroids.csv exists (see --centroids / --boundaries), each local authority also gets the mean
+distance from its LSOAs to the nearest BikePoint and the mean number of BikePoints within 500m of them.
 """
+import argparse
+import os
+import time
+
 import polars as pl
 
+from modules import data_store, instrumentation
+from modules.indicator_panel import scan_panel, wide_panel
+from modules.out_of_core import engine
+from modules.rollup_cube import scan_cube
+from modules.spatial_join import load_index
+from modules.station_distance import centroids_from_boundaries, station_coverage
+
 file_path = "data/"
-# Data Cleaning
-la_counts = pl.read_csv(file_path + "la_counts.csv")
-deprivation_data = pl.read_csv(file_path + "deprivation.csv")
-
-# Rename columns to make sense for graphs / joining
-deprivation_data = deprivation_data.rename(
-    {
-        "Local Authority District name (2019)": "la_name",
-        "Local Authority District code (2019)": "la_code",
-        "Index of Multiple Deprivation (IMD) Rank": "rank",
-        "Index of Multiple Deprivation (IMD) Decile": "decile",
-        "LSOA code (2011)":"lsoa"
-    }
-)
-# Make them numbers
-deprivation_data = deprivation_data.with_columns(
-    (pl.col("rank").str.replace(",", "")).cast(pl.Int64)
-)
-# With vs without bikepoints
-deprivation_data = deprivation_data.with_columns(
-    (pl.col("lsoa").is_in(la_counts["lsoa"])).alias("bikepoint")
-)
-# London only
-deprivation_data = deprivation_data.with_columns(
-    (pl.col("la_code").str.slice(0, 3) == "E09").alias("london")
-)
-# Bikepoints corelate with more deprived (lower score) LAs - both London and England-wid
-# Childhood Obesity Data
-children_data = pl.read_csv(file_path + "childhood_obesity.csv", infer_schema_length= 10000)
-# I want the most recent data
-children_data = children_data.filter(pl.col("Time period") == "2022/23")
+
+# Adult obesity before BikePoint expansion, for the change columns
+HISTORIC_ADULTS_PERIOD = "2015/16"
+
 # Don't want England-wide etc.
-children_data = children_data.filter(pl.col("Area Type") == "Districts & UAs (from Apr 2023)")
-
-children_data = children_data.rename({
-    "Area Code":"la_code",
-    "Area Name":"la_name"
-})
-
-overweight_children = children_data.filter(pl.col("Indicator Name") == "Reception prevalence of overweight (including obesity)")
-obese_children = children_data.filter(pl.col("Indicator Name") == 'Reception prevalence of obesity (including severe obesity)')
-
-overweight_children = overweight_children.rename({
-    "Value": "5_yearolds_overweight"
-})
-
-obese_children = obese_children.rename({
-    "Value": "5_yearolds_obese"
-})
-reception_children = obese_children.with_columns(
-    pl.Series(overweight_children["5_yearolds_overweight"]).alias("5_yearolds_overweight")
-)
-# Join them together
-la_bikepoints = deprivation_data.filter(pl.col("london") == True).group_by("la_name").mean()[["la_name", "bikepoint", "rank"]]
-la_bikepoints = la_bikepoints.with_columns(
-    (pl.col("bikepoint") != 0).alias("bikepoint_binary")
-)
-reception_children = reception_children[["la_name","5_yearolds_overweight", "5_yearolds_obese"]].join(la_bikepoints, on = "la_name")
-
-
-overweight_children = children_data.filter(pl.col("Indicator Name") == "Year 6 prevalence of overweight (including obesity)")
-obese_children = children_data.filter(pl.col("Indicator Name") == 'Year 6 prevalence of obesity (including severe obesity)')
-
-overweight_children = overweight_children.rename({
-    "Value": "11_yearolds_overweight"
-})
-
-obese_children = obese_children.rename({
-    "Value": "11_yearolds_obese"
-})
-y6_children = obese_children.with_columns(
-    pl.Series(overweight_children["11_yearolds_overweight"]).alias("11_yearolds_overweight")
-)
-
-full_children_df = reception_children.join(y6_children[["la_name", "11_yearolds_overweight", "11_yearolds_obese"]], on = "la_name")
-# Adult Obesity Data
-adult_obesity=  pl.read_csv(file_path + "adult_obesity.csv", infer_schema_length= 10000)
-adult_obesity = adult_obesity.rename({
-    "Area Code":"la_code",
-    "Area Name":"la_name"
-})
-# Only want it at LA level
-adult_obesity = adult_obesity.filter(pl.col("Area Type") == "Districts & UAs (2020/21)")
-# I want the most recent data
-today_adult_obesity = adult_obesity.filter(pl.col("Time period") == "2021/22")
-historic_adult_obesity = adult_obesity.filter(pl.col("Time period") == "2015/16")
-
-
-
-overweight_adult = today_adult_obesity.filter(pl.col("Indicator ID") == 93088)
-obese_adult = today_adult_obesity.filter(pl.col("Indicator ID") == 93881)
-historic_overweight_adult = historic_adult_obesity.filter(pl.col("Indicator ID") == 93088)
-historic_obese_adult = historic_adult_obesity.filter(pl.col("Indicator ID") == 93881)
-
-overweight_adult = overweight_adult.rename({
-    "Value": "adults_overweight"
-})
-
-obese_adult = obese_adult.rename({
-    "Value": "adults_obese"
-})
-
-historic_overweight_adult = historic_overweight_adult.rename({
-    "Value": "historic_adults_overweight"
-})
-
-historic_obese_adult = historic_obese_adult.rename({
-    "Value": "historic_adults_obese"
-})
-
-adults = obese_adult.with_columns(
-    pl.Series(overweight_adult["adults_overweight"]).alias("adults_overweight")
-)
-adults = adults.with_columns(
-    pl.Series(historic_overweight_adult["historic_adults_overweight"]).alias("historic_adults_overweight")
-)
-adults = adults.with_columns(
-    pl.Series(historic_obese_adult["historic_adults_obese"]).alias("historic_adults_obese")
-)
-full_demographics_data = full_children_df.join(adults[["la_name","adults_overweight", "adults_obese", "historic_adults_overweight", "historic_adults_obese"]], on = "la_name")
-
-full_demographics_data = full_demographics_data.with_columns(
-    (pl.col("adults_overweight") - pl.col("historic_adults_overweight")).alias("overweight_change")
-)
-full_demographics_data = full_demographics_data.with_columns(
-    (pl.col("adults_obese") - pl.col("historic_adults_obese")).alias("obese_change")
-)
-full_demographics_data.write_csv(file_path + "model_data.csv")
\ No newline at end of file
+CHILDREN_AREA_TYPE = "Districts & UAs (from Apr 2023)"
+ADULTS_AREA_TYPE = "Districts & UAs (2020/21)"
+
+CHILDREN_INDICATORS = {
+    "Reception prevalence of overweight (including obesity)": "5_yearolds_overweight",
+    "Reception prevalence of obesity (including severe obesity)": "5_yearolds_obese",
+    "Year 6 prevalence of overweight (including obesity)": "11_yearolds_overweight",
+    "Year 6 prevalence of obesity (including severe obesity)": "11_yearolds_obese",
+}
+ADULT_INDICATORS = {
+    93088: "adults_overweight",
+    93881: "adults_obese",
+}
+# The Fingertips exports and what to take from each (see modules/indicator_panel.py)
+INDICATOR_SOURCES = {
+    "childhood_obesity.csv": {"indicator_column": "Indicator Name", "indicators": CHILDREN_INDICATORS, "area_type": CHILDREN_AREA_TYPE},
+    "adult_obesity.csv": {"indicator_column": "Indicator ID", "indicators": ADULT_INDICATORS, "area_type": ADULTS_AREA_TYPE},
+}
+
+
+def scan_deprivation(file_path = file_path):
+    """
+    A function which flags every LSOA in deprivation.csv with whether it has a BikePoint and whether it is in London.
+
+    Returns
+    --------
+    deprivation_data: LazyFrame
+        Columns lsoa, lsoa_name, la_code, la_name, rank, decile, bikepoint and london.
+    """
+    # Rename columns to make sense for graphs / joining
+    deprivation_data = data_store.scan(file_path + "deprivation.csv").select(
+        pl.col("LSOA code (2011)").alias("lsoa"),
+        pl.col("LSOA name (2011)").alias("lsoa_name"),
+        pl.col("Local Authority District code (2019)").alias("la_code"),
+        pl.col("Local Authority District name (2019)").alias("la_name"),
+        # The store has already made these numbers
+        pl.col("Index of Multiple Deprivation (IMD) Rank").alias("rank"),
+        pl.col("Index of Multiple Deprivation (IMD) Decile").alias("decile"),
+    )
+    # With vs without bikepoints
+    lsoas_with_bikepoints = (
+        data_store.scan(file_path + "la_counts.csv")
+        .select("lsoa")
+        .unique()
+        .with_columns(pl.lit(True).alias("bikepoint"))
+    )
+    return (
+        deprivation_data.join(lsoas_with_bikepoints, on = "lsoa", how = "left")
+        .with_columns(
+            pl.col("bikepoint").fill_null(False),
+            # London only
+            (pl.col("la_code").str.slice(0, 3) == "E09").alias("london"),
+        )
+    )
+
+
+def scan_la_bikepoints(deprivation_data):
+    """
+    A function which averages BikePoint presence and deprivation rank over the LSOAs of each London local authority.
+
+    Returns
+    --------
+    la_bikepoints: LazyFrame
+        Columns la_name, bikepoint (the share of LSOAs with a BikePoint), rank and bikepoint_binary.
+    """
+    return (
+        deprivation_data.filter(pl.col("london"))
+        .group_by("la_name")
+        .agg(pl.col("bikepoint").mean(), pl.col("rank").mean())
+        .with_columns((pl.col("bikepoint") != 0).alias("bikepoint_binary"))
+    )
+
+
+def scan_la_coverage(deprivation_data, file_path = file_path):
+    """
+    A function which averages how close each London local authority's LSOAs are to a BikePoint.
+
+    Returns
+    --------
+    la_coverage: LazyFrame or None
+        Columns la_name, nearest_bikepoint_m and bikepoints_within_500m, or None if data/lsoa_centroids.csv doesn't exist.
+    """
+    if not os.path.exists(file_path + "lsoa_centroids.csv"):
+        return None
+    coverage = station_coverage(
+        data_store.load(file_path + "lsoa_centroids.csv"),
+        data_store.load(file_path + "bikepoints.csv"),
+    )
+    return (
+        deprivation_data.filter(pl.col("london"))
+        .select("lsoa", "la_name")
+        .join(coverage.lazy(), on = "lsoa")
+        .group_by("la_name")
+        .agg(pl.exclude("lsoa").mean())
+    )
+
+
+def scan_indicator_panel(file_path = file_path):
+    """
+    A function which gathers every obesity indicator in every time period for the London local authorities.
+
+    Returns
+    --------
+    panel: LazyFrame
+        Columns la_name, indicator, period, year and value (see modules/indicator_panel.py).
+    """
+    london = scan_deprivation(file_path).filter(pl.col("london")).select("la_name").unique()
+    return (
+        scan_panel(file_path, INDICATOR_SOURCES)
+        .join(london, on = "la_name", how = "semi")
+        .sort("indicator", "year", "la_name")
+    )
+
+
+def build_model_data(file_path = file_path):
+    """
+    A function which builds the query joining deprivation, BikePoint presence and obesity by London local authority.
+
+    Returns
+    --------
+    full_demographics_data: LazyFrame
+        The query for model_data.csv, one row per London local authority.
+    """
+    deprivation_data = scan_deprivation(file_path)
+    la_bikepoints = scan_la_bikepoints(deprivation_data)
+    la_coverage = scan_la_coverage(deprivation_data, file_path)
+    panel = scan_panel(file_path, INDICATOR_SOURCES)
+    latest = wide_panel(panel, list(CHILDREN_INDICATORS.values()) + list(ADULT_INDICATORS.values()))
+    historic = wide_panel(panel, list(ADULT_INDICATORS.values()), HISTORIC_ADULTS_PERIOD, "historic_")
+    # Join them together
+    full_demographics_data = (
+        latest.join(la_bikepoints, on = "la_name")
+        .join(historic, on = "la_name")
+        .select(
+            "la_name", "5_yearolds_overweight", "5_yearolds_obese", "bikepoint", "rank", "bikepoint_binary",
+            "11_yearolds_overweight", "11_yearolds_obese", "adults_overweight", "adults_obese",
+            "historic_adults_overweight", "historic_adults_obese",
+            (pl.col("adults_overweight") - pl.col("historic_adults_overweight")).alias("overweight_change"),
+            (pl.col("adults_obese") - pl.col("historic_adults_obese")).alias("obese_change"),
+        )
+    )
+    if la_coverage is not None:
+        full_demographics_data = full_demographics_data.join(la_coverage, on = "la_name", how = "left")
+    return full_demographics_data
+
+
+def build_rollup_cube(file_path = file_path):
+    """
+    A function which builds the query summing BikePoints, deprivation and the latest obesity indicators from every
+    London LSOA up to its MSOA, local authority and London.
+
+    Returns
+    --------
+    cube: LazyFrame
+        The query for rollup_cube.csv (see modules/rollup_cube.py).
+    """
+    indicators = list(CHILDREN_INDICATORS.values()) + list(ADULT_INDICATORS.values())
+    lsoa_bikepoints = (
+        data_store.scan(file_path + "la_counts.csv")
+        .group_by("lsoa")
+        .agg(pl.col("count").sum().alias("bikepoints"))
+    )
+    lsoa_data = (
+        scan_deprivation(file_path).filter(pl.col("london"))
+        .join(lsoa_bikepoints, on = "lsoa", how = "left")
+        # Obesity is only published by local authority, so each LSOA gets its local authority's
+        .join(wide_panel(scan_panel(file_path, INDICATOR_SOURCES), indicators), on = "la_name", how = "left")
+        .select(
+            "lsoa", "lsoa_name", "la_name", pl.col("bikepoints").fill_null(0),
+            pl.col("rank").cast(pl.Float64), pl.col("decile").cast(pl.Float64), *indicators,
+        )
+    )
+    return scan_cube(lsoa_data, ["rank", "decile"] + indicators)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Clean and combine the data in data/ into model_data.csv.")
+    parser.add_argument("--explain", action = "store_true", help = "Print the optimised query plan.")
+    parser.add_argument("--timing", action = "store_true", help = "Print how long the query takes to run.")
+    parser.add_argument("--streaming", action = "store_true", help = "Run the query in batches on Polars' streaming engine, to bound memory use.")
+    parser.add_argument("--centroids", help = "A csv of LSOA centroids (columns lsoa, lat, lon) to save as data/lsoa_centroids.csv.")
+    parser.add_argument("--boundaries", help = "A GeoJSON of LSOA boundaries to derive data/lsoa_centroids.csv from.")
+    args = parser.parse_args()
+
+    if args.centroids:
+        with instrumentation.span("clean_data.centroids"):
+            centroids = pl.read_csv(args.centroids, columns = ["lsoa", "lat", "lon"])
+            data_store.write(centroids, file_path + "lsoa_centroids.csv")
+    elif args.boundaries:
+        with instrumentation.span("clean_data.centroids"):
+            data_store.write(centroids_from_boundaries(load_index(args.boundaries)), file_path + "lsoa_centroids.csv")
+
+    full_demographics_data = build_model_data(file_path)
+    panel = scan_indicator_panel(file_path)
+    cube = build_rollup_cube(file_path)
+    if args.explain:
+        print(full_demographics_data.explain())
+    start = time.perf_counter()
+    # Collected together, so the files both queries read are only scanned once
+    with instrumentation.span("clean_data.query"):
+        full_demographics_data, panel, cube = pl.collect_all([full_demographics_data, panel, cube], engine = engine(args.streaming))
+    if args.timing:
+        print(f"Cleaned {full_demographics_data.height} local authorities in {time.perf_counter() - start:.3f}s")
+    with instrumentation.span("clean_data.write", rows = full_demographics_data.height, panel_rows = panel.height, cube_rows = cube.height):
+        data_store.write(full_demographics_data, file_path + "model_data.csv")
+        data_store.write(panel, file_path + "indicator_panel.csv")
+        data_store.write(cube, file_path + "rollup_cube.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+collect_occupancy.py
+---------------------
+This script polls the TfL BikePoint feed on a schedule and records how many bikes and empty docks every
+BikePoint has, for operational analysis.
+The counts are stored in the data/occupancy/ folder (see modules/occupancy.py).
+
+It runs until stopped with Ctrl+C, writing out anything still buffered before it exits.
+"""
+import argparse
+
+from modules.occupancy import FLUSH_EVERY, collect
+
+# File path where data will be stored
+file_path = "data/"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Record BikePoint dock occupancy over time.")
+    parser.add_argument("--api", default = "https://api.tfl.gov.uk/BikePoint/", help = "The BikePoint feed to poll.")
+    parser.add_argument("--interval", type = float, default = 60, help = "Seconds between polls.")
+    parser.add_argument("--polls", type = int, help = "Stop after this many polls. Runs until stopped if not given.")
+    parser.add_argument("--flush-every", type = int, default = FLUSH_EVERY, help = "Polls kept in memory before they are written.")
+    args = parser.parse_args()
+
+    try:
+        rows = collect(args.api, file_path + "occupancy", args.interval, args.polls, args.flush_every)
+        print(f"Wrote {rows} rows.")
+    except KeyboardInterrupt:
+        print("Stopped.")
@@ -6,18 +6,39 @@ These are all stored in the Data/ folder.
 
 This is performed in advance of the model's run to make sure the data is quickly available.
 """
-import requests
+import argparse
+import os
+
 import urllib3
 import polars as pl
 
+from modules import data_store, instrumentation
+from modules.bikepoint_feed import fetch_bikepoints, load_validators, save_validators
+from modules.geocode_cache import load_cache, lsoa_counts, save_cache, stations_to_lookup, update_cache
+from modules.geocoding import reverse_geocode
+from modules.out_of_core import CHUNK_ROWS, count_stations, locate_stations
+from modules.spatial_join import count_lsoas, load_index
+
 urllib3.disable_warnings()
 # File path where data will be stored
 file_path = "data/"
 
+def read_previous_bikepoints():
+    """
+    Reads the bikepoints.csv left by the previous run, before get_bikepoints overwrites it. Returns None on the first run.
+    """
+    if not os.path.exists(file_path + "bikepoints.csv"):
+        return None
+    return data_store.load(file_path + "bikepoints.csv")
+
+@instrumentation.timed()
 def get_bikepoints(bikepoint_api):
     """
     A function which visits the bikepoint_api and both returns the data as a dataframe and outputs it to a csv.
 
+    The request is conditional on the ETag / Last-Modified of the previous download, and the csv is only
+    rewritten if the stations themselves have changed (the feed also changes whenever dock counts do).
+
     Parameters
     ----------
     bikepoint_api: str
@@ -27,83 +48,206 @@ def get_bikepoints(bikepoint_api):
     --------
     cycle_dataframe: dataframe
         A dataframe of all the data at the API except "additionalProperties".
+    changed: bool
+        Whether the stations differ from the previous bikepoints.csv.
     
     Raises
     ------
     Type Error
         If input is not str.
     Index Error
-        If there is something wrong with the API and it does not return code 200.
+        If there is something wrong with the API and it does not return code 200 or 304.
     
     # TODO: Consider changing column names to underscore_style for neatness of output.
     """
     if type(bikepoint_api) != str:
         raise TypeError("The API must be a string.")
 
-    r = requests.get(bikepoint_api)
-    if r.status_code == 200:
-        bikepoints = pl.read_json(r.content)
-    else:
-        raise IndexError(f"API Error: {r.status_code}")
-    bikepoints = bikepoints.drop("additionalProperties")
-    bikepoints.write_csv(file = file_path + "bikepoints.csv")
-    return bikepoints
+    meta_path = file_path + "bikepoints_meta.json"
+    previous_bikepoints = read_previous_bikepoints()
+    # Only ask for a 304 if there is a previous download to fall back on
+    validators = load_validators(meta_path, bikepoint_api) if previous_bikepoints is not None else {}
+    bikepoints, headers = fetch_bikepoints(bikepoint_api, validators)
+    if bikepoints is None:
+        return previous_bikepoints, False
 
-bikepoint_dataframe = get_bikepoints("https://api.tfl.gov.uk/BikePoint/")
+    changed = previous_bikepoints is None or not bikepoints.sort("id").equals(previous_bikepoints.sort("id"))
+    if changed:
+        data_store.write(bikepoints, file_path + "bikepoints.csv")
+    save_validators(meta_path, bikepoint_api, headers)
+    return bikepoints, changed
 
-def lat_long_translate(postcodes_api, bikepoints):
+@instrumentation.timed()
+def lat_long_translate(postcodes_api, bikepoints, max_workers = 4):
     """
-    A function which takes a dataframe of latitudes and logitudes and counts how many are in each local authority.
+    A function which takes a dataframe of latitudes and logitudes and counts how many are in each LSOA.
 
     Parameters
     ----------
-    postcodes: str
+    postcodes_api: str
         The API where the postcode translation is available. Usually https://api.postcodes.io/postcodes
     bikepoints: dataframe
         The dataframe containing all the latitudes and logitudes of the dataframe
+    max_workers: int
+        The maximum number of 100-point batches sent to the API at once.
     
     Returns
     --------
     la_dataframe: dataframe
-        A dataframe with two columns: la_name and counts
+        A dataframe with two columns: lsoa and count
     
     Raises
     ------
     Type Error
         If postcodes_api is not str.
+    Index Error
+        If the API still fails after retrying.
     
-    # TODO: There must be a neater way of doing this. Come back if time.
     # TODO: Make it work with polars and pandas dataframes
     """
     if type(postcodes_api) != str:
         raise TypeError("The API must be a string.")
-    list_of_locations = list(zip(list(bikepoints["lat"]), list(bikepoints["lon"])))
-    las = {}
-    for loop in range(0, int(len(list_of_locations)/100)):
-        # The API wants the information in a list of dictionaries, each of which has an individual logitude / latitude
-        request_list = []
-        # The API only handles inputs in batches of 100
-        for location in list_of_locations[loop*100: loop*100 + 100]:
-            loc_dict = {
-                "longitude":  location[1],
-                "latitude": location[0],
-                "limit":1,
-                "radius":300,
-            }
-            request_list.append(loc_dict)
-        request_dict = {
-            "geolocations" : request_list
-            }
-        r = requests.post(postcodes_api, json = request_dict, verify = False)
-        for i in range(0, 100):
-            raw_data = r.json()["result"][i]["result"][0].pop("codes")
-            this_location = pl.DataFrame(raw_data)
-            if "parliamentary_constituency" in this_location.columns:
-                las.setdefault(this_location["lsoa"][0], 0)
-                las[this_location["lsoa"][0]] += 1
-    la_table = pl.DataFrame(las)
-    la_table = la_table.transpose(include_header=True, header_name="lsoa", column_names = ["count"])
-    la_table.write_csv(file = file_path + "la_counts.csv", separator= ",")
+    lsoas = reverse_geocode(postcodes_api, bikepoints["lat"], bikepoints["lon"], max_workers = max_workers)
+    la_table = (
+        pl.DataFrame({"lsoa": lsoas}, schema = {"lsoa": pl.Utf8})
+        .drop_nulls()
+        .group_by("lsoa", maintain_order = True)
+        .agg(pl.len().alias("count"))
+    )
+    data_store.write(la_table, file_path + "la_counts.csv")
+    return la_table
+
+@instrumentation.timed()
+def lat_long_spatial_join(boundary_path, bikepoints):
+    """
+    The offline equivalent of lat_long_translate: assigns each BikePoint to the LSOA polygon containing it.
+
+    Parameters
+    ----------
+    boundary_path: str
+        A GeoJSON file of LSOA boundaries in WGS84. A prebuilt index is cached next to it.
+    bikepoints: dataframe
+        The dataframe containing all the latitudes and logitudes of the dataframe
+
+    Returns
+    --------
+    la_dataframe: dataframe
+        A dataframe with two columns: lsoa and count
+
+    Raises
+    ------
+    Type Error
+        If boundary_path is not str.
+    """
+    if type(boundary_path) != str:
+        raise TypeError("The boundary path must be a string.")
+    la_table = count_lsoas(load_index(boundary_path), bikepoints["lat"], bikepoints["lon"])
+    data_store.write(la_table, file_path + "la_counts.csv")
     return la_table
 
-la_counts_dataframe = lat_long_translate("https://api.postcodes.io/postcodes", bikepoint_dataframe)
\ No newline at end of file
+@instrumentation.timed()
+def refresh_la_counts(bikepoints, previous_bikepoints, lookup, source):
+    """
+    A function which rebuilds la_counts.csv from the geocode cache, only looking up stations which are new or have moved.
+
+    Parameters
+    ----------
+    bikepoints: dataframe
+        The freshly downloaded BikePoints.
+    previous_bikepoints: dataframe or None
+        The BikePoints from the previous run, from read_previous_bikepoints.
+    lookup: function
+        Takes sequences of latitudes and longitudes and returns the LSOA of each, or None.
+    source: str
+        Identifies what lookup uses (the API URL or boundary file path, relative or absolute). A cache from a
+        different source is discarded.
+
+    Returns
+    --------
+    la_dataframe: dataframe
+        A dataframe with two columns: lsoa and count
+    """
+    cache_path = file_path + "geocode_cache.json"
+    cache = load_cache(cache_path, source)
+    to_lookup = stations_to_lookup(bikepoints, previous_bikepoints, cache)
+    # A refresh where no station has changed makes no lookups at all
+    lsoas = lookup(to_lookup["lat"].to_numpy(), to_lookup["lon"].to_numpy()) if len(to_lookup) > 0 else []
+    to_lookup = to_lookup.with_columns(pl.Series("lsoa", lsoas, dtype = pl.Utf8))
+    cache = update_cache(cache, bikepoints, to_lookup)
+    save_cache(cache, cache_path, source)
+    la_table = lsoa_counts(cache)
+    data_store.write(la_table, file_path + "la_counts.csv")
+    return la_table
+
+@instrumentation.timed()
+def count_station_table(station_path, chunk_rows = CHUNK_ROWS, boundary_path = None):
+    """
+    A function which counts the stations of a large local table per LSOA, reading it chunk_rows stations at a time,
+    for data too big for the API route (e.g. every UK bike share scheme).
+
+    With a boundary file each station is located in the LSOA polygon it is in, as in lat_long_spatial_join.
+    Without one each station goes to the LSOA with the nearest centroid in data/lsoa_centroids.csv, which is only
+    approximate near LSOA boundaries; stations more than out_of_core.MAX_CENTROID_DISTANCE_M from every centroid
+    aren't counted.
+
+    Parameters
+    ----------
+    station_path: str
+        An Arrow IPC file, or folder of them, with lat and lon columns.
+    chunk_rows: int
+        The number of stations held in memory at once.
+    boundary_path: str or None
+        A GeoJSON file of LSOA boundaries in WGS84.
+
+    Returns
+    --------
+    la_dataframe: dataframe
+        A dataframe with two columns: lsoa and count
+
+    Raises
+    ------
+    File Not Found Error
+        If there is no boundary file and data/lsoa_centroids.csv doesn't exist (see clean_data.py --centroids).
+    """
+    if boundary_path is not None:
+        la_table = locate_stations(station_path, load_index(boundary_path), chunk_rows)
+    elif os.path.exists(file_path + "lsoa_centroids.csv"):
+        la_table = count_stations(station_path, data_store.load(file_path + "lsoa_centroids.csv"), chunk_rows)
+    else:
+        raise FileNotFoundError("Counting a station table needs --boundaries or data/lsoa_centroids.csv (see clean_data.py --centroids).")
+    data_store.write(la_table, file_path + "la_counts.csv")
+    return la_table
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Download the BikePoint data and count BikePoints per LSOA.")
+    parser.add_argument("--boundaries", help = "GeoJSON of LSOA boundaries. If given, LSOAs are assigned offline instead of through postcodes.io.")
+    parser.add_argument("--no-cache", action = "store_true", help = "Geocode every BikePoint rather than only new or moved ones.")
+    parser.add_argument("--stations", help = "An Arrow IPC file or folder of stations (lat, lon) to count per LSOA instead of the TfL feed, in chunks. "
+                        "Located in the --boundaries if given, otherwise approximately, by the nearest centroid in data/lsoa_centroids.csv.")
+    parser.add_argument("--chunk-rows", type = int, default = CHUNK_ROWS, help = "Stations read at a time with --stations.")
+    args = parser.parse_args()
+
+    if args.stations:
+        la_counts_dataframe = count_station_table(args.stations, args.chunk_rows, args.boundaries)
+    else:
+        previous_bikepoint_dataframe = read_previous_bikepoints()
+        bikepoint_dataframe, bikepoints_changed = get_bikepoints("https://api.tfl.gov.uk/BikePoint/")
+        if not bikepoints_changed and not args.no_cache and os.path.exists(file_path + "la_counts.csv"):
+            print("BikePoints unchanged, la_counts.csv is up to date.")
+        elif args.no_cache and args.boundaries:
+            la_counts_dataframe = lat_long_spatial_join(args.boundaries, bikepoint_dataframe)
+        elif args.no_cache:
+            la_counts_dataframe = lat_long_translate("https://api.postcodes.io/postcodes", bikepoint_dataframe)
+        elif args.boundaries:
+            la_counts_dataframe = refresh_la_counts(
+                bikepoint_dataframe, previous_bikepoint_dataframe,
+                lambda lats, lons: load_index(args.boundaries).locate(lats, lons),
+                source = args.boundaries,
+            )
+        else:
+            postcodes_api = "https://api.postcodes.io/postcodes"
+            la_counts_dataframe = refresh_la_counts(
+                bikepoint_dataframe, previous_bikepoint_dataframe,
+                lambda lats, lons: reverse_geocode(postcodes_api, lats, lons),
+                source = postcodes_api,
+            )
@@ -0,0 +1,107 @@
+"""
+bikepoint_feed.py
+------------------
+Conditional download of the TfL BikePoint feed, parsed with a typed schema.
+
+The feed is mostly "additionalProperties" (dock counts etc.), which get_data.py doesn't keep.
+The response body is read into memory whole (a few MB) and parsed by Polars' JSON reader with an explicit
+schema, so those objects are skipped rather than built into a column and dropped, and no schema has to be
+inferred. The ETag / Last-Modified of the last download are sent back so an unchanged feed costs a 304.
+"""
+import json
+import os
+
+import polars as pl
+import requests
+
+# The top-level fields of each BikePoint, in feed order. Anything else is skipped while parsing.
+BIKEPOINT_SCHEMA = {
+    "$type": pl.Utf8,
+    "id": pl.Utf8,
+    "url": pl.Utf8,
+    "commonName": pl.Utf8,
+    "placeType": pl.Utf8,
+    "lat": pl.Float64,
+    "lon": pl.Float64,
+}
+
+
+def parse_bikepoints(stream):
+    """
+    Reads the BikePoints from a file-like JSON stream, keeping only the fields in BIKEPOINT_SCHEMA.
+    The stream is read to the end before parsing, so the whole response is held in memory at once.
+
+    Returns
+    --------
+    bikepoints: dataframe
+        One row per BikePoint.
+    """
+    return pl.read_json(stream, schema = BIKEPOINT_SCHEMA)
+
+
+def load_validators(meta_path, bikepoint_api):
+    """
+    Reads the ETag / Last-Modified saved from the last download of bikepoint_api, or an empty dict.
+    """
+    if not os.path.exists(meta_path):
+        return {}
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    if meta.get("url") != bikepoint_api:
+        return {}
+    return meta
+
+
+def save_validators(meta_path, bikepoint_api, headers):
+    """
+    Saves the ETag / Last-Modified of a download so the next one can be conditional.
+    """
+    meta = {
+        "url": bikepoint_api,
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+
+
+def fetch_bikepoints(bikepoint_api, validators = None, timeout = 60):
+    """
+    Downloads the BikePoint feed, unless it hasn't changed since the download validators came from.
+
+    Parameters
+    ----------
+    bikepoint_api: str
+        The API where the bikepoint data is available. Usually https://api.tfl.gov.uk/BikePoint/
+    validators: dict
+        The "etag" and / or "last_modified" of the previous download, if any.
+    timeout: float
+        Seconds to wait for the server.
+
+    Returns
+    --------
+    bikepoints: dataframe or None
+        The BikePoints without "additionalProperties", or None if the server answered 304 Not Modified.
+    headers: dict
+        The response headers, to pass to save_validators.
+
+    Raises
+    ------
+    Index Error
+        If the API returns anything other than 200 or 304.
+    """
+    validators = validators or {}
+    request_headers = {}
+    if validators.get("etag"):
+        request_headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        request_headers["If-Modified-Since"] = validators["last_modified"]
+
+    with requests.get(bikepoint_api, headers = request_headers, stream = True, timeout = timeout) as r:
+        if r.status_code == 304:
+            return None, r.headers
+        if r.status_code != 200:
+            raise IndexError(f"API Error: {r.status_code}")
+        # Let urllib3 undo any gzip / deflate transfer encoding as we read
+        r.raw.decode_content = True
+        return parse_bikepoints(r.raw), r.headers
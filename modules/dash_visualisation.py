@@ -1,10 +1,118 @@
 """
-dash_modules.py
-----------------
+dash_visualisation.py
+----------------------
+Helpers for serving the Dash app: opening the browser, serving precompressed static files and compressing responses.
 """
+import gzip
+import hashlib
+import mimetypes
+import threading
 import webbrowser
 import os
+from collections import OrderedDict
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    # Optional: without it everything is gzipped instead
+    brotli = None
+
+mimetypes.add_type("application/geo+json", ".geojson")
+
+# Responses worth compressing: the page, layout, callback results, Dash's JavaScript and the map files
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/geo+json")
+# A year, for files whose URL changes whenever they do
+IMMUTABLE_MAX_AGE = 31536000
 
 def open_browser():
     if not os.environ.get("WERKZEUG_RUN_MAIN"):
-        webbrowser.open_new('http://127.0.0.1:1222/')
\ No newline at end of file
+        webbrowser.open_new('http://127.0.0.1:1222/')
+
+def serve_directory(app, url_prefix, directory, max_age = 86400):
+    """
+    Serves the files in directory from the Dash app's Flask server at url_prefix.
+    Where a brotli (name + ".br") or gzipped (name + ".gz") copy exists and the browser accepts it, that is sent instead.
+    Requests with a version (?v=...) in the URL are cached for a year, as a new version gets a new URL.
+    """
+    directory = os.path.abspath(directory)
+
+    def serve(name):
+        mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        max_age_now = IMMUTABLE_MAX_AGE if request.args.get("v") else max_age
+        for encoding, suffix in [("br", ".br"), ("gzip", ".gz")]:
+            if encoding in request.accept_encodings and os.path.exists(os.path.join(directory, name + suffix)):
+                response = send_from_directory(directory, name + suffix, mimetype = mimetype, max_age = max_age_now)
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = send_from_directory(directory, name, mimetype = mimetype, max_age = max_age_now)
+        response.headers["Vary"] = "Accept-Encoding"
+        response.cache_control.public = True
+        if max_age_now == IMMUTABLE_MAX_AGE:
+            response.cache_control.immutable = True
+        return response
+
+    app.server.add_url_rule(url_prefix + "/<path:name>", endpoint = "serve" + url_prefix.replace("/", "_"), view_func = serve)
+
+
+def compress_responses(app, min_size = 1024, cache_size = 64):
+    """
+    Compresses the Dash app's responses (page, layout, callbacks and Dash's own JavaScript) with brotli if it is
+    installed and the browser accepts it, otherwise gzip.
+
+    Most large responses are the same every time (the layout, the JavaScript bundles), so compressed bodies are
+    kept by a hash of their contents and only compressed once.
+
+    Parameters
+    ----------
+    app: Dash
+        The app to compress the responses of.
+    min_size: int
+        Responses smaller than this many bytes aren't worth compressing.
+    cache_size: int
+        How many compressed bodies to keep.
+    """
+    cache = OrderedDict()
+    lock = threading.Lock()
+
+    def compressed(body, encoding):
+        key = (encoding, hashlib.blake2b(body, digest_size = 16).digest())
+        with lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+        if encoding == "br":
+            result = brotli.compress(body, quality = 5)
+        else:
+            result = gzip.compress(body, compresslevel = 6)
+        with lock:
+            cache[key] = result
+            if len(cache) > cache_size:
+                cache.popitem(last = False)
+        return result
+
+    @app.server.after_request
+    def compress(response):
+        # Files sent from disk stream past this, and serve_directory already compresses those
+        if (
+            response.status_code != 200
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or not (response.mimetype or "").startswith(COMPRESSIBLE_TYPES)
+        ):
+            return response
+        body = response.get_data()
+        if len(body) < min_size:
+            return response
+        if brotli is not None and "br" in request.accept_encodings:
+            encoding = "br"
+        elif "gzip" in request.accept_encodings:
+            encoding = "gzip"
+        else:
+            return response
+        response.set_data(compressed(body, encoding))
+        response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        return response
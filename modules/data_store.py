@@ -0,0 +1,150 @@
+"""
+data_store.py
+--------------
+Typed Arrow IPC copies of the csvs in data/, so each csv is only parsed once.
+
+The first time a csv is read through this module it is parsed, typed (e.g. thousands separators stripped
+from the deprivation rank) and written to data/store/ as an Arrow IPC file. Later reads memory-map that file
+instead of parsing text. A copy is rebuilt whenever the content hash of its csv changes.
+"""
+import hashlib
+import json
+import os
+
+import polars as pl
+
+# Bump when the conversion below changes, so existing copies are rebuilt
+STORE_VERSION = 1
+
+# Columns written with thousands separators, which are stored as integers
+THOUSANDS_COLUMNS = {
+    "deprivation.csv": ["Index of Multiple Deprivation (IMD) Rank"],
+}
+
+
+def _store_dir(csv_path):
+    return os.path.join(os.path.dirname(csv_path), "store")
+
+
+def _ipc_file(csv_path):
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(_store_dir(csv_path), name + ".arrow")
+
+
+def _write_ipc(data, path):
+    # Uncompressed, so the file can be memory-mapped
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    data.write_ipc(path + ".tmp", compression = "uncompressed")
+    os.replace(path + ".tmp", path)
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Each copy has its own entry file rather than sharing one manifest, so pipeline stages running in
+# parallel processes can't overwrite each other's entries
+def _entry_path(csv_path):
+    return os.path.splitext(_ipc_file(csv_path))[0] + ".json"
+
+
+def _read_entry(csv_path):
+    entry_path = _entry_path(csv_path)
+    if not os.path.exists(entry_path):
+        return None
+    with open(entry_path, "r") as f:
+        return json.load(f)
+
+
+def _parse_csv(csv_path):
+    """
+    Reads a csv with its types inferred from every row, converting any thousands-separated columns to integers.
+    """
+    name = os.path.basename(csv_path)
+    thousands = THOUSANDS_COLUMNS.get(name, [])
+    data = pl.read_csv(csv_path, infer_schema_length = None, schema_overrides = {col: pl.Utf8 for col in thousands})
+    return data.with_columns(pl.col(col).str.replace_all(",", "").cast(pl.Int64) for col in thousands)
+
+
+def _record(csv_path, csv_hash):
+    entry_path = _entry_path(csv_path)
+    stat = os.stat(csv_path)
+    entry = {"hash": csv_hash, "size": stat.st_size, "mtime": stat.st_mtime, "version": STORE_VERSION}
+    with open(entry_path + ".tmp", "w") as f:
+        json.dump(entry, f)
+    os.replace(entry_path + ".tmp", entry_path)
+
+
+def ipc_path(csv_path):
+    """
+    A function which returns the Arrow IPC copy of a csv, creating or rebuilding it if the csv has changed.
+
+    The csv is only hashed when its size or modification time differ from when the copy was made.
+
+    Parameters
+    ----------
+    csv_path: str
+        A csv in data/.
+
+    Returns
+    --------
+    ipc_path: str
+        The path of the up to date Arrow IPC file.
+
+    Raises
+    ------
+    File Not Found Error
+        If the csv doesn't exist.
+    """
+    path = _ipc_file(csv_path)
+    stat = os.stat(csv_path)
+    entry = _read_entry(csv_path)
+
+    if entry is not None and entry["version"] == STORE_VERSION and os.path.exists(path):
+        if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return path
+        csv_hash = _file_hash(csv_path)
+        if entry["hash"] == csv_hash:
+            # Touched but not changed
+            _record(csv_path, csv_hash)
+            return path
+    else:
+        csv_hash = _file_hash(csv_path)
+
+    _write_ipc(_parse_csv(csv_path), path)
+    _record(csv_path, csv_hash)
+    return path
+
+
+def copy_path(csv_path):
+    """
+    Where the typed copy of a csv is kept, whether or not it has been made yet.
+    """
+    return _ipc_file(csv_path)
+
+
+def scan(csv_path):
+    """
+    A function which lazily scans the typed copy of a csv, so only the columns and rows a query uses are read.
+    """
+    return pl.scan_ipc(ipc_path(csv_path))
+
+
+def load(csv_path):
+    """
+    A function which loads the typed copy of a csv as a dataframe. Polars memory-maps IPC files by default.
+    """
+    return pl.read_ipc(ipc_path(csv_path))
+
+
+def write(data, csv_path):
+    """
+    A function which writes a dataframe to a csv and its typed copy at the same time, so it is never re-parsed.
+    """
+    data.write_csv(csv_path)
+    _write_ipc(data, _ipc_file(csv_path))
+    _record(csv_path, _file_hash(csv_path))
@@ -0,0 +1,130 @@
+"""
+geocode_cache.py
+-----------------
+An on-disk cache of the LSOA each BikePoint was geocoded to, so get_data.py only looks up new or moved stations.
+
+The cache is a JSON file holding a format version, the source that produced the LSOAs
+(the postcodes API or a boundary file) and one entry per station id with the coordinates it was looked up at.
+A cache written by another version or source is ignored and rebuilt from scratch.
+"""
+import json
+import os
+
+import polars as pl
+
+# Bump when the layout of the cache file changes
+CACHE_VERSION = 1
+# The BikePoint feed gives coordinates to 6 decimal places
+COORDINATE_PRECISION = 6
+
+CACHE_SCHEMA = {"id": pl.Utf8, "lat": pl.Float64, "lon": pl.Float64, "lsoa": pl.Utf8}
+
+
+def _stations(bikepoints):
+    """
+    The id, lat and lon of each station, with coordinates rounded so CSV round-trips compare equal.
+    """
+    return bikepoints.select(
+        pl.col("id").cast(pl.Utf8),
+        pl.col("lat").cast(pl.Float64).round(COORDINATE_PRECISION),
+        pl.col("lon").cast(pl.Float64).round(COORDINATE_PRECISION),
+    )
+
+
+def _source_key(source):
+    """
+    The source as saved in the cache: boundary files by absolute path, so relative and absolute spellings of the
+    same file (or the same relative path from another directory) are told apart correctly. URLs are kept as they are.
+    """
+    if "://" in source:
+        return source
+    return os.path.abspath(source)
+
+
+def load_cache(cache_path, source):
+    """
+    Reads the cache, returning an empty one if it is missing or was written by a different version or source.
+
+    Returns
+    --------
+    cache: dataframe
+        A dataframe with columns id, lat, lon and lsoa (null where the station has no LSOA).
+    """
+    empty = pl.DataFrame(schema = CACHE_SCHEMA)
+    if not os.path.exists(cache_path):
+        return empty
+    with open(cache_path, "r") as f:
+        saved = json.load(f)
+    if saved.get("version") != CACHE_VERSION or saved.get("source") != _source_key(source):
+        return empty
+    return pl.DataFrame(saved["entries"], schema = CACHE_SCHEMA)
+
+
+def save_cache(cache, cache_path, source):
+    """
+    Writes the cache atomically so an interrupted run can't leave a half-written file.
+    """
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": CACHE_VERSION, "source": _source_key(source), "entries": cache.to_dicts()}, f)
+    os.replace(tmp_path, cache_path)
+
+
+def stations_to_lookup(bikepoints, previous_bikepoints, cache):
+    """
+    Finds the stations which are new or have moved since the previous bikepoints.csv, or aren't cached at the right coordinates.
+
+    Parameters
+    ----------
+    bikepoints: dataframe
+        The freshly downloaded BikePoints.
+    previous_bikepoints: dataframe or None
+        The bikepoints.csv from the previous run, if there was one.
+    cache: dataframe
+        The cache returned by load_cache.
+
+    Returns
+    --------
+    stations: dataframe
+        The id, lat and lon of every station that needs geocoding.
+    """
+    current = _stations(bikepoints)
+    unchanged = cache.select("id", "lat", "lon")
+    if previous_bikepoints is not None:
+        unchanged = unchanged.join(_stations(previous_bikepoints), on = ["id", "lat", "lon"], how = "semi")
+    return current.join(unchanged, on = ["id", "lat", "lon"], how = "anti")
+
+
+def update_cache(cache, bikepoints, looked_up):
+    """
+    Merges freshly geocoded stations into the cache and evicts stations no longer in the feed.
+
+    Parameters
+    ----------
+    cache: dataframe
+        The cache returned by load_cache.
+    bikepoints: dataframe
+        The freshly downloaded BikePoints. Only these stations are kept.
+    looked_up: dataframe
+        The id, lat, lon and lsoa of the stations that were just geocoded.
+
+    Returns
+    --------
+    cache: dataframe
+        The new cache, in the same order as bikepoints.
+    """
+    kept = cache.join(looked_up.select("id"), on = "id", how = "anti")
+    merged = pl.concat([kept, looked_up.select(list(CACHE_SCHEMA)).cast(CACHE_SCHEMA)])
+    return _stations(bikepoints).join(merged, on = ["id", "lat", "lon"], how = "inner", maintain_order = "left")
+
+
+def lsoa_counts(cache):
+    """
+    Counts how many cached stations are in each LSOA, in the lsoa,count layout of la_counts.csv.
+    """
+    return (
+        cache.select("lsoa")
+        .drop_nulls()
+        .group_by("lsoa", maintain_order = True)
+        .agg(pl.len().alias("count"))
+    )
@@ -0,0 +1,136 @@
+"""
+geocoding.py
+-------------
+Batched reverse geocoding of latitudes / longitudes against postcodes.io.
+
+Points are sent in batches of 100 (the API limit) over a single pooled session,
+with a bounded number of batches in flight at once.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import polars as pl
+import requests
+from requests.adapters import HTTPAdapter
+
+from modules import instrumentation
+
+# The API only handles inputs in batches of 100
+BATCH_SIZE = 100
+# Rate limiting and server-side errors are worth retrying, anything else is not
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# The parts of each point's result that are kept: the codes of its nearest postcode, if any
+RESULT_SCHEMA = {
+    "result": pl.List(pl.Struct({"codes": pl.Struct({"lsoa": pl.Utf8, "parliamentary_constituency": pl.Utf8})})),
+}
+
+
+def make_session(max_workers = 4):
+    """
+    Creates a requests session whose connection pool is large enough for max_workers concurrent batches.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@instrumentation.timed("geocoding.batch")
+def _post_batch(session, postcodes_api, lats, lons, max_retries, backoff, timeout):
+    """
+    Sends one batch to the API, retrying with exponential backoff on 429 / 5xx.
+    Returns the LSOA code of every point in the batch, or None where there is no match.
+    """
+    # The API wants the information in a list of dictionaries, each of which has an individual logitude / latitude
+    request_dict = {
+        "geolocations": [
+            {"longitude": lon, "latitude": lat, "limit": 1, "radius": 300}
+            for lat, lon in zip(lats, lons)
+        ]
+    }
+    for attempt in range(max_retries + 1):
+        r = session.post(postcodes_api, json = request_dict, verify = False, timeout = timeout)
+        if r.status_code == 200:
+            break
+        if r.status_code not in RETRY_STATUSES or attempt == max_retries:
+            raise IndexError(f"API Error: {r.status_code}")
+        instrumentation.count("geocoding.retries")
+        retry_after = r.headers.get("Retry-After", "")
+        time.sleep(float(retry_after) if retry_after.isdigit() else backoff * 2 ** attempt)
+
+    codes = pl.col("result").list.first().struct.field("codes")
+    lsoas = (
+        pl.from_dicts(r.json()["result"], schema = RESULT_SCHEMA)
+        # Only keep points which resolve to a full UK postcode
+        .select(pl.when(codes.struct.field("parliamentary_constituency").is_not_null()).then(codes.struct.field("lsoa")))
+        .to_series()
+        .to_list()
+    )
+    if len(lsoas) != len(lats):
+        raise IndexError(f"API Error: expected {len(lats)} results, got {len(lsoas)}")
+    return lsoas
+
+
+def reverse_geocode(postcodes_api, lats, lons, max_workers = 4, max_retries = 3, backoff = 0.5, timeout = 30, session = None):
+    """
+    A function which looks up the LSOA of every latitude / longitude pair.
+
+    Parameters
+    ----------
+    postcodes_api: str
+        The API where the postcode translation is available. Usually https://api.postcodes.io/postcodes
+    lats, lons: sequence of float
+        The latitudes and longitudes to look up. Must be the same length.
+    max_workers: int
+        The maximum number of batches in flight at once.
+    max_retries: int
+        How many times a batch is retried after a 429 or 5xx response.
+    backoff: float
+        Seconds to wait before the first retry, doubling each time. A Retry-After header takes precedence.
+    timeout: float
+        Seconds to wait for each response.
+    session: requests.Session
+        An existing session to reuse. One is created (and closed) if not given.
+
+    Returns
+    --------
+    lsoas: list
+        The LSOA code of each point, in input order, or None where the point has no postcode.
+
+    Raises
+    ------
+    Type Error
+        If postcodes_api is not str.
+    Value Error
+        If lats and lons are different lengths.
+    Index Error
+        If a batch still fails after all retries.
+    """
+    if type(postcodes_api) != str:
+        raise TypeError("The API must be a string.")
+    lats = np.asarray(lats, dtype = np.float64)
+    lons = np.asarray(lons, dtype = np.float64)
+    if len(lats) != len(lons):
+        raise ValueError("lats and lons must be the same length.")
+
+    own_session = session is None
+    if own_session:
+        session = make_session(max_workers)
+    # Include the final, partial batch
+    starts = range(0, len(lats), BATCH_SIZE)
+    try:
+        with ThreadPoolExecutor(max_workers = max_workers) as pool:
+            batches = pool.map(
+                lambda start: _post_batch(
+                    session, postcodes_api,
+                    lats[start: start + BATCH_SIZE], lons[start: start + BATCH_SIZE],
+                    max_retries, backoff, timeout,
+                ),
+                starts,
+            )
+            return [lsoa for batch in batches for lsoa in batch]
+    finally:
+        if own_session:
+            session.close()
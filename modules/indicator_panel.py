@@ -0,0 +1,125 @@
+"""
+indicator_panel.py
+-------------------
+Gathers every indicator, time period and area of the Fingertips exports into one long table.
+
+Each export is scanned once and reshaped into one row per area, indicator and time period, so a new year of data
+is picked up without any code changes. Tables with one column per indicator for a chosen period are pivoted from
+the panel by key, rather than by filtering it once for each indicator and period.
+"""
+import polars as pl
+
+from modules import data_store
+
+# Stands for the most recent period of each indicator
+LATEST = "latest"
+
+
+def scan_source(csv_path, indicator_column, indicators, area_type):
+    """
+    A function which reshapes the chosen indicators of a Fingertips export into the panel's long format.
+
+    Parameters
+    ----------
+    csv_path: str
+        The Fingertips csv to read.
+    indicator_column: str
+        The column identifying the indicator, e.g. "Indicator Name" or "Indicator ID".
+    indicators: dict
+        Maps each indicator to the name it should have.
+    area_type: str
+        The "Area Type" to keep, so England / regional rows are dropped.
+
+    Returns
+    --------
+    panel: LazyFrame
+        Columns la_name, indicator, period (the "Time period", e.g. "2021/22"), year (the year the period starts) and value.
+    """
+    return (
+        data_store.scan(csv_path)
+        .filter((pl.col("Area Type") == area_type) & pl.col(indicator_column).is_in(list(indicators)))
+        .select(
+            pl.col("Area Name").alias("la_name"),
+            pl.col(indicator_column).replace_strict(indicators, return_dtype = pl.Utf8).alias("indicator"),
+            pl.col("Time period").cast(pl.Utf8).alias("period"),
+            pl.col("Time period").cast(pl.Utf8).str.slice(0, 4).cast(pl.Int32, strict = False).alias("year"),
+            pl.col("Value").cast(pl.Float64).alias("value"),
+        )
+    )
+
+
+def scan_panel(file_path, sources):
+    """
+    A function which stacks the panels of several Fingertips exports.
+
+    Parameters
+    ----------
+    file_path: str
+        The folder the exports are in.
+    sources: dict
+        Maps each export's file name to the other arguments of scan_source.
+
+    Returns
+    --------
+    panel: LazyFrame
+        See scan_source.
+    """
+    return pl.concat([scan_source(file_path + csv_name, **source) for csv_name, source in sources.items()])
+
+
+def wide_panel(panel, indicators, period = LATEST, prefix = ""):
+    """
+    A function which pivots one time period of the panel into a column per indicator, by local authority.
+
+    Parameters
+    ----------
+    panel: LazyFrame
+        From scan_panel.
+    indicators: list of str
+        The indicators to keep, in the order their columns should be in.
+    period: str
+        The "Time period" to keep, or LATEST for the most recent period of each indicator.
+    prefix: str
+        Put in front of each indicator's column name, e.g. "historic_".
+
+    Returns
+    --------
+    indicator_data: LazyFrame
+        Column la_name then one column per indicator. Local authorities missing an indicator have null there.
+    """
+    if period == LATEST:
+        chosen = panel.filter(pl.col("year") == pl.col("year").max().over("indicator"))
+    else:
+        chosen = panel.filter(pl.col("period") == period)
+    return (
+        chosen.filter(pl.col("indicator").is_in(indicators))
+        .pivot(
+            on = "indicator", on_columns = indicators, index = "la_name", values = "value",
+            aggregate_function = "first", maintain_order = True,
+        )
+        .rename({indicator: prefix + indicator for indicator in indicators})
+    )
+
+
+def indicator_periods(period_aggregates):
+    """
+    The periods each indicator has data for, most recent first.
+
+    Parameters
+    ----------
+    period_aggregates: dataframe
+        With indicator, period and year columns (like artifacts/period_aggregates.arrow).
+
+    Returns
+    --------
+    periods: dict
+        Maps each indicator to its list of periods.
+    """
+    periods = (
+        period_aggregates.select("indicator", "period", "year")
+        .unique()
+        .sort(["indicator", "year", "period"], descending = [False, True, True])
+        .group_by("indicator", maintain_order = True)
+        .agg("period")
+    )
+    return dict(zip(periods["indicator"].to_list(), periods["period"].to_list()))
@@ -0,0 +1,274 @@
+"""
+instrumentation.py
+-------------------
+Timings, counters and memory high-water marks for the pipeline and dashboard.
+
+Off unless the BIKEPOINT_METRICS environment variable is set (to anything but 0), or enable() is called. When off,
+span() hands back a shared do-nothing context manager and timed() functions call straight through, so the
+instrumented code costs a function call and a flag check.
+
+When on, every span is logged as one line of JSON (to stderr, or appended to the file named by
+BIKEPOINT_METRICS_LOG), with its duration, its parent span, and the process' peak memory so far. Spans and counters
+are also totalled for the process, and the dashboard serves the totals at /metrics in the Prometheus text format.
+Processes started by the pipeline inherit the environment variables, so they are instrumented too.
+"""
+import atexit
+import bisect
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows has no getrusage, so memory isn't recorded there
+    resource = None
+
+ENABLED = False
+# Upper bounds (seconds) of the /metrics duration histogram buckets
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+_log = logging.getLogger("bikepoint.metrics")
+_lock = threading.Lock()
+_local = threading.local()
+# Span name -> {"count", "sum", "max", "buckets"}
+_spans = {}
+_counters = {}
+
+
+def enable(log_path = None):
+    """
+    A function which turns instrumentation on for this process.
+
+    Parameters
+    ----------
+    log_path: str or None
+        A file to append the JSON lines to. They go to stderr if not given.
+    """
+    global ENABLED
+    if ENABLED:
+        return
+    handler = logging.FileHandler(log_path) if log_path else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _log.addHandler(handler)
+    _log.setLevel(logging.INFO)
+    _log.propagate = False
+    ENABLED = True
+    atexit.register(_log_summary)
+
+
+def peak_memory():
+    """
+    The most memory (resident set size, bytes) this process has used so far, or None where it can't be measured.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _emit(record):
+    _log.info(json.dumps(record, default = str))
+
+
+def record(name, seconds, **fields):
+    """
+    A function which adds a timing to the totals for name and logs it. Does nothing if instrumentation is off.
+
+    Parameters
+    ----------
+    name: str
+        What was timed, e.g. "clean_data.query".
+    seconds: float
+        How long it took.
+    fields:
+        Anything else worth logging with it.
+    """
+    if not ENABLED:
+        return
+    with _lock:
+        totals = _spans.get(name)
+        if totals is None:
+            totals = _spans[name] = {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * (len(BUCKETS) + 1)}
+        totals["count"] += 1
+        totals["sum"] += seconds
+        totals["max"] = max(totals["max"], seconds)
+        totals["buckets"][bisect.bisect_left(BUCKETS, seconds)] += 1
+    _emit({
+        "type": "span", "name": name, "duration_ms": round(seconds * 1000, 3), "pid": os.getpid(),
+        "thread": threading.current_thread().name, "peak_memory_mb": _megabytes(peak_memory()), **fields,
+    })
+
+
+def count(name, amount = 1):
+    """
+    A function which adds amount to the counter called name. Does nothing if instrumentation is off.
+    """
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+class _Span:
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        stack = _local.__dict__.setdefault("stack", [])
+        self.parent = stack[-1] if stack else None
+        stack.append(self.name)
+        self.memory = peak_memory()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        _local.stack.pop()
+        memory = peak_memory()
+        growth = None if memory is None else memory - self.memory
+        record(
+            self.name, seconds, parent = self.parent, peak_memory_growth_mb = _megabytes(growth),
+            error = exc_info[0].__name__ if exc_info[0] is not None else None, **self.fields,
+        )
+        return False
+
+
+class _NoSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **fields):
+    """
+    A context manager which times the code inside it. Spans opened inside it record it as their parent.
+
+    Parameters
+    ----------
+    name: str
+        What is being timed. Use the same name for every run of the same code, as totals are kept by name.
+    fields:
+        Anything else worth logging with it, e.g. the number of rows.
+    """
+    if not ENABLED:
+        return _NO_SPAN
+    return _Span(name, fields)
+
+
+def timed(name = None):
+    """
+    A decorator which runs every call of a function in a span, named after the function unless name is given.
+    """
+    def decorator(function):
+        span_name = name or f"{function.__module__}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with _Span(span_name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _megabytes(size):
+    return None if size is None else round(size / 2 ** 20, 1)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics():
+    """
+    The span and counter totals, and peak memory, in the Prometheus text format.
+    """
+    with _lock:
+        spans = {name: dict(totals, buckets = list(totals["buckets"])) for name, totals in _spans.items()}
+        counters = dict(_counters)
+    lines = [
+        "# HELP bikepoint_span_seconds Time spent in each span.",
+        "# TYPE bikepoint_span_seconds histogram",
+    ]
+    for name, totals in sorted(spans.items()):
+        label = _label(name)
+        cumulative = 0
+        for bound, bucket in zip(BUCKETS + ["+Inf"], totals["buckets"]):
+            cumulative += bucket
+            lines.append(f'bikepoint_span_seconds_bucket{{span="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'bikepoint_span_seconds_sum{{span="{label}"}} {totals["sum"]:.6f}')
+        lines.append(f'bikepoint_span_seconds_count{{span="{label}"}} {totals["count"]}')
+    lines += ["# HELP bikepoint_span_max_seconds The slowest run of each span.", "# TYPE bikepoint_span_max_seconds gauge"]
+    for name, totals in sorted(spans.items()):
+        lines.append(f'bikepoint_span_max_seconds{{span="{_label(name)}"}} {totals["max"]:.6f}')
+    lines += ["# HELP bikepoint_events_total Counted events.", "# TYPE bikepoint_events_total counter"]
+    for name, value in sorted(counters.items()):
+        lines.append(f'bikepoint_events_total{{event="{_label(name)}"}} {value}')
+    memory = peak_memory()
+    if memory is not None:
+        lines += [
+            "# HELP bikepoint_peak_memory_bytes The most memory this process has used.",
+            "# TYPE bikepoint_peak_memory_bytes gauge",
+            f"bikepoint_peak_memory_bytes {memory}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def instrument_app(app):
+    """
+    A function which times every request to a Dash app's server, naming callbacks after their outputs,
+    and serves the totals at /metrics. Does nothing if instrumentation is off.
+    """
+    if not ENABLED:
+        return
+    from flask import Response, g, request
+
+    @app.server.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.server.after_request
+    def stop_timer(response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+        if request.path.endswith("_dash-update-component"):
+            name = "callback:" + str((request.get_json(silent = True) or {}).get("output"))
+        else:
+            # The route rather than the path, so every map file is one span
+            name = "request:" + (request.url_rule.rule if request.url_rule is not None else "unmatched")
+        record(name, time.perf_counter() - start, status = response.status_code)
+        return response
+
+    app.server.add_url_rule(
+        "/metrics", endpoint = "metrics",
+        view_func = lambda: Response(render_metrics(), mimetype = "text/plain; version=0.0.4"),
+    )
+
+
+def _log_summary():
+    with _lock:
+        spans = {name: {key: totals[key] for key in ("count", "sum", "max")} for name, totals in _spans.items()}
+        counters = dict(_counters)
+    if spans or counters:
+        _emit({"type": "summary", "pid": os.getpid(), "spans": spans, "counters": counters,
+               "peak_memory_mb": _megabytes(peak_memory())})
+
+
+if os.environ.get("BIKEPOINT_METRICS", "0") not in ("", "0"):
+    enable(os.environ.get("BIKEPOINT_METRICS_LOG"))
@@ -0,0 +1,322 @@
+"""
+lsoa_tiles.py
+--------------
+Cuts LSOA boundaries into map tiles, so a choropleth of every LSOA can be drawn without sending the whole boundary
+file to the browser.
+
+The boundaries are projected to Web Mercator once. For each zoom level they are snapped to the pixel grid of that
+level (dropping repeated points, points on a straight line and polygons smaller than a pixel, which simplifies them
+to what can be seen), cut into the standard 256 pixel XYZ tiles and saved as small JSON files (with compressed
+copies) in tile_dir/z/x/y.json. Each tile lists its polygons as [value, rings], with each ring a flat list of
+x, y tile pixel coordinates, so the browser draws them straight onto a canvas with no projection of its own
+(see map_layers.ChoroplethTileLayer).
+
+Empty tiles aren't written. tile_dir/tiles.json records the zoom levels, bounds and a version which changes with
+the tiles' contents, for cache-busting the tile URLs.
+"""
+import hashlib
+import json
+import os
+import shutil
+from collections import defaultdict
+
+import numpy as np
+
+from modules.map_layers import compress
+from modules.spatial_join import LSOA_PROPERTY
+
+# Tile coordinates run from 0 to EXTENT: two units per screen pixel, so tiles stay sharp one zoom level past the last
+EXTENT = 512
+# How far polygons are kept past the edge of each tile, so their outlines don't show at tile boundaries
+BUFFER = 8
+# Polygons smaller than this (in tile units squared, so a pixel) are dropped
+MIN_AREA = 4
+MIN_ZOOM = 8
+MAX_ZOOM = 14
+MAX_LATITUDE = 85.05112878
+
+
+def to_world(lons, lats):
+    """
+    Projects longitudes and latitudes to Web Mercator, scaled so the whole world is the unit square (y downwards).
+    """
+    lats = np.radians(np.clip(lats, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(lons) + 180) / 360
+    y = (1 - np.log(np.tan(lats) + 1 / np.cos(lats)) / np.pi) / 2
+    return np.column_stack([x, y])
+
+
+def from_world(x, y):
+    """
+    The longitudes and latitudes of Web Mercator unit square coordinates (the inverse of to_world).
+    """
+    lons = np.asarray(x) * 360 - 180
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(y)))))
+    return lons, lats
+
+
+def read_boundaries(boundary_path, values, code_property = LSOA_PROPERTY):
+    """
+    A function which reads the polygons of a GeoJSON boundary file into flat arrays, projected with to_world.
+
+    Parameters
+    ----------
+    boundary_path: str
+        A GeoJSON FeatureCollection of Polygons / MultiPolygons in WGS84.
+    values: dict
+        Maps each area's code to the value to colour it by. Areas without a value are left out.
+    code_property: str
+        The property holding each area's code.
+
+    Returns
+    --------
+    feature_values: array
+        The value of each area kept.
+    ring_features: array
+        The area each ring belongs to (an area has several rings if it has holes or several parts).
+    points: array
+        Shape (n, 2): every ring's points, ring after ring, without repeating the first point at the end.
+    point_rings: array
+        The ring each point belongs to.
+
+    Raises
+    ------
+    Value Error
+        If a feature is not a Polygon or MultiPolygon.
+    """
+    with open(boundary_path, "r") as f:
+        collection = json.load(f)
+    feature_values = []
+    ring_features = []
+    blocks = []
+    for feature in collection["features"]:
+        value = values.get(feature["properties"][code_property])
+        if value is None:
+            continue
+        geometry = feature["geometry"]
+        if geometry["type"] == "Polygon":
+            rings = geometry["coordinates"]
+        elif geometry["type"] == "MultiPolygon":
+            rings = [ring for polygon in geometry["coordinates"] for ring in polygon]
+        else:
+            raise ValueError(f"Unsupported geometry type: {geometry['type']}")
+        for ring in rings:
+            ring = np.asarray(ring, dtype = np.float64)[:, :2]
+            if np.array_equal(ring[0], ring[-1]):
+                ring = ring[:-1]
+            ring_features.append(len(feature_values))
+            blocks.append(ring)
+        feature_values.append(value)
+    lengths = [len(ring) for ring in blocks]
+    points = np.vstack(blocks) if blocks else np.zeros((0, 2))
+    return (
+        np.asarray(feature_values),
+        np.asarray(ring_features, dtype = np.int64),
+        to_world(points[:, 0], points[:, 1]),
+        np.repeat(np.arange(len(blocks)), lengths),
+    )
+
+
+def _neighbours(point_rings):
+    """
+    The index of the point before and after each point in its ring, for points stored ring after ring.
+    """
+    n = len(point_rings)
+    if n == 0:
+        return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64)
+    starts = np.flatnonzero(np.concatenate([[True], point_rings[1:] != point_rings[:-1]]))
+    ends = np.concatenate([starts[1:], [n]]) - 1
+    before = np.arange(n) - 1
+    after = np.arange(n) + 1
+    before[starts] = ends
+    after[ends] = starts
+    return before, after
+
+
+def _simplify(points, point_rings):
+    """
+    Drops repeated points and points on a straight line between their neighbours from integer rings.
+    """
+    before, _ = _neighbours(point_rings)
+    keep = np.any(points != points[before], axis = 1)
+    points = points[keep]
+    point_rings = point_rings[keep]
+    before, after = _neighbours(point_rings)
+    turn = (
+        (points[:, 0] - points[before, 0]) * (points[after, 1] - points[before, 1])
+        - (points[:, 1] - points[before, 1]) * (points[after, 0] - points[before, 0])
+    )
+    return points[turn != 0], point_rings[turn != 0]
+
+
+def _clip_side(ring, axis, bound, keep_above):
+    """
+    One step of Sutherland-Hodgman clipping: the part of a ring on one side of a vertical or horizontal line.
+    """
+    inside = ring[:, axis] >= bound if keep_above else ring[:, axis] <= bound
+    if inside.all() or not inside.any():
+        return ring if inside.all() else ring[:0]
+    following = np.concatenate([ring[1:], ring[:1]])
+    crossing = inside != np.concatenate([inside[1:], inside[:1]])
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        t = np.where(crossing, (bound - ring[:, axis]) / (following[:, axis] - ring[:, axis]), 0)
+    intersections = ring + t[:, None] * (following - ring)
+    # Each edge contributes its start if that is inside, then where it crosses the line
+    points = np.stack([ring, intersections], axis = 1)
+    return points[np.stack([inside, crossing], axis = 1)]
+
+
+def _clip(ring, low, high):
+    for axis in (0, 1):
+        ring = _clip_side(ring, axis, low, True)
+        ring = _clip_side(ring, axis, high, False)
+        if len(ring) == 0:
+            break
+    return ring
+
+
+def _cut_zoom(feature_values, ring_features, points, point_rings, zoom):
+    """
+    Simplifies the boundaries to the pixel grid of a zoom level and cuts them into tiles.
+
+    Returns
+    --------
+    tiles: dict
+        Maps each tile's (x, y) to its list of [value, rings], with each ring a flat list of tile coordinates.
+    """
+    snapped, rings = _simplify(np.round(points * (2 ** zoom * EXTENT)).astype(np.int64), point_rings)
+    # Rings which have shrunk to nothing at this zoom
+    counts = np.bincount(rings, minlength = len(ring_features))
+    _, after = _neighbours(rings)
+    twice_area = np.abs(np.bincount(
+        rings, weights = snapped[:, 0] * snapped[after, 1] - snapped[:, 1] * snapped[after, 0], minlength = len(ring_features)
+    ))
+    keep = ((counts >= 3) & (twice_area >= 2 * MIN_AREA))[rings]
+    snapped = snapped[keep]
+    rings = rings[keep]
+    if len(rings) == 0:
+        return {}
+
+    # Points are ring after ring and rings are area after area, so each area's points are one run
+    ring_starts = np.flatnonzero(np.concatenate([[True], rings[1:] != rings[:-1]]))
+    point_features = ring_features[rings]
+    feature_starts = np.flatnonzero(np.concatenate([[True], point_features[1:] != point_features[:-1]]))
+    feature_ends = np.concatenate([feature_starts[1:], [len(rings)]])
+    low = (np.minimum.reduceat(snapped, feature_starts) - BUFFER) // EXTENT
+    high = (np.maximum.reduceat(snapped, feature_starts) + BUFFER) // EXTENT
+
+    tiles = defaultdict(list)
+    for feature, start, end, (low_x, low_y), (high_x, high_y) in zip(point_features[feature_starts], feature_starts, feature_ends, low, high):
+        feature_rings = np.split(snapped[start:end], ring_starts[(ring_starts > start) & (ring_starts < end)] - start)
+        value = feature_values[feature].item()
+        if low_x == high_x and low_y == high_y:
+            # Most areas are well inside one tile, and need no clipping
+            origin = np.array([low_x, low_y]) * EXTENT
+            tiles[(int(low_x), int(low_y))].append([value, [(ring - origin).ravel().tolist() for ring in feature_rings]])
+            continue
+        ring_low = [ring.min(axis = 0) for ring in feature_rings]
+        ring_high = [ring.max(axis = 0) for ring in feature_rings]
+        for tile_x in range(int(low_x), int(high_x) + 1):
+            for tile_y in range(int(low_y), int(high_y) + 1):
+                origin = np.array([tile_x, tile_y]) * EXTENT
+                cut = []
+                for ring, ring_min, ring_max in zip(feature_rings, ring_low, ring_high):
+                    ring_min = ring_min - origin
+                    ring_max = ring_max - origin
+                    if (ring_max < -BUFFER).any() or (ring_min > EXTENT + BUFFER).any():
+                        continue
+                    ring = ring - origin
+                    if (ring_min < -BUFFER).any() or (ring_max > EXTENT + BUFFER).any():
+                        ring = np.round(_clip(ring.astype(np.float64), -BUFFER, EXTENT + BUFFER)).astype(np.int64)
+                        ring, _ = _simplify(ring, np.zeros(len(ring), dtype = np.int64))
+                        if len(ring) < 3:
+                            continue
+                    cut.append(ring.ravel().tolist())
+                if cut:
+                    tiles[(tile_x, tile_y)].append([value, cut])
+    return tiles
+
+
+def build_tiles(boundary_path, values, tile_dir, min_zoom = MIN_ZOOM, max_zoom = MAX_ZOOM, code_property = LSOA_PROPERTY):
+    """
+    A function which cuts a boundary file into choropleth tiles for every zoom level from min_zoom to max_zoom.
+
+    The tiles are written to a new folder which then replaces tile_dir, so the old tiles are served until the new
+    ones are all ready. The old folder is renamed aside just before and deleted after, so tile_dir is only missing
+    for the moment between the two renames.
+
+    Parameters
+    ----------
+    boundary_path: str
+        A GeoJSON FeatureCollection of Polygons / MultiPolygons in WGS84.
+    values: dict
+        Maps each area's code to the (whole number) value to colour it by, e.g. its deprivation decile.
+    tile_dir: str
+        The folder to write the tiles to.
+    min_zoom, max_zoom: int
+        The zoom levels to cut. Past max_zoom the browser scales up the max_zoom tiles.
+    code_property: str
+        The property of each feature holding its code.
+
+    Returns
+    --------
+    manifest: dict
+        What is saved in tile_dir/tiles.json: min_zoom, max_zoom, extent, bounds ([west, south, east, north]),
+        the number of tiles and a version which changes whenever the tiles do.
+
+    Raises
+    ------
+    Value Error
+        If none of the boundaries have a value, or a feature is not a Polygon or MultiPolygon.
+    """
+    boundaries = read_boundaries(boundary_path, values, code_property)
+    points = boundaries[2]
+    if len(points) == 0:
+        raise ValueError("None of the boundaries have a value to colour them by.")
+    west, north = from_world(*points.min(axis = 0))
+    east, south = from_world(*points.max(axis = 0))
+
+    tile_dir = tile_dir.rstrip("/")
+    new_dir = tile_dir + ".new"
+    shutil.rmtree(new_dir, ignore_errors = True)
+    digest = hashlib.sha256()
+    count = 0
+    for zoom in range(min_zoom, max_zoom + 1):
+        tiles = _cut_zoom(*boundaries, zoom)
+        for (tile_x, tile_y), tile_features in sorted(tiles.items()):
+            content = json.dumps({"features": tile_features}, separators = (",", ":")).encode()
+            directory = os.path.join(new_dir, str(zoom), str(tile_x))
+            os.makedirs(directory, exist_ok = True)
+            path = os.path.join(directory, f"{tile_y}.json")
+            with open(path, "wb") as f:
+                f.write(content)
+            compress(path)
+            digest.update(f"{zoom}/{tile_x}/{tile_y}".encode())
+            digest.update(content)
+            count += 1
+
+    manifest = {
+        "min_zoom": min_zoom, "max_zoom": max_zoom, "extent": EXTENT,
+        "bounds": [float(west), float(south), float(east), float(north)],
+        "tiles": count, "version": digest.hexdigest()[:12],
+    }
+    with open(os.path.join(new_dir, "tiles.json"), "w") as f:
+        json.dump(manifest, f)
+    old_dir = tile_dir + ".old"
+    shutil.rmtree(old_dir, ignore_errors = True)
+    if os.path.exists(tile_dir):
+        os.replace(tile_dir, old_dir)
+    os.replace(new_dir, tile_dir)
+    shutil.rmtree(old_dir, ignore_errors = True)
+    return manifest
+
+
+def load_manifest(tile_dir):
+    """
+    The manifest build_tiles saved in tile_dir, or None if no tiles have been built there.
+    """
+    path = os.path.join(tile_dir, "tiles.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
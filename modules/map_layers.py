@@ -0,0 +1,197 @@
+"""
+map_layers.py
+--------------
+Folium layers which load their data from a separate, cacheable file instead of inlining one marker per point.
+
+The stations are written once to a GeoJSON file. Each map only holds a few lines of JavaScript which fetch
+that file and draw every station on a single canvas, so map size doesn't grow with the number of stations
+and both maps share one (browser-cached, gzip-compressed) copy of the stations.
+"""
+import gzip
+import hashlib
+import json
+import shutil
+
+from branca.element import MacroElement
+from folium.elements import JSCSSMixin
+from folium.plugins import MarkerCluster
+from jinja2 import Template
+
+try:
+    import brotli
+except ImportError:
+    # Optional: without it only the gzipped copy is written
+    brotli = None
+
+
+class StationLayer(JSCSSMixin, MacroElement):
+    """
+    Draws the points in a GeoJSON file as circle markers on a shared canvas, optionally clustered.
+
+    Parameters
+    ----------
+    url: str
+        Where the map will fetch the GeoJSON from, e.g. /maps/stations.geojson
+    radius: int
+        Radius of each circle in pixels.
+    cluster: bool
+        Whether to group nearby stations into clusters when zoomed out.
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            fetch({{ this.url|tojson }})
+                .then(function(response) { return response.json(); })
+                .then(function(stations) {
+                    var renderer = L.canvas({padding: 0.5});
+                    var layer = L.geoJSON(stations, {
+                        pointToLayer: function(feature, latlng) {
+                            return L.circleMarker(latlng, {radius: {{ this.radius }}, renderer: renderer});
+                        }
+                    });
+                    {% if this.cluster %}
+                    L.markerClusterGroup().addLayer(layer).addTo({{ this._parent.get_name() }});
+                    {% else %}
+                    layer.addTo({{ this._parent.get_name() }});
+                    {% endif %}
+                });
+        {% endmacro %}
+    """)
+
+    def __init__(self, url, radius = 2, cluster = False):
+        super().__init__()
+        self._name = "StationLayer"
+        self.url = url
+        self.radius = radius
+        self.cluster = cluster
+        # Only pull in the clustering library when it is used
+        if cluster:
+            self.default_js = MarkerCluster.default_js
+            self.default_css = MarkerCluster.default_css
+
+
+class ChoroplethTileLayer(MacroElement):
+    """
+    Draws the tiles cut by lsoa_tiles.build_tiles onto canvases, filling each polygon with the colour of its value,
+    with a control to hide it and a legend.
+
+    Parameters
+    ----------
+    url: str
+        The tile URL with {z}, {x} and {y} placeholders, e.g. /maps/tiles/deprivation/{z}/{x}/{y}.json?v=...
+    manifest: dict
+        From lsoa_tiles.build_tiles: where there are tiles and at which zoom levels.
+    colours: list of str
+        The colour of each value, from 1 upwards.
+    name: str
+        What the layer is called in the control.
+    legend: tuple of str
+        Labels for the first and last colours.
+    opacity: float
+        How opaque the layer is, so the streets still show through.
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            (function() {
+                var colours = {{ this.colours|tojson }};
+                var Tiles = L.GridLayer.extend({
+                    createTile: function(coords, done) {
+                        var tile = L.DomUtil.create("canvas", "leaflet-tile");
+                        var size = this.getTileSize();
+                        tile.width = {{ this.extent }};
+                        tile.height = {{ this.extent }};
+                        tile.style.width = size.x + "px";
+                        tile.style.height = size.y + "px";
+                        var url = {{ this.url|tojson }}.replace("{z}", coords.z).replace("{x}", coords.x).replace("{y}", coords.y);
+                        fetch(url)
+                            .then(function(response) { return response.ok ? response.json() : {features: []}; })
+                            .then(function(data) {
+                                var context = tile.getContext("2d");
+                                data.features.forEach(function(feature) {
+                                    context.beginPath();
+                                    feature[1].forEach(function(ring) {
+                                        context.moveTo(ring[0], ring[1]);
+                                        for (var i = 2; i < ring.length; i += 2) {
+                                            context.lineTo(ring[i], ring[i + 1]);
+                                        }
+                                        context.closePath();
+                                    });
+                                    context.fillStyle = colours[feature[0] - 1];
+                                    context.fill("evenodd");
+                                });
+                                done(null, tile);
+                            })
+                            .catch(function(error) { done(error, tile); });
+                        return tile;
+                    }
+                });
+                var bounds = {{ this.manifest["bounds"]|tojson }};
+                var layer = new Tiles({
+                    opacity: {{ this.opacity }},
+                    minZoom: {{ this.manifest["min_zoom"] }},
+                    maxNativeZoom: {{ this.manifest["max_zoom"] }},
+                    bounds: L.latLngBounds([bounds[1], bounds[0]], [bounds[3], bounds[2]])
+                }).addTo({{ this._parent.get_name() }});
+                L.control.layers(null, {{ '{' }}{{ this.layer_name|tojson }}: layer{{ '}' }}, {collapsed: false}).addTo({{ this._parent.get_name() }});
+
+                var legend = L.control({position: "bottomright"});
+                legend.onAdd = function() {
+                    var div = L.DomUtil.create("div", "leaflet-control");
+                    div.style.background = "white";
+                    div.style.padding = "4px 6px";
+                    div.style.font = "12px sans-serif";
+                    div.innerHTML = {{ this.legend[0]|tojson }} + " " + colours.map(function(colour) {
+                        return '<span style="display:inline-block;width:14px;height:12px;background:' + colour + '"></span>';
+                    }).join("") + " " + {{ this.legend[1]|tojson }};
+                    return div;
+                };
+                legend.addTo({{ this._parent.get_name() }});
+            })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, url, manifest, colours, name, legend = ("Low", "High"), opacity = 0.6):
+        super().__init__()
+        self._name = "ChoroplethTileLayer"
+        self.url = url
+        self.manifest = manifest
+        self.extent = manifest["extent"]
+        self.colours = list(colours)
+        self.layer_name = name
+        self.legend = legend
+        self.opacity = opacity
+
+
+def write_stations_geojson(bikepoints, path):
+    """
+    A function which writes the BikePoints as a compact GeoJSON FeatureCollection, plus a gzipped copy for serving.
+
+    Returns
+    --------
+    version: str
+        A short hash of the file's content, to add to its URL so browsers can cache it indefinitely.
+    """
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {"id": station_id},
+        }
+        for station_id, lat, lon in zip(bikepoints["id"], bikepoints["lat"], bikepoints["lon"])
+    ]
+    content = json.dumps({"type": "FeatureCollection", "features": features}, separators = (",", ":")).encode()
+    with open(path, "wb") as f:
+        f.write(content)
+    compress(path)
+    return hashlib.sha256(content).hexdigest()[:12]
+
+
+def compress(path):
+    """
+    A function which writes a gzipped copy of a file next to it (path + ".gz") for serving to browsers which accept it,
+    and a brotli copy (path + ".br") too if brotli is installed.
+    """
+    with open(path, "rb") as source, gzip.open(path + ".gz", "wb", compresslevel = 9) as target:
+        shutil.copyfileobj(source, target)
+    if brotli is not None:
+        with open(path, "rb") as source, open(path + ".br", "wb") as target:
+            target.write(brotli.compress(source.read(), quality = 11))
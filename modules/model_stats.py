@@ -0,0 +1,244 @@
+"""
+model_stats.py
+---------------
+How sure we can be about the differences between local authorities with and without BikePoints.
+
+For every indicator this gives the mean in each group, the difference between them, and a logistic regression of
+BikePoint presence on the indicator (per standard deviation). Uncertainty comes from resampling:
+
+- Bootstrap confidence intervals, resampling local authorities within each group so both groups are always present.
+- Permutation test p-values for the difference in means, shuffling which local authorities have BikePoints.
+
+Every indicator is fitted separately. They can't go in one model together, as the change columns are exact
+differences of the others.
+
+Resamples are drawn as NumPy arrays a batch at a time, and every indicator of every resample in a batch is
+handled at once (the logistic regressions are two-parameter Newton steps done in closed form). Batches run in a
+process pool, each from its own seed, so the results don't depend on the number of processes. Results are cached
+by a hash of the data and settings.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import polars as pl
+
+# Bump when the method changes, so cached results are recomputed
+STATS_VERSION = 1
+RESAMPLES = 10_000
+BATCH_SIZE = 500
+CONFIDENCE = 0.95
+NEWTON_STEPS = 25
+# A slope this steep (per standard deviation) means the groups are perfectly separated
+MAX_LOG_ODDS = 20.0
+
+
+def fit_logistic(x, y, start = None):
+    """
+    A function which fits log(p / (1 - p)) = a + b * x by Newton's method, for many independent problems at once.
+
+    Each step only works on the problems which haven't converged yet, so the few hard ones don't slow down the rest.
+
+    Parameters
+    ----------
+    x: array
+        Shape (..., n): the predictor of each problem.
+    y: array
+        Shape (n,) or (..., n): the 0 / 1 outcomes.
+    start: tuple of arrays or None
+        Starting values of a and b, broadcastable to shape (...). Zero if not given.
+
+    Returns
+    --------
+    a, b: arrays
+        Shape (...): the intercept and slope of each problem. Problems still not converged after NEWTON_STEPS
+        are (nearly) perfectly separated, with no finite slope, and get a slope of +/- MAX_LOG_ODDS.
+    """
+    shape = x.shape[:-1]
+    n = x.shape[-1]
+    x = x.reshape(-1, n)
+    y = np.broadcast_to(y, x.shape[:-1] + (n,)) if np.ndim(y) == 1 else y.reshape(-1, n)
+    a = np.zeros(len(x))
+    b = np.zeros(len(x))
+    if start is not None:
+        a[:] = np.broadcast_to(start[0], shape).ravel()
+        b[:] = np.broadcast_to(start[1], shape).ravel()
+    active = np.arange(len(x))
+    for _ in range(NEWTON_STEPS):
+        xs = x[active]
+        eta = np.clip(a[active, None] + b[active, None] * xs, -30, 30)
+        p = 1 / (1 + np.exp(-eta))
+        w = p * (1 - p)
+        wx = w * xs
+        residual = y[active] - p
+        # The 2x2 information matrix and score of each problem
+        h_aa = w.sum(-1)
+        h_ab = wx.sum(-1)
+        h_bb = (wx * xs).sum(-1)
+        g_a = residual.sum(-1)
+        g_b = (residual * xs).sum(-1)
+        det = h_aa * h_bb - h_ab * h_ab
+        ok = det > 1e-12
+        det = np.where(ok, det, 1)
+        step_a = np.where(ok, (h_bb * g_a - h_ab * g_b) / det, 0)
+        step_b = np.where(ok, (h_aa * g_b - h_ab * g_a) / det, 0)
+        a[active] += step_a
+        b[active] = np.clip(b[active] + step_b, -MAX_LOG_ODDS, MAX_LOG_ODDS)
+        still = ok & (np.abs(step_a) + np.abs(step_b) > 1e-9) & (np.abs(b[active]) < MAX_LOG_ODDS)
+        active = active[still]
+        if len(active) == 0:
+            break
+    b[active] = np.sign(b[active]) * MAX_LOG_ODDS
+    return a.reshape(shape), b.reshape(shape)
+
+
+def _resample_batch(with_values, without_values, seed, size):
+    """
+    One batch of bootstrap and permutation resamples, for every indicator at once.
+
+    Returns
+    --------
+    means_with, means_without, log_odds, permuted_differences: arrays
+        Each of shape (size, indicators).
+    """
+    rng = np.random.default_rng(seed)
+    n_with = len(with_values)
+    n_without = len(without_values)
+    pooled = np.vstack([with_values, without_values])
+    scale = pooled.std(axis = 0)
+    scale[scale == 0] = 1
+    standardised = (pooled - pooled.mean(axis = 0)) / scale
+
+    # Bootstrap within each group
+    with_rows = rng.integers(0, n_with, (size, n_with))
+    without_rows = rng.integers(0, n_without, (size, n_without)) + n_with
+    rows = np.concatenate([with_rows, without_rows], axis = 1)
+    means_with = pooled[with_rows].mean(axis = 1)
+    means_without = pooled[without_rows].mean(axis = 1)
+    y = np.concatenate([np.ones(n_with), np.zeros(n_without)])
+    # (size, indicators, rows), so each indicator of each resample is its own regression.
+    # Resamples are close to the original data, so starting from its fit saves most of the steps.
+    start = fit_logistic(standardised.T, y)
+    _, log_odds = fit_logistic(standardised[rows].transpose(0, 2, 1), y, start)
+
+    # Shuffle which rows have BikePoints
+    with_shuffled = np.argsort(rng.random((size, n_with + n_without)), axis = 1)[:, :n_with]
+    sum_with = pooled[with_shuffled].sum(axis = 1)
+    permuted_differences = sum_with / n_with - (pooled.sum(axis = 0) - sum_with) / n_without
+    return means_with, means_without, log_odds, permuted_differences
+
+
+def _cache_key(data, resamples, seed):
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"columns": data.columns, "resamples": resamples, "seed": seed,
+                              "batch_size": BATCH_SIZE, "version": STATS_VERSION}).encode())
+    digest.update(data.to_numpy().astype(np.float64).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _incomparable(indicators, with_values, without_values):
+    """
+    The statistics when one group is empty: each group's means where it has local authorities, NaN elsewhere.
+    """
+    missing = np.full(len(indicators), np.nan)
+    columns = {"indicator": indicators}
+    for name, values in [("mean_with", with_values), ("mean_without", without_values)]:
+        columns[name] = values.mean(axis = 0) if len(values) > 0 else missing
+        columns[name + "_low"] = missing
+        columns[name + "_high"] = missing
+    for name in ["difference", "log_odds_per_sd"]:
+        columns[name] = missing
+        columns[name + "_low"] = missing
+        columns[name + "_high"] = missing
+    columns["p_value"] = missing
+    return pl.DataFrame(columns)
+
+
+def model_statistics(data, group = "bikepoint_binary", resamples = RESAMPLES, seed = 0, workers = None, cache_dir = None):
+    """
+    A function which compares every indicator between local authorities with and without BikePoints.
+
+    Parameters
+    ----------
+    data: dataframe
+        The boolean group column and numeric indicator columns, without nulls (like log_reg_data in run_model.py).
+    group: str
+        The column saying whether each local authority has a BikePoint.
+    resamples: int
+        The number of bootstrap and of permutation resamples.
+    seed: int
+        Makes the resamples repeatable.
+    workers: int or None
+        Processes to spread the batches over. None uses one per CPU, and 1 runs them in this process.
+    cache_dir: str or None
+        A folder to cache results in, keyed by the data and settings.
+
+    Returns
+    --------
+    statistics: dataframe
+        One row per indicator: mean_with / mean_without (with BikePoints and without) and their difference, each
+        with _low and _high bounds of a CONFIDENCE bootstrap interval; p_value, from the permutation test of the
+        difference; and log_odds_per_sd (with bounds), the logistic regression slope of BikePoint presence on the
+        indicator in standard deviations.
+
+        If either group is empty there is nothing to compare: the means of the other group are given, and
+        every other value (and every bound) is NaN.
+    """
+    data = data.select(pl.col(group), pl.exclude(group).cast(pl.Float64))
+    indicators = data.drop(group).columns
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, f"model_stats_{_cache_key(data, resamples, seed)}.arrow")
+        if os.path.exists(cache_path):
+            return pl.read_ipc(cache_path)
+
+    with_values = data.filter(pl.col(group)).drop(group).to_numpy()
+    without_values = data.filter(~pl.col(group)).drop(group).to_numpy()
+    if len(with_values) == 0 or len(without_values) == 0:
+        return _incomparable(indicators, with_values, without_values)
+
+    sizes = [BATCH_SIZE] * (resamples // BATCH_SIZE) + ([resamples % BATCH_SIZE] if resamples % BATCH_SIZE else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    arguments = [[with_values] * len(sizes), [without_values] * len(sizes), seeds, sizes]
+    workers = min(workers or os.cpu_count() or 1, len(sizes))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers = workers, mp_context = multiprocessing.get_context("spawn")) as pool:
+            batches = list(pool.map(_resample_batch, *arguments))
+    else:
+        batches = list(map(_resample_batch, *arguments))
+    means_with, means_without, log_odds, permuted = (np.concatenate(parts) for parts in zip(*batches))
+
+    observed_with = with_values.mean(axis = 0)
+    observed_without = without_values.mean(axis = 0)
+    observed_difference = observed_with - observed_without
+    pooled = np.vstack([with_values, without_values])
+    scale = pooled.std(axis = 0)
+    scale[scale == 0] = 1
+    y = np.concatenate([np.ones(len(with_values)), np.zeros(len(without_values))])
+    _, observed_log_odds = fit_logistic(((pooled - pooled.mean(axis = 0)) / scale).T, y)
+
+    tails = [(1 - CONFIDENCE) / 2 * 100, (1 + CONFIDENCE) / 2 * 100]
+    columns = {"indicator": indicators}
+    for name, observed, resampled in [
+        ("mean_with", observed_with, means_with),
+        ("mean_without", observed_without, means_without),
+        ("difference", observed_difference, means_with - means_without),
+        ("log_odds_per_sd", observed_log_odds, log_odds),
+    ]:
+        low, high = np.percentile(resampled, tails, axis = 0)
+        columns[name] = observed
+        columns[name + "_low"] = low
+        columns[name + "_high"] = high
+    # Two-sided, counting the observed data as one of the permutations
+    extreme = (np.abs(permuted) >= np.abs(observed_difference) - 1e-12).sum(axis = 0)
+    columns["p_value"] = (extreme + 1) / (len(permuted) + 1)
+    statistics = pl.DataFrame(columns)
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok = True)
+        statistics.write_ipc(cache_path + ".tmp")
+        os.replace(cache_path + ".tmp", cache_path)
+    return statistics
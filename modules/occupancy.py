@@ -0,0 +1,391 @@
+"""
+occupancy.py
+-------------
+An append-only store of how many bikes and empty docks every BikePoint has over time, and queries over it.
+
+The store is a folder of Arrow IPC files, one partition per day:
+
+    data/occupancy/date=2024-01-31/part-080000.arrow
+    data/occupancy/date=2024-01-30/occupancy.arrow
+
+Only stations whose counts changed since the previous poll are written, plus a full snapshot at the start of
+every day so each partition can be read on its own. A station that leaves the feed gets a row of nulls.
+Polls are buffered in memory and flushed as one part file at a time, and once a day is over its parts are
+merged into a single file, so a month of 1-minute polling is ~30 files rather than ~40k.
+"""
+import glob
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import polars as pl
+import requests
+
+# The occupancy fields of each BikePoint's additionalProperties, and the columns they are stored as
+OCCUPANCY_KEYS = {
+    "NbBikes": "nb_bikes",
+    "NbEmptyDocks": "nb_empty_docks",
+    "NbDocks": "nb_docks",
+    "NbStandardBikes": "nb_standard_bikes",
+    "NbEBikes": "nb_ebikes",
+}
+OCCUPANCY_COLUMNS = list(OCCUPANCY_KEYS.values())
+OCCUPANCY_SCHEMA = {
+    "time": pl.Datetime("ms", "UTC"),
+    "id": pl.Utf8,
+    **{col: pl.Int16 for col in OCCUPANCY_COLUMNS},
+}
+
+# Only the fields needed for occupancy are parsed from the feed
+FEED_SCHEMA = {
+    "id": pl.Utf8,
+    "additionalProperties": pl.List(pl.Struct({"key": pl.Utf8, "value": pl.Utf8})),
+}
+
+# Polls kept in memory before they are written as a part file
+FLUSH_EVERY = 60
+
+
+def parse_occupancy(stream):
+    """
+    Reads the dock counts of every BikePoint from a file-like JSON stream of the BikePoint feed.
+
+    Returns
+    --------
+    occupancy: dataframe
+        Columns id and OCCUPANCY_COLUMNS, one row per BikePoint.
+    """
+    feed = pl.read_json(stream, schema = FEED_SCHEMA)
+    return (
+        feed.explode("additionalProperties")
+        .unnest("additionalProperties")
+        .filter(pl.col("key").is_in(list(OCCUPANCY_KEYS)))
+        .pivot(on = "key", index = "id", values = "value", on_columns = list(OCCUPANCY_KEYS))
+        .rename(OCCUPANCY_KEYS)
+        .with_columns(pl.col(OCCUPANCY_COLUMNS).cast(pl.Int16, strict = False))
+    )
+
+
+def fetch_occupancy(bikepoint_api, validators, timeout = 30):
+    """
+    Downloads the dock counts from the BikePoint feed, unless it hasn't changed since the last download.
+
+    Parameters
+    ----------
+    bikepoint_api: str
+        The API where the bikepoint data is available. Usually https://api.tfl.gov.uk/BikePoint/
+    validators: dict
+        The ETag of the last download, updated in place.
+    timeout: float
+        Seconds to wait for the server.
+
+    Returns
+    --------
+    occupancy: dataframe or None
+        From parse_occupancy, or None if the server answered 304 Not Modified.
+
+    Raises
+    ------
+    Index Error
+        If the API returns anything other than 200 or 304.
+    """
+    request_headers = {"If-None-Match": validators["etag"]} if validators.get("etag") else {}
+    with requests.get(bikepoint_api, headers = request_headers, stream = True, timeout = timeout) as r:
+        if r.status_code == 304:
+            return None
+        if r.status_code != 200:
+            raise IndexError(f"API Error: {r.status_code}")
+        validators["etag"] = r.headers.get("ETag")
+        r.raw.decode_content = True
+        return parse_occupancy(r.raw)
+
+
+def _partition_dir(store_path, day):
+    return os.path.join(store_path, f"date={day.isoformat()}")
+
+
+def _partition_files(store_path, start = None, end = None):
+    """
+    The files of every partition between the days of start and end (inclusive), oldest first.
+    """
+    files = []
+    for directory in sorted(glob.glob(os.path.join(store_path, "date=*"))):
+        day = datetime.strptime(os.path.basename(directory)[5:], "%Y-%m-%d").date()
+        if start is not None and day < start.astimezone(timezone.utc).date():
+            continue
+        if end is not None and day > end.astimezone(timezone.utc).date():
+            continue
+        files.extend(sorted(glob.glob(os.path.join(directory, "*.arrow"))))
+    return files
+
+
+def _write(data, path):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    data.write_ipc(path + ".tmp", compression = "zstd")
+    os.replace(path + ".tmp", path)
+
+
+def compact_partition(directory):
+    """
+    Merges the part files of one day into a single occupancy.arrow.
+    """
+    parts = sorted(glob.glob(os.path.join(directory, "part-*.arrow")))
+    if not parts:
+        return
+    merged_path = os.path.join(directory, "occupancy.arrow")
+    previous = [merged_path] if os.path.exists(merged_path) else []
+    merged = pl.concat([pl.read_ipc(path) for path in previous + parts]).sort("time", maintain_order = True)
+    _write(merged, merged_path)
+    for path in parts:
+        os.remove(path)
+
+
+class OccupancyStore:
+    """
+    Appends polls to the store, writing only the stations which changed.
+
+    Only the latest counts of each station and the unwritten polls are held in memory.
+    Call flush (or use it as a context manager) so buffered polls aren't lost.
+
+    Parameters
+    ----------
+    store_path: str
+        The store folder, created if needed.
+    flush_every: int
+        Polls kept in memory before they are written.
+    """
+
+    def __init__(self, store_path, flush_every = FLUSH_EVERY):
+        self.store_path = store_path
+        self.flush_every = flush_every
+        self.buffer = []
+        self.buffered_polls = 0
+        self.day = None
+        self.state = pl.DataFrame(schema = {col: OCCUPANCY_SCHEMA[col] for col in ["id"] + OCCUPANCY_COLUMNS})
+
+        # Carry on from the latest day already stored, so a restart doesn't write a full snapshot
+        files = _partition_files(store_path)
+        if files:
+            latest = os.path.dirname(files[-1])
+            self.day = datetime.strptime(os.path.basename(latest)[5:], "%Y-%m-%d").date()
+            self.state = latest_counts(pl.scan_ipc(sorted(glob.glob(os.path.join(latest, "*.arrow"))))).collect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def append(self, occupancy, polled_at):
+        """
+        A function which adds one poll to the store.
+
+        Parameters
+        ----------
+        occupancy: dataframe
+            From parse_occupancy.
+        polled_at: datetime
+            When the poll was taken, timezone aware.
+
+        Returns
+        --------
+        changed: int
+            The number of rows written for this poll.
+        """
+        occupancy = occupancy.select(pl.col("id"), pl.col(OCCUPANCY_COLUMNS).cast(pl.Int16))
+        day = polled_at.astimezone(timezone.utc).date()
+        if day != self.day:
+            # A new day starts with every station, so its partition doesn't depend on the previous one
+            self.flush()
+            if self.day is not None:
+                compact_partition(_partition_dir(self.store_path, self.day))
+            self.day = day
+            changed = occupancy
+        else:
+            joined = occupancy.join(self.state, on = "id", how = "full", suffix = "_previous", coalesce = True)
+            differs = pl.any_horizontal(
+                pl.col(col).ne_missing(pl.col(col + "_previous")) for col in OCCUPANCY_COLUMNS
+            )
+            changed = joined.filter(differs).select(["id"] + OCCUPANCY_COLUMNS)
+        self.state = occupancy
+
+        if len(changed):
+            self.buffer.append(changed.select(pl.lit(polled_at).cast(OCCUPANCY_SCHEMA["time"]).alias("time"), pl.all()))
+        self.buffered_polls += 1
+        if self.buffered_polls >= self.flush_every:
+            self.flush()
+        return len(changed)
+
+    def flush(self):
+        """
+        Writes the buffered polls to a new part file in the current day's partition.
+        """
+        if self.buffer:
+            data = pl.concat(self.buffer)
+            first = data["time"][0]
+            _write(data, os.path.join(_partition_dir(self.store_path, self.day), f"part-{first:%H%M%S%f}.arrow"))
+        self.buffer = []
+        self.buffered_polls = 0
+
+
+def collect(bikepoint_api, store_path, interval = 60, polls = None, flush_every = FLUSH_EVERY):
+    """
+    A function which polls the BikePoint feed every interval seconds and appends the dock counts to the store.
+
+    Polls are kept on a fixed schedule, so a slow download doesn't make the next one late. A failed poll is
+    reported and skipped. Runs until polls polls have been made, or forever if polls is None.
+
+    Returns
+    --------
+    rows: int
+        The number of rows written.
+    """
+    validators = {}
+    rows = 0
+    made = 0
+    next_poll = time.monotonic()
+    with OccupancyStore(store_path, flush_every) as store:
+        while polls is None or made < polls:
+            now = datetime.now(timezone.utc)
+            try:
+                occupancy = fetch_occupancy(bikepoint_api, validators)
+            except (requests.RequestException, IndexError, pl.exceptions.PolarsError) as error:
+                print(f"{now:%Y-%m-%d %H:%M:%S} poll failed: {error}")
+                occupancy = None
+            if occupancy is not None:
+                rows += store.append(occupancy, now)
+            made += 1
+            # If a poll overran a whole interval, skip the missed polls rather than making them back to back
+            next_poll = max(next_poll + interval, time.monotonic())
+            if polls is None or made < polls:
+                time.sleep(max(0, next_poll - time.monotonic()))
+    return rows
+
+
+def scan_occupancy(store_path, start = None, end = None):
+    """
+    A function which lazily scans the stored rows between start and end, only opening the partitions of those days.
+
+    Returns
+    --------
+    occupancy: lazyframe
+        Columns time, id and OCCUPANCY_COLUMNS. Each row is a change (or a day's first snapshot) of one station.
+    """
+    files = _partition_files(store_path, start, end)
+    if not files:
+        return pl.LazyFrame(schema = OCCUPANCY_SCHEMA)
+    occupancy = pl.scan_ipc(files)
+    if start is not None:
+        occupancy = occupancy.filter(pl.col("time") >= start)
+    if end is not None:
+        occupancy = occupancy.filter(pl.col("time") <= end)
+    return occupancy
+
+
+def latest_counts(occupancy):
+    """
+    The last row of every station in a scan of the store, leaving out stations which have left the feed.
+    """
+    return (
+        occupancy.sort("time", maintain_order = True)
+        .group_by("id").last()
+        .filter(pl.col("nb_docks").is_not_null())
+        .select(["id"] + OCCUPANCY_COLUMNS)
+        .sort("id")
+    )
+
+
+def _day_start(at):
+    return at.astimezone(timezone.utc).replace(hour = 0, minute = 0, second = 0, microsecond = 0)
+
+
+def snapshot(store_path, at):
+    """
+    A function which finds the dock counts of every station as they were at a (timezone aware) time.
+
+    Only the partition of that day is read, since it starts with a full snapshot. Before the day's first poll,
+    the counts are those the latest earlier partition ended with.
+
+    Returns
+    --------
+    occupancy: dataframe
+        Columns id and OCCUPANCY_COLUMNS.
+    """
+    counts = latest_counts(scan_occupancy(store_path, _day_start(at), at)).collect()
+    if len(counts) == 0:
+        earlier = _partition_files(store_path, end = _day_start(at) - timedelta(days = 1))
+        if earlier:
+            latest = os.path.dirname(earlier[-1])
+            counts = latest_counts(pl.scan_ipc([path for path in earlier if os.path.dirname(path) == latest])).collect()
+    return counts
+
+
+def _window(store_path, start, end):
+    """
+    Every station's counts at start followed by its changes up to end, with how long each row held for.
+    Rows for stations which left the feed are kept, with null counts.
+    """
+    at_start = snapshot(store_path, start).lazy().select(pl.lit(start).cast(OCCUPANCY_SCHEMA["time"]).alias("time"), pl.all())
+    changes = scan_occupancy(store_path, start + timedelta(milliseconds = 1), end)
+    return (
+        pl.concat([at_start, changes])
+        .sort("id", "time")
+        .with_columns(
+            (pl.col("time").shift(-1).over("id").fill_null(pl.lit(end).cast(OCCUPANCY_SCHEMA["time"])) - pl.col("time"))
+            .dt.total_milliseconds().alias("held_ms")
+        )
+    )
+
+
+def station_summary(store_path, start, end):
+    """
+    A function which summarises each station's occupancy between start and end, weighting each count by how long it held.
+
+    Returns
+    --------
+    summary: dataframe
+        One row per station: mean_bikes, mean_empty_docks, share_empty (of the time with no bikes),
+        share_full (of the time with no empty docks) and changes (the number of times its counts changed).
+    """
+    window = _window(store_path, start, end).filter(pl.col("nb_docks").is_not_null())
+    held = pl.col("held_ms")
+    return (
+        window.group_by("id")
+        .agg(
+            ((pl.col("nb_bikes") * held).sum() / held.sum()).alias("mean_bikes"),
+            ((pl.col("nb_empty_docks") * held).sum() / held.sum()).alias("mean_empty_docks"),
+            (held.filter(pl.col("nb_bikes") == 0).sum() / held.sum()).alias("share_empty"),
+            (held.filter(pl.col("nb_empty_docks") == 0).sum() / held.sum()).alias("share_full"),
+            (pl.len() - 1).alias("changes"),
+        )
+        .sort("id")
+        .collect()
+    )
+
+
+def network_totals(store_path, start, end, every = "15m"):
+    """
+    A function which totals the bikes, empty docks and docks across the whole network at regular times
+    between start and end.
+
+    Each station's changes are turned into differences from its previous counts, so a running sum over all
+    changes gives the network total after each one, and each time takes the total of the last change before it.
+
+    Returns
+    --------
+    totals: dataframe
+        Columns time, nb_bikes, nb_empty_docks and nb_docks.
+    """
+    totals_columns = ["nb_bikes", "nb_empty_docks", "nb_docks"]
+    window = _window(store_path, start, end)
+    running = (
+        window.with_columns(pl.col(totals_columns).cast(pl.Int32).fill_null(0))
+        .with_columns((pl.col(col) - pl.col(col).shift(1, fill_value = 0).over("id")) for col in totals_columns)
+        .sort("time", maintain_order = True)
+        .select(pl.col("time"), pl.col(totals_columns).cum_sum())
+        .group_by("time", maintain_order = True).last()
+    )
+    times = pl.LazyFrame({
+        "time": pl.datetime_range(start, end, every, time_unit = "ms", time_zone = "UTC", eager = True)
+    })
+    return times.join_asof(running, on = "time", strategy = "backward").collect()
@@ -0,0 +1,146 @@
+"""
+out_of_core.py
+---------------
+Streaming versions of the steps which grow with the number of stations and rows, for England-wide, multi-scheme
+or trip-level data that won't fit in memory as eager frames.
+
+Large tables are Arrow IPC files, or folders of them read as one table. Station coordinates are read CHUNK_ROWS at a
+time as NumPy arrays, located and counted, and only the running counts (one per LSOA) are kept between chunks.
+Stations are located in the LSOA boundaries when there are some (locate_stations), or else approximately, by the
+nearest LSOA centroid (count_stations).
+Aggregations run on Polars' streaming engine, which works through its inputs in batches instead of loading them.
+"""
+import os
+
+import numpy as np
+import polars as pl
+
+from modules.spatial_join import count_lsoas
+from modules.station_distance import StationIndex
+
+CHUNK_ROWS = 1_000_000
+# Stations further than this from every LSOA centroid are taken to be outside the LSOAs and not counted
+MAX_CENTROID_DISTANCE_M = 2_000
+
+
+def scan_table(path):
+    """
+    A function which lazily scans an Arrow IPC file, or every .arrow file in a folder as one table.
+    """
+    return pl.scan_ipc(os.path.join(path, "*.arrow") if os.path.isdir(path) else path)
+
+
+def engine(streaming):
+    """
+    The Polars engine to collect with: "streaming" to work through the inputs in batches, or "auto".
+    """
+    return "streaming" if streaming else "auto"
+
+
+def coordinate_chunks(path, chunk_rows = CHUNK_ROWS):
+    """
+    A function which reads the lat and lon columns of a table chunk_rows at a time.
+
+    Parameters
+    ----------
+    path: str
+        An Arrow IPC file or folder of them (see scan_table).
+    chunk_rows: int or None
+        Rows per chunk. None reads the whole table as one chunk.
+
+    Returns
+    --------
+    chunks: iterator of (array, array)
+        The latitudes and longitudes of each chunk.
+    """
+    coordinates = scan_table(path).select(pl.col("lat").cast(pl.Float64), pl.col("lon").cast(pl.Float64))
+    if chunk_rows is None:
+        batches = [coordinates.collect()]
+    else:
+        batches = coordinates.collect_batches(chunk_size = chunk_rows, engine = "streaming")
+    for batch in batches:
+        yield batch["lat"].to_numpy(), batch["lon"].to_numpy()
+
+
+def locate_stations(path, index, chunk_rows = CHUNK_ROWS):
+    """
+    A function which counts the stations in each LSOA, finding the LSOA polygon each station is in.
+
+    Parameters
+    ----------
+    path: str
+        An Arrow IPC file or folder of them with lat and lon columns, e.g. from benchmarks/synthetic.py.
+    index: LsoaIndex
+        The LSOA boundaries, from spatial_join.load_index.
+    chunk_rows: int or None
+        Stations to locate at a time. None locates them all at once.
+
+    Returns
+    --------
+    la_dataframe: dataframe
+        A dataframe with two columns: lsoa and count, in the layout of la_counts.csv. Stations outside every LSOA
+        are dropped.
+    """
+    # Only each chunk's counts are kept, at most one row per LSOA
+    counts = [count_lsoas(index, lats, lons, chunk_size = max(1, len(lats))) for lats, lons in coordinate_chunks(path, chunk_rows)]
+    if not counts:
+        return pl.DataFrame(schema = {"lsoa": pl.Utf8, "count": pl.Int64})
+    return pl.concat(counts).group_by("lsoa", maintain_order = True).agg(pl.col("count").sum().cast(pl.Int64))
+
+
+def count_stations(path, centroids, chunk_rows = CHUNK_ROWS, max_distance_m = MAX_CENTROID_DISTANCE_M):
+    """
+    A function which counts the stations in each LSOA, assigning each station to the LSOA with the nearest centroid.
+
+    This is an approximation, for when there are no LSOA boundaries to use locate_stations with: near a boundary
+    the nearest centroid can belong to the neighbouring LSOA, especially where small LSOAs border large ones.
+
+    Parameters
+    ----------
+    path: str
+        An Arrow IPC file or folder of them with lat and lon columns, e.g. from benchmarks/synthetic.py.
+    centroids: dataframe
+        Columns lsoa, lat and lon (like data/lsoa_centroids.csv).
+    chunk_rows: int or None
+        Stations to locate at a time. None locates them all at once.
+    max_distance_m: float
+        Stations further than this from every centroid are outside the centroids' coverage and aren't counted.
+
+    Returns
+    --------
+    la_dataframe: dataframe
+        A dataframe with two columns: lsoa and count, in the layout of la_counts.csv.
+    """
+    # The KD-tree works for any points, here the centroids rather than stations
+    index = StationIndex(centroids["lat"].to_numpy(), centroids["lon"].to_numpy())
+    counts = np.zeros(len(centroids), dtype = np.int64)
+    for lats, lons in coordinate_chunks(path, chunk_rows):
+        if len(lats) == 0:
+            continue
+        distance, nearest = index.nearest(lats, lons)
+        counts += np.bincount(nearest[distance <= max_distance_m], minlength = len(counts))
+    return pl.DataFrame({"lsoa": centroids["lsoa"], "count": counts}).filter(pl.col("count") > 0)
+
+
+def scan_la_indicator_means(path, lsoas):
+    """
+    A function which averages an LSOA level indicator panel over the LSOAs of each local authority.
+
+    Parameters
+    ----------
+    path: str
+        An Arrow IPC file or folder of them with columns lsoa, indicator, period, year and value.
+    lsoas: LazyFrame
+        Columns lsoa and la_name, e.g. from clean_data.scan_deprivation.
+
+    Returns
+    --------
+    panel: LazyFrame
+        In the long layout of modules/indicator_panel.py: la_name, indicator, period, year and value.
+    """
+    return (
+        scan_table(path)
+        .join(lsoas.select("lsoa", "la_name"), on = "lsoa")
+        .group_by("la_name", "indicator", "period", "year")
+        .agg(pl.col("value").mean())
+    )
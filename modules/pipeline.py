@@ -0,0 +1,213 @@
+"""
+pipeline.py
+------------
+Runs a set of stages that depend on each other's files, redoing only what has changed.
+
+Each stage declares the files it reads and writes. Before a stage runs, the content hashes of its inputs,
+its parameters and the source of the code it calls are combined into a key. If the key matches the last
+successful run and its outputs are still as it left them, the stage is skipped. A stage whose outputs come out
+byte-for-byte the same as before therefore leaves everything downstream skipped too.
+
+Stages whose dependencies have finished run at the same time, each in its own process. The processes are
+spawned rather than forked, since forking a process which has already used Polars' thread pool can deadlock.
+"""
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from modules import instrumentation
+
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    Parameters
+    ----------
+    name: str
+        Identifies the stage.
+    function: function
+        A module level function (so it can be sent to another process), called as function(**params).
+    inputs: list of str
+        Files the stage reads. Files which don't exist are allowed, and hash as missing.
+    outputs: list of str
+        Files the stage writes.
+    after: list of str
+        Stages which must finish first.
+    params: dict
+        Keyword arguments for function, which are part of the key.
+    always: bool
+        Run every time, e.g. for a download, which has no input files to say whether anything changed.
+    """
+
+    def __init__(self, name, function, inputs = (), outputs = (), after = (), params = None, always = False):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.after = list(after)
+        self.params = params or {}
+        self.always = always
+
+
+def _load_state(state_path):
+    if not os.path.exists(state_path):
+        return {"files": {}, "stages": {}}
+    with open(state_path, "r") as f:
+        return json.load(f)
+
+
+def _save_state(state, state_path):
+    with open(state_path + ".tmp", "w") as f:
+        json.dump(state, f, indent = 1)
+    os.replace(state_path + ".tmp", state_path)
+
+
+def file_hash(path, state):
+    """
+    The SHA-256 of a file's contents, or None if it doesn't exist.
+    Hashes are remembered in state and only recomputed when a file's size or modification time changes.
+    """
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    known = state["files"].get(path)
+    if known is not None and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+        return known["hash"]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    state["files"][path] = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": digest.hexdigest()}
+    return digest.hexdigest()
+
+
+def _code_hash(function):
+    # The whole file the function is defined in, since it will usually call other functions there
+    with open(inspect.getsourcefile(function), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def stage_key(stage, state):
+    """
+    Combines the hashes of a stage's inputs, its parameters and its code into one key.
+    """
+    key = {
+        "inputs": {path: file_hash(path, state) for path in stage.inputs},
+        "params": stage.params,
+        "code": _code_hash(stage.function),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys = True, default = str).encode()).hexdigest()
+
+
+def up_to_date(stage, key, state):
+    """
+    Whether a stage last ran successfully with the same key, and its outputs haven't changed since.
+    """
+    previous = state["stages"].get(stage.name)
+    if stage.always or previous is None or previous["key"] != key:
+        return False
+    return all(file_hash(path, state) == previous["outputs"].get(path) for path in stage.outputs)
+
+
+def _order(stages):
+    """
+    Checks every dependency exists and there are no cycles.
+
+    Raises
+    ------
+    Value Error
+        If a stage depends on an unknown stage or the stages depend on each other in a loop.
+    """
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        for name in stage.after:
+            if name not in names:
+                raise ValueError(f"Stage {stage.name} depends on unknown stage {name}.")
+    done = set()
+    remaining = list(stages)
+    while remaining:
+        ready = [stage for stage in remaining if set(stage.after) <= done]
+        if not ready:
+            raise ValueError("The stages depend on each other in a loop: " + ", ".join(stage.name for stage in remaining))
+        done.update(stage.name for stage in ready)
+        remaining = [stage for stage in remaining if stage.name not in done]
+
+
+def run_pipeline(stages, state_path, max_workers = None, force = (), log = print):
+    """
+    A function which runs the stages in dependency order, skipping those which are up to date and running
+    independent ones in parallel processes.
+
+    Parameters
+    ----------
+    stages: list of Stage
+        The pipeline.
+    state_path: str
+        A JSON file recording file hashes and what each stage last ran with.
+    max_workers: int or None
+        The most stages run at once. None uses one process per CPU.
+    force: collection of str
+        Stages to run even if they are up to date.
+    log: function
+        Called with a line of progress per stage.
+
+    Returns
+    --------
+    ran: list of str
+        The stages which ran, in the order they finished.
+
+    Raises
+    ------
+    Value Error
+        If the stages can't be ordered (see _order).
+    Any error raised by a stage. The stages which finished before it are recorded, so a re-run picks up from there.
+    """
+    _order(stages)
+    state = _load_state(state_path)
+    by_name = {stage.name: stage for stage in stages}
+    waiting = dict(by_name)
+    finished = set()
+    ran = []
+    running = {}
+
+    with ProcessPoolExecutor(max_workers = max_workers, mp_context = multiprocessing.get_context("spawn")) as pool:
+        try:
+            while waiting or running:
+                for name, stage in list(waiting.items()):
+                    if not set(stage.after) <= finished:
+                        continue
+                    del waiting[name]
+                    key = stage_key(stage, state)
+                    if name not in force and up_to_date(stage, key, state):
+                        log(f"{name}: up to date")
+                        instrumentation.count("pipeline.skipped")
+                        finished.add(name)
+                        continue
+                    running[pool.submit(stage.function, **stage.params)] = (stage, key, time.perf_counter())
+                if not running:
+                    # Everything skipped this round may have unblocked more stages
+                    continue
+                done, _ = wait(running, return_when = FIRST_COMPLETED)
+                for future in done:
+                    stage, key, start = running.pop(future)
+                    future.result()
+                    state["stages"][stage.name] = {
+                        "key": key,
+                        "outputs": {path: file_hash(path, state) for path in stage.outputs},
+                    }
+                    _save_state(state, state_path)
+                    instrumentation.record("pipeline." + stage.name, time.perf_counter() - start)
+                    log(f"{stage.name}: ran in {time.perf_counter() - start:.2f}s")
+                    finished.add(stage.name)
+                    ran.append(stage.name)
+        except BaseException:
+            for future in running:
+                future.cancel()
+            _save_state(state, state_path)
+            raise
+    return ran
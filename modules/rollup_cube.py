@@ -0,0 +1,141 @@
+"""
+rollup_cube.py
+---------------
+BikePoint counts, deprivation and obesity summed up from LSOAs to every larger area of London, for drilling down
+from London to its local authorities, their MSOAs and their LSOAs.
+
+MSOAs are named after the LSOAs they contain, less the LSOA's letter ("Camden 001A" is in MSOA "Camden 001"),
+so no lookup file is needed. Each LSOA row is stacked once for each level it belongs to and the whole cube is
+then one group_by, rather than re-aggregating each level from the one below.
+
+The cube is sorted by level and then parent, so the areas inside any area are one contiguous slice of it.
+RollupCube indexes those slices once, so every lookup is a dict lookup and a zero-copy slice.
+"""
+import polars as pl
+
+# From the largest area to the smallest
+LEVELS = ["london", "la", "msoa", "lsoa"]
+LONDON = "London"
+
+
+def msoa_name(lsoa_name):
+    """
+    The expression for the MSOA of an LSOA name column: the name less its final letter.
+    """
+    return lsoa_name.str.replace(r"[A-Z]$", "")
+
+
+def scan_cube(lsoa_data, measures):
+    """
+    A function which sums up LSOA data to every MSOA, local authority and London as a whole.
+
+    Parameters
+    ----------
+    lsoa_data: LazyFrame
+        One row per LSOA, with columns lsoa, lsoa_name, la_name, bikepoints (the number of BikePoints in it) and
+        the measures.
+    measures: list of str
+        The columns to average over the LSOAs of each area, e.g. deprivation rank. Measures only known for
+        local authorities (like obesity) are given to each of their LSOAs, so every area's value is
+        weighted by its number of LSOAs.
+
+    Returns
+    --------
+    cube: LazyFrame
+        One row per area: level (one of LEVELS), key (the LSOA code, or the name of any larger area), name,
+        parent (the key of the area it is in, null for London), lsoas, bikepoints, lsoas_with_bikepoint,
+        bikepoints_per_lsoa, share_with_bikepoint and the mean of each measure.
+        LSOAs have similar populations, so BikePoints per LSOA is also a BikePoint density per resident.
+    """
+    lsoa_data = lsoa_data.with_columns(msoa_name(pl.col("lsoa_name")).alias("msoa"))
+    values = [pl.col("bikepoints")] + [pl.col(measure) for measure in measures]
+    level = pl.Enum(LEVELS)
+    stacked = pl.concat([
+        lsoa_data.select(
+            pl.lit(name, dtype = level).alias("level"), key.alias("key"), area_name.alias("name"),
+            parent.cast(pl.Utf8).alias("parent"), *values,
+        )
+        for name, key, area_name, parent in [
+            ("lsoa", pl.col("lsoa"), pl.col("lsoa_name"), pl.col("msoa")),
+            ("msoa", pl.col("msoa"), pl.col("msoa"), pl.col("la_name")),
+            ("la", pl.col("la_name"), pl.col("la_name"), pl.lit(LONDON)),
+            ("london", pl.lit(LONDON), pl.lit(LONDON), pl.lit(None)),
+        ]
+    ])
+    return (
+        stacked.group_by("level", "key")
+        .agg(
+            pl.col("name").first(),
+            pl.col("parent").first(),
+            pl.len().alias("lsoas"),
+            pl.col("bikepoints").sum(),
+            (pl.col("bikepoints") > 0).sum().alias("lsoas_with_bikepoint"),
+            *[pl.col(measure).mean() for measure in measures],
+        )
+        .with_columns(
+            pl.col("lsoas").cast(pl.Int64),
+            pl.col("lsoas_with_bikepoint").cast(pl.Int64),
+            (pl.col("bikepoints") / pl.col("lsoas")).alias("bikepoints_per_lsoa"),
+            (pl.col("lsoas_with_bikepoint") / pl.col("lsoas")).alias("share_with_bikepoint"),
+        )
+        .sort("level", "parent", "key", nulls_last = False)
+    )
+
+
+class RollupCube:
+    """
+    Constant time lookups of areas and the areas inside them, over a cube from scan_cube.
+
+    Parameters
+    ----------
+    cube: dataframe
+        The collected cube, in the order scan_cube sorts it (e.g. its typed copy from data_store, memory-mapped).
+    """
+
+    def __init__(self, cube):
+        self.cube = cube
+        levels = cube["level"].cast(pl.Utf8).to_list()
+        keys = cube["key"].to_list()
+        parents = cube["parent"].to_list()
+        self.rows = {(level, key): row for row, (level, key) in enumerate(zip(levels, keys))}
+        # Each (level, parent) is one run of rows, so the start and end of every run are found in one sweep
+        self.runs = {}
+        start = 0
+        for row in range(1, len(keys) + 1):
+            if row == len(keys) or (levels[row], parents[row]) != (levels[start], parents[start]):
+                self.runs[(levels[start], parents[start])] = (start, row)
+                start = row
+
+    def __contains__(self, area):
+        return area in self.rows
+
+    def area(self, level, key):
+        """
+        The row of one area as a dict.
+
+        Raises
+        ------
+        Key Error
+            If there is no such area.
+        """
+        return self.cube.row(self.rows[(level, key)], named = True)
+
+    def children(self, level, key):
+        """
+        The areas directly inside an area, as a dataframe (empty for an LSOA).
+        """
+        depth = LEVELS.index(level)
+        if depth + 1 == len(LEVELS):
+            return self.cube.clear()
+        start, end = self.runs.get((LEVELS[depth + 1], key), (0, 0))
+        return self.cube.slice(start, end - start)
+
+    def path(self, level, key):
+        """
+        The (level, key) of an area and every area it is in, from London down.
+        """
+        path = [(level, key)]
+        while level != LEVELS[0]:
+            level, key = LEVELS[LEVELS.index(level) - 1], self.area(level, key)["parent"]
+            path.insert(0, (level, key))
+        return path
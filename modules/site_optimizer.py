@@ -0,0 +1,267 @@
+"""
+site_optimizer.py
+------------------
+Chooses where new BikePoints would do the most public health good.
+
+Every London LSOA not already within walking distance of a BikePoint is a demand point, weighted by a mix of
+its deprivation and its local authority's obesity rates. A dense grid of candidate sites is laid over London,
+and each candidate covers the demand points within COVERAGE_RADIUS_M of it. Candidates are only valuable if
+they join up with the network, so each candidate's coverage is scaled down the further it is from a station.
+
+Sites are picked greedily: the candidate with the best score is taken, the demand it covers is removed from
+every other candidate's score, and candidates near the new site count it as part of the network. Only the
+scores of the candidates touching the newly covered LSOAs or the new site are recomputed at each step, so
+re-running with different weights takes well under a second even with 100k+ candidates.
+
+The built grid can be saved as plain .npy files and loaded memory-mapped, so every worker process of the
+dashboard shares one copy of it through the operating system's page cache instead of building its own.
+"""
+import os
+
+import numpy as np
+import polars as pl
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+from modules import data_store
+from modules.station_distance import StationIndex, chord_to_metres, metres_to_chord, to_unit_vectors
+
+# Deprivation is always available; the rest are local authority columns of model_data.csv
+DEFAULT_WEIGHTS = {
+    "deprivation": 1.0,
+    "adults_obese": 1.0,
+    "11_yearolds_obese": 0.5,
+}
+# How far people will walk to a BikePoint
+COVERAGE_RADIUS_M = 500
+# Sites further than this from any station get no benefit from the network
+ADJACENCY_RADIUS_M = 3000
+GRID_SPACING_M = 150
+
+METRES_PER_DEGREE_LAT = 111_320
+
+
+def load_demand(file_path):
+    """
+    A function which gathers the demand points: every London LSOA with its centroid, deprivation rank and local authority indicators.
+
+    Needs data/lsoa_centroids.csv (see clean_data.py --centroids).
+
+    Returns
+    --------
+    demand: dataframe
+        Columns lsoa, lat, lon, la_name, rank and the model_data.csv indicator columns.
+    """
+    deprivation_data = data_store.load(file_path + "deprivation.csv").select(
+        pl.col("LSOA code (2011)").alias("lsoa"),
+        pl.col("Local Authority District code (2019)").alias("la_code"),
+        pl.col("Local Authority District name (2019)").alias("la_name"),
+        pl.col("Index of Multiple Deprivation (IMD) Rank").alias("rank"),
+    )
+    london = deprivation_data.filter(pl.col("la_code").str.starts_with("E09")).drop("la_code")
+    model_data = data_store.load(file_path + "model_data.csv").drop("rank", "bikepoint", "bikepoint_binary")
+    return (
+        data_store.load(file_path + "lsoa_centroids.csv")
+        .join(london, on = "lsoa")
+        .join(model_data, on = "la_name", how = "left")
+    )
+
+
+class SiteProblem:
+    """
+    The candidate grid and which demand points each candidate covers. Built once, then solved for any weights.
+
+    Parameters
+    ----------
+    demand: dataframe
+        From load_demand.
+    bikepoints: dataframe
+        The existing BikePoints, with lat and lon columns.
+    spacing_m: float
+        Distance between neighbouring candidate sites.
+    coverage_radius_m, adjacency_radius_m: float
+        See COVERAGE_RADIUS_M and ADJACENCY_RADIUS_M.
+    """
+
+    def __init__(self, demand, bikepoints, spacing_m = GRID_SPACING_M, coverage_radius_m = COVERAGE_RADIUS_M, adjacency_radius_m = ADJACENCY_RADIUS_M):
+        self.demand = demand
+        self.coverage_radius_m = coverage_radius_m
+        self.adjacency_radius_m = adjacency_radius_m
+        demand_points = to_unit_vectors(demand["lat"].to_numpy(), demand["lon"].to_numpy())
+        demand_tree = cKDTree(demand_points)
+
+        # LSOAs already within walking distance of a station aren't worth covering again
+        stations = StationIndex(bikepoints["lat"].to_numpy(), bikepoints["lon"].to_numpy())
+        self.already_covered = stations.count_within(demand["lat"].to_numpy(), demand["lon"].to_numpy(), coverage_radius_m) > 0
+
+        # A regular grid over the demand points, keeping only candidates that cover at least one of them
+        lat_min, lat_max = demand["lat"].min(), demand["lat"].max()
+        lon_min, lon_max = demand["lon"].min(), demand["lon"].max()
+        lat_step = spacing_m / METRES_PER_DEGREE_LAT
+        lon_step = lat_step / np.cos(np.radians((lat_min + lat_max) / 2))
+        lats, lons = np.meshgrid(np.arange(lat_min, lat_max + lat_step, lat_step), np.arange(lon_min, lon_max + lon_step, lon_step))
+        lats = lats.ravel()
+        lons = lons.ravel()
+        covered = demand_tree.query_ball_point(to_unit_vectors(lats, lons), metres_to_chord(coverage_radius_m), workers = -1)
+        counts = np.fromiter((len(c) for c in covered), dtype = np.int64, count = len(covered))
+        keep = counts > 0
+        self.lats = lats[keep]
+        self.lons = lons[keep]
+        self.points = to_unit_vectors(self.lats, self.lons)
+        self.tree = cKDTree(self.points)
+
+        # Candidate x demand incidence, and its transpose for the incremental updates
+        indices = np.concatenate([np.asarray(c, dtype = np.int64) for c, k in zip(covered, keep) if k])
+        indptr = np.concatenate([[0], np.cumsum(counts[keep])])
+        self.covers = sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape = (len(self.lats), len(demand)))
+        self.covered_by = self.covers.T.tocsr()
+        self.network_distance, _ = stations.nearest(self.lats, self.lons)
+
+    # Everything save() writes, each as its own .npy file
+    SAVED_ARRAYS = ["lats", "lons", "already_covered", "network_distance", "covers_data", "covers_indices",
+                    "covers_indptr", "covered_by_data", "covered_by_indices", "covered_by_indptr"]
+
+    def save(self, directory):
+        """
+        A function which saves the candidate grid to directory, for load.
+        """
+        os.makedirs(directory, exist_ok = True)
+        arrays = {
+            "lats": self.lats, "lons": self.lons, "already_covered": self.already_covered,
+            "network_distance": self.network_distance,
+            "covers_data": self.covers.data, "covers_indices": self.covers.indices, "covers_indptr": self.covers.indptr,
+            "covered_by_data": self.covered_by.data, "covered_by_indices": self.covered_by.indices,
+            "covered_by_indptr": self.covered_by.indptr,
+        }
+        for name in self.SAVED_ARRAYS:
+            with open(os.path.join(directory, name + ".npy.tmp"), "wb") as f:
+                np.save(f, arrays[name])
+            os.replace(os.path.join(directory, name + ".npy.tmp"), os.path.join(directory, name + ".npy"))
+
+    @classmethod
+    def load(cls, directory, demand, coverage_radius_m = COVERAGE_RADIUS_M, adjacency_radius_m = ADJACENCY_RADIUS_M):
+        """
+        A function which loads a candidate grid saved by save, memory-mapped rather than read into memory.
+
+        Parameters
+        ----------
+        directory: str
+            Where save put it.
+        demand: dataframe
+            From load_demand, as the grid was built with.
+        coverage_radius_m, adjacency_radius_m: float
+            As the grid was built with.
+
+        Returns
+        --------
+        problem: SiteProblem
+
+        Raises
+        ------
+        Value Error
+            If the saved grid was built for a different number of demand points.
+        """
+        arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode = "r") for name in cls.SAVED_ARRAYS}
+        if len(arrays["already_covered"]) != len(demand):
+            raise ValueError(f"The saved grid is for {len(arrays['already_covered'])} demand points, not {len(demand)}.")
+        problem = cls.__new__(cls)
+        problem.demand = demand
+        problem.coverage_radius_m = coverage_radius_m
+        problem.adjacency_radius_m = adjacency_radius_m
+        problem.lats = arrays["lats"]
+        problem.lons = arrays["lons"]
+        problem.already_covered = arrays["already_covered"]
+        problem.network_distance = arrays["network_distance"]
+        problem.points = to_unit_vectors(problem.lats, problem.lons)
+        problem.tree = cKDTree(problem.points)
+        n_candidates, n_demand = len(problem.lats), len(demand)
+        problem.covers = sparse.csr_matrix(
+            (arrays["covers_data"], arrays["covers_indices"], arrays["covers_indptr"]),
+            shape = (n_candidates, n_demand), copy = False,
+        )
+        problem.covered_by = sparse.csr_matrix(
+            (arrays["covered_by_data"], arrays["covered_by_indices"], arrays["covered_by_indptr"]),
+            shape = (n_demand, n_candidates), copy = False,
+        )
+        return problem
+
+    def demand_weights(self, weights):
+        """
+        Each demand point's weight: the weighted sum of its indicators, each scaled to 0-1 over London
+        (for deprivation, 1 is the most deprived). Missing indicators count as 0.
+
+        Raises
+        ------
+        Key Error
+            If a weight names an indicator that isn't in the demand data.
+        """
+        total = np.zeros(len(self.demand))
+        for name, weight in weights.items():
+            if weight == 0:
+                continue
+            if name == "deprivation":
+                values = -self.demand["rank"].cast(pl.Float64)
+            else:
+                values = self.demand[name].cast(pl.Float64)
+            low, high = values.min(), values.max()
+            scaled = ((values - low) / (high - low)) if high is not None and high > low else values * 0
+            total += weight * scaled.fill_null(0).fill_nan(0).to_numpy()
+        return total
+
+    def _adjacency(self, distance):
+        return np.clip(1 - distance / self.adjacency_radius_m, 0, 1)
+
+    def solve(self, weights = DEFAULT_WEIGHTS, k = 5):
+        """
+        A function which greedily picks k sites maximising the weighted demand covered, scaled by adjacency to the network.
+
+        Returns
+        --------
+        sites: dataframe
+            One row per chosen site, in the order chosen: rank, lat, lon, score, lsoas_covered, demand_covered,
+            network_distance_m and la_name (of the nearest covered LSOA).
+        """
+        remaining = self.demand_weights(weights) * ~self.already_covered
+        gain = self.covers @ remaining
+        network_distance = self.network_distance.copy()
+        score = gain * self._adjacency(network_distance)
+        # Subtracting covered demand leaves rounding residue behind, which mustn't count as a site covering something
+        tolerance = 1e-9 * score.max(initial = 0)
+        chosen = []
+        for _ in range(k):
+            site = int(np.argmax(score))
+            if score[site] <= tolerance:
+                break
+            lsoas = self.covers.indices[self.covers.indptr[site]: self.covers.indptr[site + 1]]
+            newly_covered = lsoas[remaining[lsoas] > 0]
+            chosen.append({
+                "lat": self.lats[site],
+                "lon": self.lons[site],
+                "score": score[site],
+                "lsoas_covered": len(newly_covered),
+                "demand_covered": gain[site],
+                "network_distance_m": network_distance[site],
+                "la_name": self.demand["la_name"][int(lsoas[np.argmax(remaining[lsoas])])],
+            })
+
+            # Remove the newly covered demand from every candidate that also covered it
+            starts = self.covered_by.indptr[newly_covered]
+            ends = self.covered_by.indptr[newly_covered + 1]
+            lengths = ends - starts
+            candidates = self.covered_by.indices[np.repeat(starts, lengths) + np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)]
+            np.subtract.at(gain, candidates, np.repeat(remaining[newly_covered], lengths))
+            remaining[newly_covered] = 0
+
+            # The new site is now part of the network for the candidates around it
+            nearby = np.asarray(self.tree.query_ball_point(self.points[site], metres_to_chord(self.adjacency_radius_m)), dtype = np.int64)
+            distance = chord_to_metres(np.linalg.norm(self.points[nearby] - self.points[site], axis = 1))
+            network_distance[nearby] = np.minimum(network_distance[nearby], distance)
+
+            touched = np.union1d(candidates, nearby)
+            score[touched] = gain[touched] * self._adjacency(network_distance[touched])
+
+        sites = pl.DataFrame(chosen, schema = {
+            "lat": pl.Float64, "lon": pl.Float64, "score": pl.Float64, "lsoas_covered": pl.Int64,
+            "demand_covered": pl.Float64, "network_distance_m": pl.Float64, "la_name": pl.Utf8,
+        })
+        return sites.with_row_index("rank", offset = 1)
@@ -0,0 +1,270 @@
+"""
+spatial_join.py
+----------------
+Offline assignment of latitudes / longitudes to LSOAs from a local boundary file.
+
+This replaces the postcodes.io round-trip in get_data.py when a boundary file is available.
+Boundaries are read once from GeoJSON (e.g. the ONS "LSOA (2011) Boundaries" download, in WGS84),
+flattened into NumPy edge arrays and bucketed into a uniform grid so that each point is only
+tested against the few polygons whose bounding boxes overlap its grid cell.
+"""
+import json
+import os
+
+import numpy as np
+import polars as pl
+
+# Property holding the LSOA code in the ONS boundary files
+LSOA_PROPERTY = "LSOA11CD"
+# Bump when the layout of the saved index changes
+INDEX_VERSION = 1
+# Upper bound on point x edge comparisons done in one NumPy operation
+CHUNK_SIZE = 2_000_000
+# Points located at a time by count_lsoas, which bounds the size of locate's candidate arrays
+POINT_CHUNK_SIZE = 1_000_000
+
+
+class LsoaIndex:
+    """
+    A grid spatial index over LSOA polygons.
+
+    Every polygon is stored as a flat run of edges (x0, y0, x1, y1), where x is longitude and y is latitude.
+    Holes and multi-part polygons need no special treatment as the even-odd crossing rule covers both.
+    """
+
+    def __init__(self, codes, bounds, edge_start, edges, grid_bounds, grid_shape, cell_start, cell_polygons):
+        self.codes = codes
+        self.bounds = bounds
+        self.edge_start = edge_start
+        self.edges = edges
+        self.grid_bounds = grid_bounds
+        self.grid_shape = grid_shape
+        self.cell_start = cell_start
+        self.cell_polygons = cell_polygons
+
+    @classmethod
+    def from_geojson(cls, boundary_path, code_property = LSOA_PROPERTY):
+        """
+        Builds the index from a GeoJSON FeatureCollection of Polygons / MultiPolygons.
+
+        Raises
+        ------
+        Value Error
+            If a feature is not a Polygon or MultiPolygon.
+        """
+        with open(boundary_path, "r") as f:
+            features = json.load(f)["features"]
+
+        codes = []
+        edge_start = [0]
+        edge_blocks = []
+        for feature in features:
+            geometry = feature["geometry"]
+            if geometry["type"] == "Polygon":
+                rings = geometry["coordinates"]
+            elif geometry["type"] == "MultiPolygon":
+                rings = [ring for polygon in geometry["coordinates"] for ring in polygon]
+            else:
+                raise ValueError(f"Unsupported geometry type: {geometry['type']}")
+            polygon_edges = []
+            for ring in rings:
+                ring = np.asarray(ring, dtype = np.float64)[:, :2]
+                # Close the ring if the file doesn't
+                if not np.array_equal(ring[0], ring[-1]):
+                    ring = np.vstack([ring, ring[:1]])
+                polygon_edges.append(np.hstack([ring[:-1], ring[1:]]))
+            polygon_edges = np.vstack(polygon_edges)
+            edge_blocks.append(polygon_edges)
+            edge_start.append(edge_start[-1] + len(polygon_edges))
+            codes.append(feature["properties"][code_property])
+
+        edges = np.vstack(edge_blocks)
+        edge_start = np.asarray(edge_start, dtype = np.int64)
+        bounds = np.column_stack([
+            np.minimum.reduceat(np.minimum(edges[:, 0], edges[:, 2]), edge_start[:-1]),
+            np.minimum.reduceat(np.minimum(edges[:, 1], edges[:, 3]), edge_start[:-1]),
+            np.maximum.reduceat(np.maximum(edges[:, 0], edges[:, 2]), edge_start[:-1]),
+            np.maximum.reduceat(np.maximum(edges[:, 1], edges[:, 3]), edge_start[:-1]),
+        ])
+        return cls._with_grid(np.asarray(codes), bounds, edge_start, edges)
+
+    @classmethod
+    def _with_grid(cls, codes, bounds, edge_start, edges):
+        """
+        Buckets every polygon into each grid cell its bounding box overlaps.
+        Roughly one polygon per cell keeps the candidate lists short.
+        """
+        grid_bounds = np.array([bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max()])
+        side = max(1, int(np.ceil(np.sqrt(len(codes)))))
+        grid_shape = np.array([side, side])
+
+        lo = cls._cells(grid_bounds, grid_shape, bounds[:, 0], bounds[:, 1])
+        hi = cls._cells(grid_bounds, grid_shape, bounds[:, 2], bounds[:, 3])
+        cell_ids = []
+        polygon_ids = []
+        for polygon, (x0, y0), (x1, y1) in zip(range(len(codes)), lo, hi):
+            xs, ys = np.meshgrid(np.arange(x0, x1 + 1), np.arange(y0, y1 + 1))
+            cells = (ys * side + xs).ravel()
+            cell_ids.append(cells)
+            polygon_ids.append(np.full(len(cells), polygon))
+        cell_ids = np.concatenate(cell_ids)
+        polygon_ids = np.concatenate(polygon_ids)
+        order = np.argsort(cell_ids, kind = "stable")
+        cell_start = np.zeros(side * side + 1, dtype = np.int64)
+        np.cumsum(np.bincount(cell_ids, minlength = side * side), out = cell_start[1:])
+        return cls(codes, bounds, edge_start, edges, grid_bounds, grid_shape, cell_start, polygon_ids[order])
+
+    @staticmethod
+    def _cells(grid_bounds, grid_shape, xs, ys):
+        """
+        Converts coordinates into (column, row) grid cells, clipped to the grid.
+        """
+        width = max(grid_bounds[2] - grid_bounds[0], 1e-12)
+        height = max(grid_bounds[3] - grid_bounds[1], 1e-12)
+        col = np.floor((np.asarray(xs) - grid_bounds[0]) / width * grid_shape[0]).astype(np.int64)
+        row = np.floor((np.asarray(ys) - grid_bounds[1]) / height * grid_shape[1]).astype(np.int64)
+        return np.column_stack([np.clip(col, 0, grid_shape[0] - 1), np.clip(row, 0, grid_shape[1] - 1)])
+
+    def save(self, index_path):
+        """
+        Saves the prebuilt index so later runs can skip parsing the boundary file.
+        """
+        np.savez(
+            index_path,
+            version = INDEX_VERSION,
+            codes = self.codes,
+            bounds = self.bounds,
+            edge_start = self.edge_start,
+            edges = self.edges,
+            grid_bounds = self.grid_bounds,
+            grid_shape = self.grid_shape,
+            cell_start = self.cell_start,
+            cell_polygons = self.cell_polygons,
+        )
+
+    @classmethod
+    def load(cls, index_path):
+        """
+        Loads an index written by save.
+
+        Raises
+        ------
+        Value Error
+            If the index was written by an incompatible version.
+        """
+        with np.load(index_path, allow_pickle = False) as saved:
+            if int(saved["version"]) != INDEX_VERSION:
+                raise ValueError(f"Index version {int(saved['version'])} is not {INDEX_VERSION}, rebuild it.")
+            return cls(
+                saved["codes"], saved["bounds"], saved["edge_start"], saved["edges"],
+                saved["grid_bounds"], saved["grid_shape"], saved["cell_start"], saved["cell_polygons"],
+            )
+
+    def locate(self, lats, lons):
+        """
+        Finds the LSOA containing each point.
+
+        Parameters
+        ----------
+        lats, lons: array-like of float
+            The latitudes and longitudes of the points.
+
+        Returns
+        --------
+        lsoas: numpy array
+            The LSOA code of each point, or None where the point is outside every polygon.
+        """
+        ys = np.asarray(lats, dtype = np.float64)
+        xs = np.asarray(lons, dtype = np.float64)
+        polygon_of_point = np.full(len(xs), -1, dtype = np.int64)
+
+        # Candidate (point, polygon) pairs from the point's grid cell
+        cells = self._cells(self.grid_bounds, self.grid_shape, xs, ys)
+        cells = cells[:, 1] * self.grid_shape[0] + cells[:, 0]
+        starts = self.cell_start[cells]
+        counts = self.cell_start[cells + 1] - starts
+        points = np.repeat(np.arange(len(xs)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        polygons = self.cell_polygons[np.repeat(starts, counts) + offsets]
+
+        # Cheap bounding box rejection before the edge tests
+        box = self.bounds[polygons]
+        keep = (xs[points] >= box[:, 0]) & (xs[points] <= box[:, 2]) & (ys[points] >= box[:, 1]) & (ys[points] <= box[:, 3])
+        points = points[keep]
+        polygons = polygons[keep]
+
+        # Test all the points of one polygon against its edges at once
+        order = np.argsort(polygons, kind = "stable")
+        points = points[order]
+        polygons = polygons[order]
+        breaks = np.flatnonzero(np.diff(polygons)) + 1
+        for group in np.split(np.arange(len(polygons)), breaks):
+            if len(group) == 0:
+                continue
+            polygon = polygons[group[0]]
+            edges = self.edges[self.edge_start[polygon]: self.edge_start[polygon + 1]]
+            group_points = points[group]
+            step = max(1, CHUNK_SIZE // len(edges))
+            for chunk_start in range(0, len(group_points), step):
+                chunk = group_points[chunk_start: chunk_start + step]
+                inside = _crossings(xs[chunk], ys[chunk], edges) % 2 == 1
+                # A point on a shared border keeps the first polygon it was found in
+                hits = chunk[inside & (polygon_of_point[chunk] == -1)]
+                polygon_of_point[hits] = polygon
+
+        lsoas = np.full(len(xs), None, dtype = object)
+        found = polygon_of_point >= 0
+        lsoas[found] = self.codes[polygon_of_point[found]]
+        return lsoas
+
+
+def _crossings(xs, ys, edges):
+    """
+    Counts how many edges a ray from each point towards +x crosses.
+    """
+    x0, y0, x1, y1 = (edges[:, i][None, :] for i in range(4))
+    px = xs[:, None]
+    py = ys[:, None]
+    straddles = (y0 > py) != (y1 > py)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        x_cross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+    return np.count_nonzero(straddles & (px < x_cross), axis = 1)
+
+
+def load_index(boundary_path, code_property = LSOA_PROPERTY):
+    """
+    Loads the index for a boundary file, building and saving it alongside the file if it is missing or out of date.
+    """
+    index_path = os.path.splitext(boundary_path)[0] + ".index.npz"
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(boundary_path):
+        try:
+            return LsoaIndex.load(index_path)
+        except ValueError:
+            pass
+    index = LsoaIndex.from_geojson(boundary_path, code_property)
+    index.save(index_path)
+    return index
+
+
+def count_lsoas(index, lats, lons, chunk_size = POINT_CHUNK_SIZE):
+    """
+    A function which counts how many points fall in each LSOA, locating chunk_size points at a time.
+
+    Returns
+    --------
+    la_dataframe: dataframe
+        A dataframe with two columns: lsoa and count. Points outside every LSOA are dropped.
+    """
+    lats = np.asarray(lats, dtype = np.float64)
+    lons = np.asarray(lons, dtype = np.float64)
+    counts = [
+        # As a list, since Polars can't read an object array starting with a point outside every LSOA as strings
+        pl.DataFrame({"lsoa": pl.Series(index.locate(lats[start: start + chunk_size], lons[start: start + chunk_size]).tolist(), dtype = pl.Utf8)})
+        .drop_nulls()
+        .group_by("lsoa", maintain_order = True)
+        .agg(pl.len().alias("count"))
+        for start in range(0, len(lats), chunk_size)
+    ]
+    if not counts:
+        return pl.DataFrame(schema = {"lsoa": pl.Utf8, "count": pl.UInt32})
+    return pl.concat(counts).group_by("lsoa", maintain_order = True).agg(pl.col("count").sum())
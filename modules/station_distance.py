@@ -0,0 +1,112 @@
+"""
+station_distance.py
+--------------------
+How close each LSOA is to the BikePoint network: the distance to its nearest station and how many stations are within walking distance.
+
+Points are placed on the unit sphere and indexed with a KD-tree. The straight-line (chord) distance between two
+points on the sphere only depends on the great-circle distance between them, so nearest neighbours and radius
+searches on the tree give exact haversine answers without evaluating haversine for every pair.
+"""
+import numpy as np
+import polars as pl
+from scipy.spatial import cKDTree
+
+# Mean radius of the Earth
+EARTH_RADIUS_M = 6_371_008.8
+# Distances stations are counted within
+COVERAGE_RADII_M = (500,)
+
+
+def to_unit_vectors(lats, lons):
+    """
+    Converts latitudes and longitudes in degrees to an (n, 3) array of points on the unit sphere.
+    """
+    lat = np.radians(np.asarray(lats, dtype = np.float64))
+    lon = np.radians(np.asarray(lons, dtype = np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def metres_to_chord(metres):
+    return 2 * np.sin(np.asarray(metres) / (2 * EARTH_RADIUS_M))
+
+
+def chord_to_metres(chord):
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+class StationIndex:
+    """
+    A KD-tree over station locations, answering great-circle distance queries in metres.
+    """
+
+    def __init__(self, lats, lons):
+        self.tree = cKDTree(to_unit_vectors(lats, lons))
+
+    def nearest(self, lats, lons):
+        """
+        The distance in metres to, and the position of, the nearest station to each point.
+        """
+        chord, index = self.tree.query(to_unit_vectors(lats, lons), k = 1, workers = -1)
+        return chord_to_metres(chord), index
+
+    def count_within(self, lats, lons, radius_m):
+        """
+        The number of stations within radius_m metres of each point.
+        """
+        return self.tree.query_ball_point(
+            to_unit_vectors(lats, lons), metres_to_chord(radius_m), return_length = True, workers = -1
+        )
+
+
+def station_coverage(centroids, bikepoints, radii = COVERAGE_RADII_M):
+    """
+    A function which measures how close every LSOA centroid is to the BikePoint network.
+
+    Parameters
+    ----------
+    centroids: dataframe
+        Columns lsoa, lat and lon.
+    bikepoints: dataframe
+        The BikePoints, with lat and lon columns.
+    radii: sequence of int
+        Distances in metres to count stations within.
+
+    Returns
+    --------
+    coverage: dataframe
+        Columns lsoa, nearest_bikepoint_m and one bikepoints_within_<radius>m column per radius.
+    """
+    index = StationIndex(bikepoints["lat"].to_numpy(), bikepoints["lon"].to_numpy())
+    lats = centroids["lat"].to_numpy()
+    lons = centroids["lon"].to_numpy()
+    distance, _ = index.nearest(lats, lons)
+    return pl.DataFrame(
+        [centroids["lsoa"], pl.Series("nearest_bikepoint_m", distance)]
+        + [pl.Series(f"bikepoints_within_{radius}m", index.count_within(lats, lons, radius)) for radius in radii]
+    )
+
+
+def centroids_from_boundaries(index):
+    """
+    A function which finds the centroid of every LSOA polygon in a spatial_join.LsoaIndex.
+
+    Uses the area-weighted (shoelace) centroid of each polygon's edges, treating longitude / latitude as planar,
+    which is accurate to within metres at LSOA scale. Degenerate polygons fall back to their bounding box centre.
+
+    Returns
+    --------
+    centroids: dataframe
+        Columns lsoa, lat and lon.
+    """
+    x0, y0, x1, y1 = index.edges.T
+    starts = index.edge_start[:-1]
+    cross = x0 * y1 - x1 * y0
+    area = np.add.reduceat(cross, starts) / 2
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        lon = np.add.reduceat((x0 + x1) * cross, starts) / (6 * area)
+        lat = np.add.reduceat((y0 + y1) * cross, starts) / (6 * area)
+    degenerate = np.abs(area) < 1e-15
+    lon[degenerate] = (index.bounds[degenerate, 0] + index.bounds[degenerate, 2]) / 2
+    lat[degenerate] = (index.bounds[degenerate, 1] + index.bounds[degenerate, 3]) / 2
+    return pl.DataFrame({"lsoa": index.codes.tolist(), "lat": lat, "lon": lon})
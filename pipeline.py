@@ -0,0 +1,204 @@
+"""
+pipeline.py
+------------
+This script refreshes everything: it downloads the BikePoints, geocodes them, cleans the deprivation and obesity
+data, builds model_data.csv and renders the maps and figures for run_model.py.
+
+Each step only runs if something it reads has changed since it last ran (see modules/pipeline.py), and steps
+which don't depend on each other run at the same time. A refresh where TfL reports no new stations downloads
+the feed and does nothing else.
+"""
+import argparse
+import importlib.util
+
+from modules import data_store
+from modules.pipeline import Stage, run_pipeline
+
+# File paths where data, maps and figures will be stored
+file_path = "data/"
+map_path = "maps/"
+artifact_path = "artifacts/"
+
+BIKEPOINT_API = "https://api.tfl.gov.uk/BikePoint/"
+POSTCODES_API = "https://api.postcodes.io/postcodes"
+
+
+def served_copies(path):
+    """
+    A file the maps are served from and the compressed copies map_layers.compress writes next to it
+    (.gz, and .br if brotli is installed).
+    """
+    return [path, path + ".gz"] + ([path + ".br"] if importlib.util.find_spec("brotli") else [])
+
+
+# Each stage imports what it needs itself, so a run where everything is up to date doesn't import Dash etc.
+def fetch_bikepoints(bikepoint_api):
+    import get_data
+    get_data.get_bikepoints(bikepoint_api)
+
+
+def geocode(postcodes_api, boundaries = None):
+    import get_data
+    from modules.geocoding import reverse_geocode
+    from modules.spatial_join import load_index
+
+    # The geocode cache knows where every station was last time, so the previous download isn't needed
+    bikepoints = data_store.load(file_path + "bikepoints.csv")
+    if boundaries:
+        lookup = lambda lats, lons: load_index(boundaries).locate(lats, lons).tolist()
+        get_data.refresh_la_counts(bikepoints, None, lookup, source = boundaries)
+    else:
+        lookup = lambda lats, lons: reverse_geocode(postcodes_api, lats, lons)
+        get_data.refresh_la_counts(bikepoints, None, lookup, source = postcodes_api)
+
+
+def clean_csvs(csv_names):
+    # Parses and types each csv into data/store/, where build_model_data reads it from
+    for csv_name in csv_names:
+        data_store.ipc_path(file_path + csv_name)
+
+
+def build_model_data():
+    import clean_data
+    import polars as pl
+    model_data, panel, cube = pl.collect_all([
+        clean_data.build_model_data(file_path), clean_data.scan_indicator_panel(file_path), clean_data.build_rollup_cube(file_path),
+    ])
+    data_store.write(model_data, file_path + "model_data.csv")
+    data_store.write(panel, file_path + "indicator_panel.csv")
+    data_store.write(cube, file_path + "rollup_cube.csv")
+
+
+def cut_deprivation_tiles(boundaries):
+    import run_model
+    run_model.build_deprivation_tiles(boundaries)
+
+
+def render_maps(map_mode = "layer"):
+    import run_model
+    bikepoints = data_store.load(file_path + "bikepoints.csv")
+    run_model.build_maps(bikepoints, map_mode, run_model.recommend_sites(bikepoints))
+
+
+def build_figures():
+    import run_model
+    run_model.build_figures()
+
+
+def build_stages(fetch = True, boundaries = None, map_mode = "layer", bikepoint_api = BIKEPOINT_API, postcodes_api = POSTCODES_API):
+    """
+    A function which declares the pipeline's stages, the files each reads and writes, and which stages each waits for.
+
+    The code each stage runs is listed with its inputs, so changing it re-runs the stage.
+
+    Parameters
+    ----------
+    fetch: bool
+        Whether to download the BikePoints. If False the existing bikepoints.csv is used.
+    boundaries: str or None
+        A GeoJSON of LSOA boundaries to geocode offline with, instead of postcodes.io, and to cut into the maps'
+        deprivation tiles.
+    map_mode: str
+        See run_model.build_maps.
+    bikepoint_api, postcodes_api: str
+        The APIs to download and geocode from.
+
+    Returns
+    --------
+    stages: list of Stage
+    """
+    bikepoints = file_path + "bikepoints.csv"
+    centroids = file_path + "lsoa_centroids.csv"
+    obesity_csvs = ["childhood_obesity.csv", "adult_obesity.csv"]
+    tile_manifest = map_path + "tiles/deprivation/tiles.json"
+    fetched = ["fetch_bikepoints"] if fetch else []
+    tiled = ["deprivation_tiles"] if boundaries else []
+
+    stages = [
+        Stage(
+            "geocode", geocode,
+            inputs = [bikepoints, "get_data.py", "modules/geocode_cache.py", "modules/geocoding.py", "modules/spatial_join.py"]
+            + ([boundaries] if boundaries else []),
+            outputs = [file_path + "la_counts.csv"],
+            after = fetched,
+            params = {"postcodes_api": postcodes_api, "boundaries": boundaries},
+        ),
+        Stage(
+            "clean_deprivation", clean_csvs,
+            inputs = [file_path + "deprivation.csv", "modules/data_store.py"],
+            outputs = [data_store.copy_path(file_path + "deprivation.csv")],
+            params = {"csv_names": ["deprivation.csv"]},
+        ),
+        Stage(
+            "clean_obesity", clean_csvs,
+            inputs = [file_path + name for name in obesity_csvs] + ["modules/data_store.py"],
+            outputs = [data_store.copy_path(file_path + name) for name in obesity_csvs],
+            params = {"csv_names": obesity_csvs},
+        ),
+        Stage(
+            "model_data", build_model_data,
+            inputs = [
+                file_path + "la_counts.csv", bikepoints, centroids, "clean_data.py", "modules/station_distance.py",
+                "modules/indicator_panel.py", "modules/rollup_cube.py", data_store.copy_path(file_path + "deprivation.csv"),
+            ] + [data_store.copy_path(file_path + name) for name in obesity_csvs],
+            outputs = [file_path + "model_data.csv", file_path + "indicator_panel.csv", file_path + "rollup_cube.csv"],
+            after = ["geocode", "clean_deprivation", "clean_obesity"],
+        ),
+        Stage(
+            "render_maps", render_maps,
+            # The recommended sites are scored with model_data.csv
+            inputs = [
+                bikepoints, centroids, file_path + "model_data.csv", data_store.copy_path(file_path + "deprivation.csv"),
+                tile_manifest, "run_model.py", "modules/map_layers.py", "modules/site_optimizer.py",
+            ],
+            # Every file it writes, so a missing or changed one (e.g. the stations layer the pages load) re-runs it
+            outputs = [
+                path for name in ["map_1.html", "map_2.html"] + ([] if map_mode == "markers" else ["stations.geojson"])
+                for path in served_copies(map_path + name)
+            ],
+            after = ["model_data"] + tiled,
+            params = {"map_mode": map_mode},
+        ),
+        Stage(
+            "build_figures", build_figures,
+            inputs = [
+                file_path + "model_data.csv", file_path + "indicator_panel.csv",
+                "run_model.py", "modules/model_stats.py", "modules/indicator_panel.py",
+            ],
+            outputs = [
+                artifact_path + "aggregates.arrow",
+                artifact_path + "deprivation_plot.json",
+                artifact_path + "bar_figures.json",
+                artifact_path + "model_stats.arrow",
+                artifact_path + "period_aggregates.arrow",
+            ],
+            after = ["model_data"],
+        ),
+    ]
+    if boundaries:
+        stages.append(Stage(
+            "deprivation_tiles", cut_deprivation_tiles,
+            inputs = [boundaries, data_store.copy_path(file_path + "deprivation.csv"), "run_model.py", "modules/lsoa_tiles.py"],
+            outputs = [tile_manifest],
+            after = ["clean_deprivation"],
+            params = {"boundaries": boundaries},
+        ))
+    if fetch:
+        stages.insert(0, Stage(
+            "fetch_bikepoints", fetch_bikepoints, outputs = [bikepoints], params = {"bikepoint_api": bikepoint_api}, always = True
+        ))
+    return stages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Refresh the data, model and dashboard artifacts, redoing only what has changed.")
+    parser.add_argument("--no-fetch", action = "store_true", help = "Use the existing bikepoints.csv rather than downloading it.")
+    parser.add_argument("--boundaries", help = "GeoJSON of LSOA boundaries. If given, LSOAs are assigned offline instead of through postcodes.io.")
+    parser.add_argument("--map-mode", choices = ["layer", "cluster", "markers"], default = "layer", help = "How stations are drawn on the maps.")
+    parser.add_argument("--workers", type = int, help = "The most stages run at once. Defaults to one per CPU.")
+    parser.add_argument("--force", nargs = "*", metavar = "STAGE", help = "Run these stages (or every stage, if none are named) even if they are up to date.")
+    args = parser.parse_args()
+
+    stages = build_stages(fetch = not args.no_fetch, boundaries = args.boundaries, map_mode = args.map_mode)
+    force = [stage.name for stage in stages] if args.force == [] else (args.force or [])
+    run_pipeline(stages, file_path + "pipeline_state.json", max_workers = args.workers, force = force)
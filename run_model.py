@@ -3,20 +3,37 @@ run_model.py
 -------------
 This script creates the interactive model.
 When it is run, Dash should run on a local port and it should just open in the browser.
+
+The analysis (maps, aggregates and static figures) is built once into artifacts and the app is created
+from those, so starting the dashboard only imports Dash and Polars. The artifacts are rebuilt whenever
+the data or this script are newer than them, or when run with --build.
+
+Run on its own, this is the development server, with Dash's debugger and reloader. --production serves
+without them, with compressed responses. To serve with several worker processes, use wsgi.py.
 """
 
-import folium
-import polars as pl
-import pandas as pd
-from dash import Dash, dcc, html, Input, Output, callback
-import plotly.express as px
+import argparse
+import json
+import math
+import os
+from functools import lru_cache
 from threading import Timer
-import statsmodels.api as sm 
 
-from modules.dash_visualisation import open_browser
+import polars as pl
+from dash import ALL, Dash, dcc, html, Input, Output, State
+
+from modules import data_store, instrumentation
+from modules.dash_visualisation import compress_responses, open_browser, serve_directory
+from modules.indicator_panel import LATEST, indicator_periods
+from modules.model_stats import model_statistics
 
 file_path = "data/"
 map_path = "maps/"
+artifact_path = "artifacts/"
+# The site optimizer's candidate grid, shared (memory-mapped) by every worker of the dashboard
+site_problem_path = artifact_path + "site_problem/"
+# The LSOA deprivation choropleth tiles (see modules/lsoa_tiles.py)
+tile_path = map_path + "tiles/deprivation/"
 
 # Accessible colour scheme
 ONS_COLOURS = {
@@ -28,255 +45,826 @@ ONS_COLOURS = {
     "Light purple": "#A285D1",
 }
 
-# 1) Where London’s BikePoints are currently
-# 1a) Visual map
-full_demographics_data = pl.read_csv(file_path + "model_data.csv")
-bikepoints = pl.read_csv(file_path + "bikepoints.csv")
-list_of_locations = list(zip(list(bikepoints["lat"]), list(bikepoints["lon"])))
-
-center_of_london = [51.5074, -0.1272]
-map_1 = folium.Map(location=center_of_london, zoom_start= 12)
-for point in list_of_locations:
-    folium.CircleMarker(point, radius = 2).add_to(map_1)
-map_1.save(map_path + "map_1.html")
-
-# Logistic Regression - Won't be printed but useful to know
-log_reg_data = full_demographics_data.drop(["bikepoint", "la_name"]).drop_nulls()
-X = log_reg_data.drop("bikepoint_binary")
-y = log_reg_data["bikepoint_binary"]
-# log_reg = sm.Logit(y.to_pandas(), X.to_pandas()).fit()
-"""
-Regression Findings
---------------------
-# Obesity decreased post-BikePoint introduction
-# Overweight-ness increased by less post-BikePoint introduction
-# Neither childhood obesity nor overweightness correlate with BikePoint placement at Reception level
-# Neither childhood obesity nor overweightness correlate with BikePoint placement at Y6 level
-# Adults are less overweight in areas with BikePoints
-# Deprivation is higher in areas with BikePoints
-# Otherwise, deprivation usually correlates positively with obesity / overweight
-"""
-# 2) Where might benefit from new BikePoints from a public health perspective
-# Mean journey = 17 mins
-# Network effects mean they have to be proximal
-# i) Nearby, best choice, biasing for deprevation / obesity (SE)
-map_2 = map_1
-old_kent_road = [51.482892245020764, -0.08350725324780937]
-okr_quote = """
-    <h4> Strongly Recommended: South East </h4>
-    New bikepoints would be useful here because they:
-    <ol>
-    <li>Would easily integrate with existing BikePoints to the North, West and East</li>
-    <li>Cover an area of above average deprivation and obesity</li>
-    <li>Move towards areas of high obesity and deprivation (SE / E London)</li>
-    </ol>
-    </p>
-    """
-folium.CircleMarker(old_kent_road, radius = 40, color = "green", popup = folium.Popup(okr_quote, min_width = 300, max_width = 300)).add_to(map_2)
-
-# ii) Nearby, second best, high deprivation, not as good network (E)
-canning_town = [51.52536687233129, -0.009067582695335391]
-ct_quote = """
-    <h4> Consider: East </h4>
-    New bikepoints would be useful here because they:
-    <ol>
-    <li>Would easily integrate with existing BikePoints to the West</li>
-    <li>Cover an area of above average deprivation and obesity</li>
-    <li>Move towards areas of higher deprivation (E London)</li>
-    </ol>
-    </p>
-    """
-folium.CircleMarker(canning_town, radius = 40, color = "yellow", popup = folium.Popup(ct_quote, min_width = 300, max_width = 300)).add_to(map_2)
-
-# iii) Nearby, towards some deprivation, worse network (N)
-islington = [51.53865911744296, -0.10777669328734478]
-is_quote = """
-    <h4> Consider: North </h4>
-    New bikepoints would be useful here because they:
-    <ol>
-    <li>Would easily integrate with existing bikepoints to the South</li>
-    <li>Cover an area of above average deprivation and obesity</li>
-    <li>Move towards areas of moderate obesity (N London)</li>
-    </ol>
-    </p>
-    """
-folium.CircleMarker(islington, radius = 40, color = "yellow", popup = folium.Popup(is_quote, min_width = 300, max_width = 300)).add_to(map_2)
-
-# iv) Worst choice, towards affluence and crowded richmond park (SW)
-richmond = [51.46533077682026, -0.243703010739770381]
-rich_quote = """
-    <h4> Not Recommended: South West </h4>
-    New BikePoints would not likely bring much benefit here as:
-    <ol>
-    <li>The area is high affluence and low obesity</li>
-    <li>There are already heavily congested roads for cyclists due to Richmond park</li>
-    <li>It moves towards areas of lower obesity (Affluent W/ SW London)</li>
-    </ol>
-    </p>
-    """
-folium.CircleMarker(richmond, radius = 70, color = "red", popup = folium.Popup(rich_quote, min_width = 300, max_width = 300)).add_to(map_2)
-
-# v) Worst choice, towards afluence and Kew / chiswick (SW)
-chiswick = [51.49289581291107, -0.25124804822200003]
-chis_quote = """
-    <h4> Not Recommended: West </h4>
-    New BikePoints would not likely bring much benefit here as:
-    <ol>
-    <li>The area is high affluence and low obesity</li>
-    <li>It moves towards areas of lower obesity (Affluent W/ SW London)</li>
-    </ol>
-    </p>
-    """
-folium.CircleMarker(chiswick, radius = 70, color = "red", popup = folium.Popup(chis_quote, min_width = 300, max_width = 300)).add_to(map_2)
-map_2.save(map_path + "map_2.html")
-
-# 3) Any other insights from the data you think are relevant or will capture the interest of the decision maker
-# How deprivation relates to BikePoints
-deprivation_plot = px.bar(
-            log_reg_data.group_by(pl.col("bikepoint_binary")).mean(), 
-            x= "bikepoint_binary",
-            y = "rank",
-            color = "bikepoint_binary",
-            color_discrete_map = {True : ONS_COLOURS["Dark blue"], False: ONS_COLOURS["Orange"]},
-            hover_data = ["rank"]
+# Everything the app is created from, and everything that goes into them
+ARTIFACTS = [
+    map_path + "map_1.html",
+    map_path + "map_2.html",
+    artifact_path + "aggregates.arrow",
+    artifact_path + "deprivation_plot.json",
+    artifact_path + "bar_figures.json",
+    artifact_path + "model_stats.arrow",
+    artifact_path + "period_aggregates.arrow",
+]
+ARTIFACT_INPUTS = [
+    file_path + "model_data.csv",
+    file_path + "indicator_panel.csv",
+    file_path + "bikepoints.csv",
+    file_path + "lsoa_centroids.csv",
+    tile_path + "tiles.json",
+    __file__,
+]
+
+# IMD deciles, from 1 (most deprived, red) to 10 (least deprived, blue)
+DEPRIVATION_COLOURS = ["#a50026", "#d73027", "#f46d43", "#fdae61", "#fee090", "#e0f3f8", "#abd9e9", "#74add1", "#4575b4", "#313695"]
+
+# The y-axis range of each bar graph
+BAR_GRAPHS = {
+    "obesity_bar_graph": [0, 60],
+    "change_bar_graph": [-3, +3],
+}
+
+# The measures that can be compared across the areas of the drill-down (see modules/rollup_cube.py)
+DRILL_DOWN_MEASURES = [
+    "bikepoints", "bikepoints_per_lsoa", "share_with_bikepoint", "rank",
+    "adults_obese", "adults_overweight", "11_yearolds_obese", "5_yearolds_obese",
+]
+DRILL_DOWN_LEVELS = {"london": "London", "la": "Local Authority", "msoa": "MSOA", "lsoa": "LSOA"}
+
+# The indicators planners can weight when searching for new sites (see modules/site_optimizer.py)
+SITE_WEIGHTS = ["deprivation", "adults_obese", "adults_overweight", "11_yearolds_obese", "5_yearolds_obese"]
+
+def bar_graph_options(aggregates):
+    """
+    The columns that can be chosen in each bar graph's dropdown.
+    """
+    return {
+        "obesity_bar_graph": aggregates.select(
+            # The BikePoint proximity columns aren't percentages, so don't belong on this graph
+            pl.exclude("bikepoint_binary", "rank", "overweight_change", "obese_change", "^nearest_bikepoint_m$", "^bikepoints_within_.*m$")
+        ).columns,
+        "change_bar_graph": ["overweight_change", "obese_change"],
+    }
+
+def period_means(full_demographics_data):
+    """
+    A function which averages every indicator in every time period over local authorities with and without BikePoints.
+
+    Returns
+    --------
+    period_aggregates: dataframe
+        Columns indicator, period, year, bikepoint_binary and value.
+
+    Raises
+    ------
+    File Not Found Error
+        If data/indicator_panel.csv hasn't been made yet (see clean_data.py), as the dashboard would have no
+        time periods to show.
+    """
+    if not os.path.exists(file_path + "indicator_panel.csv"):
+        raise FileNotFoundError("The figures need data/indicator_panel.csv for the time periods (run clean_data.py).")
+    return (
+        data_store.load(file_path + "indicator_panel.csv")
+        .join(full_demographics_data.select("la_name", "bikepoint_binary"), on = "la_name")
+        .group_by("indicator", "period", "year", "bikepoint_binary")
+        .agg(pl.col("value").mean())
+        .sort("indicator", "year", "bikepoint_binary")
+    )
+
+def period_options(periods, col_chosen):
+    """
+    The choices of the time period dropdown for col_chosen: the latest data, then every period it has, newest first.
+    """
+    return [{"label": "Latest", "value": LATEST}] + [{"label": period, "value": period} for period in periods.get(col_chosen, [])]
+
+def site_popup(site):
+    """
+    The popup text for one of the optimizer's recommended sites.
+    """
+    return f"""
+        <h4> Recommended site {site["rank"]}: {site["la_name"]} </h4>
+        New BikePoints would be useful here because they:
+        <ol>
+        <li>Would be {site["network_distance_m"]:,.0f}m from the nearest existing BikePoint</li>
+        <li>Cover {site["lsoas_covered"]} LSOAs with no BikePoint within walking distance</li>
+        <li>Score {site["demand_covered"]:.2f} on deprivation and obesity across those LSOAs</li>
+        </ol>
+        </p>
+        """
+
+@instrumentation.timed()
+def build_maps(bikepoints, map_mode = "layer", sites = None):
+    """
+    A function which draws the BikePoint map (map_1) and the expansion recommendations map (map_2) and saves them to map_path.
+
+    Parameters
+    ----------
+    bikepoints: dataframe
+        The BikePoints to draw.
+    map_mode: str
+        "layer" draws every station on one canvas from the shared stations.geojson, "cluster" does the same but
+        clusters nearby stations, and "markers" inlines one folium CircleMarker per station.
+    sites: dataframe or None
+        Recommended sites from site_optimizer. If None, the hand-picked recommendations are drawn instead.
+    """
+    import folium
+    from modules.lsoa_tiles import load_manifest
+    from modules.map_layers import ChoroplethTileLayer, StationLayer, compress, write_stations_geojson
+
+    # 1) Where London’s BikePoints are currently
+    # 1a) Visual map
+    center_of_london = [51.5074, -0.1272]
+    map_1 = folium.Map(location=center_of_london, zoom_start= 12)
+    if map_mode == "markers":
+        # One (n, 2) array rather than a list of tuples
+        locations = bikepoints.select(pl.col("lat").cast(pl.Float64), pl.col("lon").cast(pl.Float64)).to_numpy()
+        for point in locations:
+            folium.CircleMarker(point.tolist(), radius = 2).add_to(map_1)
+    else:
+        version = write_stations_geojson(bikepoints, map_path + "stations.geojson")
+        StationLayer(f"/maps/stations.geojson?v={version}", radius = 2, cluster = map_mode == "cluster").add_to(map_1)
+    # Deprivation under the stations, if the tiles have been cut (see build_deprivation_tiles)
+    manifest = load_manifest(tile_path)
+    if manifest is not None:
+        ChoroplethTileLayer(
+            f"/maps/tiles/deprivation/{{z}}/{{x}}/{{y}}.json?v={manifest['version']}", manifest, DEPRIVATION_COLOURS,
+            "Deprivation (IMD decile)", legend = ("Most deprived", "Least deprived"),
+        ).add_to(map_1)
+    map_1.save(map_path + "map_1.html")
+    compress(map_path + "map_1.html")
+
+    # 2) Where might benefit from new BikePoints from a public health perspective
+    # Mean journey = 17 mins
+    # Network effects mean they have to be proximal
+    # i) Nearby, best choice, biasing for deprevation / obesity (SE)
+    map_2 = map_1
+    if sites is not None:
+        from modules.site_optimizer import COVERAGE_RADIUS_M
+
+        for site in sites.iter_rows(named = True):
+            colour = "green" if site["rank"] == 1 else "yellow"
+            folium.Circle([site["lat"], site["lon"]], radius = COVERAGE_RADIUS_M, color = colour, fill = True, popup = folium.Popup(site_popup(site), min_width = 300, max_width = 300)).add_to(map_2)
+        map_2.save(map_path + "map_2.html")
+        compress(map_path + "map_2.html")
+        return
+
+    old_kent_road = [51.482892245020764, -0.08350725324780937]
+    okr_quote = """
+        <h4> Strongly Recommended: South East </h4>
+        New bikepoints would be useful here because they:
+        <ol>
+        <li>Would easily integrate with existing BikePoints to the North, West and East</li>
+        <li>Cover an area of above average deprivation and obesity</li>
+        <li>Move towards areas of high obesity and deprivation (SE / E London)</li>
+        </ol>
+        </p>
+        """
+    folium.CircleMarker(old_kent_road, radius = 40, color = "green", popup = folium.Popup(okr_quote, min_width = 300, max_width = 300)).add_to(map_2)
+
+    # ii) Nearby, second best, high deprivation, not as good network (E)
+    canning_town = [51.52536687233129, -0.009067582695335391]
+    ct_quote = """
+        <h4> Consider: East </h4>
+        New bikepoints would be useful here because they:
+        <ol>
+        <li>Would easily integrate with existing BikePoints to the West</li>
+        <li>Cover an area of above average deprivation and obesity</li>
+        <li>Move towards areas of higher deprivation (E London)</li>
+        </ol>
+        </p>
+        """
+    folium.CircleMarker(canning_town, radius = 40, color = "yellow", popup = folium.Popup(ct_quote, min_width = 300, max_width = 300)).add_to(map_2)
+
+    # iii) Nearby, towards some deprivation, worse network (N)
+    islington = [51.53865911744296, -0.10777669328734478]
+    is_quote = """
+        <h4> Consider: North </h4>
+        New bikepoints would be useful here because they:
+        <ol>
+        <li>Would easily integrate with existing bikepoints to the South</li>
+        <li>Cover an area of above average deprivation and obesity</li>
+        <li>Move towards areas of moderate obesity (N London)</li>
+        </ol>
+        </p>
+        """
+    folium.CircleMarker(islington, radius = 40, color = "yellow", popup = folium.Popup(is_quote, min_width = 300, max_width = 300)).add_to(map_2)
+
+    # iv) Worst choice, towards affluence and crowded richmond park (SW)
+    richmond = [51.46533077682026, -0.243703010739770381]
+    rich_quote = """
+        <h4> Not Recommended: South West </h4>
+        New BikePoints would not likely bring much benefit here as:
+        <ol>
+        <li>The area is high affluence and low obesity</li>
+        <li>There are already heavily congested roads for cyclists due to Richmond park</li>
+        <li>It moves towards areas of lower obesity (Affluent W/ SW London)</li>
+        </ol>
+        </p>
+        """
+    folium.CircleMarker(richmond, radius = 70, color = "red", popup = folium.Popup(rich_quote, min_width = 300, max_width = 300)).add_to(map_2)
+
+    # v) Worst choice, towards afluence and Kew / chiswick (SW)
+    chiswick = [51.49289581291107, -0.25124804822200003]
+    chis_quote = """
+        <h4> Not Recommended: West </h4>
+        New BikePoints would not likely bring much benefit here as:
+        <ol>
+        <li>The area is high affluence and low obesity</li>
+        <li>It moves towards areas of lower obesity (Affluent W/ SW London)</li>
+        </ol>
+        </p>
+        """
+    folium.CircleMarker(chiswick, radius = 70, color = "red", popup = folium.Popup(chis_quote, min_width = 300, max_width = 300)).add_to(map_2)
+    map_2.save(map_path + "map_2.html")
+    compress(map_path + "map_2.html")
+
+@instrumentation.timed()
+def build_deprivation_tiles(boundary_path):
+    """
+    A function which cuts LSOA boundaries into tiles coloured by deprivation decile, for the maps to draw.
+
+    Parameters
+    ----------
+    boundary_path: str
+        A GeoJSON of LSOA boundaries (WGS84), e.g. the ONS LSOA 2011 boundaries for London or all of England.
+
+    Returns
+    --------
+    manifest: dict
+        See lsoa_tiles.build_tiles.
+    """
+    from modules.lsoa_tiles import build_tiles
+
+    deprivation_data = data_store.load(file_path + "deprivation.csv")
+    deciles = dict(zip(
+        deprivation_data["LSOA code (2011)"].to_list(),
+        deprivation_data["Index of Multiple Deprivation (IMD) Decile"].to_list(),
+    ))
+    return build_tiles(boundary_path, deciles, tile_path)
+
+@instrumentation.timed()
+def recommend_sites(bikepoints):
+    """
+    The site optimizer's recommendations for the expansion map, or None if data/lsoa_centroids.csv doesn't exist.
+    """
+    if not os.path.exists(file_path + "lsoa_centroids.csv"):
+        return None
+    from modules.site_optimizer import SiteProblem, load_demand
+    problem = SiteProblem(load_demand(file_path), bikepoints)
+    problem.save(site_problem_path)
+    return problem.solve()
+
+def build_artifacts(map_mode = "layer"):
+    """
+    A function which runs the analysis and saves the maps, aggregates and static figures the app is created from.
+    See build_maps for map_mode.
+    """
+    bikepoints = data_store.load(file_path + "bikepoints.csv")
+    build_maps(bikepoints, map_mode, recommend_sites(bikepoints))
+    build_figures()
+
+@instrumentation.timed()
+def build_figures():
+    """
+    A function which saves the aggregates and the static and bar graph figures the app is created from.
+    """
+    import plotly.express as px
+
+    full_demographics_data = data_store.load(file_path + "model_data.csv")
+
+    # Logistic Regression, with bootstrap intervals and permutation p-values for every indicator
+    log_reg_data = full_demographics_data.drop(["bikepoint", "la_name"]).drop_nulls()
+    statistics = model_statistics(log_reg_data, cache_dir = artifact_path + "stats/")
+    """
+    Regression Findings
+    --------------------
+    # The numbers behind these are in artifacts/model_stats.arrow and the table in Section 2
+    # Obesity decreased post-BikePoint introduction
+    # Overweight-ness increased by less post-BikePoint introduction
+    # Neither childhood obesity nor overweightness correlate with BikePoint placement at Reception level
+    # Neither childhood obesity nor overweightness correlate with BikePoint placement at Y6 level
+    # Adults are less overweight in areas with BikePoints
+    # Deprivation is higher in areas with BikePoints
+    # Otherwise, deprivation usually correlates positively with obesity / overweight
+    """
+    # The bar charts only ever show the mean of each group, so only the means are kept
+    aggregates = log_reg_data.group_by(pl.col("bikepoint_binary")).mean()
+    period_aggregates = period_means(full_demographics_data)
+
+    # 3) Any other insights from the data you think are relevant or will capture the interest of the decision maker
+    # How deprivation relates to BikePoints
+    deprivation_plot = px.bar(
+                aggregates, 
+                x= "bikepoint_binary",
+                y = "rank",
+                color = "bikepoint_binary",
+                color_discrete_map = {True : ONS_COLOURS["Dark blue"], False: ONS_COLOURS["Orange"]},
+                hover_data = ["rank"]
+                )
+    deprivation_plot.update_xaxes(categoryorder='array', categoryarray= [True, False])
+    deprivation_plot.update_layout(
+            showlegend=False,
+            title= f"How Deprivation relates to BikePoint presence in London",
+            xaxis_title="Does the local authority have a BikePoint?",
+            yaxis_title= f"Deprivation Rank (1 = Most Deprived)",
+            yaxis_range= [0, 20000]
             )
-deprivation_plot.update_xaxes(categoryorder='array', categoryarray= [True, False])
-deprivation_plot.update_layout(
-        showlegend=False,
-        title= f"How Deprivation relates to BikePoint presence in London",
-        xaxis_title="Does the local authority have a BikePoint?",
-        yaxis_title= f"Deprivation Rank (1 = Most Deprived)",
-        yaxis_range= [0, 20000]
-        )
 
-# Now the model can actually begin!
-app = Dash(__name__)
+    os.makedirs(artifact_path, exist_ok = True)
+    aggregates.write_ipc(artifact_path + "aggregates.arrow")
+    statistics.write_ipc(artifact_path + "model_stats.arrow")
+    period_aggregates.write_ipc(artifact_path + "period_aggregates.arrow")
+    with open(artifact_path + "deprivation_plot.json", "w") as f:
+        f.write(deprivation_plot.to_json())
+    # Every figure the dropdowns can show, so the browser can switch between them without asking the server.
+    # They all share one template, which is stored once rather than in every figure.
+    bar_figures = {"template": None, "figures": {}, "periods": {}}
+    for graph_id, options in bar_graph_options(aggregates).items():
+        bar_figures["figures"][graph_id] = {}
+        for col in options:
+            figure = json.loads(bar_chart(aggregates, col, BAR_GRAPHS[graph_id], statistics).to_json())
+            bar_figures["template"] = figure["layout"].pop("template")
+            bar_figures["figures"][graph_id][col] = figure
+    # And the obesity graph in each earlier time period, newest first
+    periods = indicator_periods(period_aggregates)
+    for col in bar_graph_options(aggregates)["obesity_bar_graph"]:
+        bar_figures["periods"][col] = {}
+        for period in periods.get(col, []):
+            figure = json.loads(period_bar_chart(period_aggregates, col, period).to_json())
+            figure["layout"].pop("template")
+            bar_figures["periods"][col][period] = figure
+    with open(artifact_path + "bar_figures.json", "w") as f:
+        json.dump(bar_figures, f, separators = (",", ":"))
 
-graph_df = log_reg_data
+def artifacts_stale():
+    """
+    Whether any artifact is missing or older than the data and code it is built from.
+    """
+    if not all(os.path.exists(path) for path in ARTIFACTS):
+        return True
+    inputs = [path for path in ARTIFACT_INPUTS if os.path.exists(path)]
+    return min(os.path.getmtime(path) for path in ARTIFACTS) < max(os.path.getmtime(path) for path in inputs)
+
+def bar_chart(aggregates, col_chosen, yaxis_range, statistics = None, period = None):
+    """
+    A function which plots the mean of col_chosen for local authorities with and without BikePoints.
+    If statistics (from model_stats.model_statistics) are given, the bars get their 95% confidence intervals
+    and the title the permutation test p-value of the difference, unless there was no difference to test (every
+    local authority has a BikePoint, or none does). If period is given, it goes in the title.
+    """
+    # Only needed once a dropdown is used, so kept off the startup path
+    import plotly.express as px
+
+    error_bars = {}
+    title_suffix = ""
+    row = statistics.filter((pl.col("indicator") == col_chosen) & pl.col("p_value").is_not_nan()) if statistics is not None else []
+    if len(row) > 0:
+        row = row.row(0, named = True)
+        aggregates = aggregates.with_columns(
+            pl.when(pl.col("bikepoint_binary"))
+            .then(row["mean_with_high"] - row["mean_with"])
+            .otherwise(row["mean_without_high"] - row["mean_without"])
+            .alias("error_high"),
+            pl.when(pl.col("bikepoint_binary"))
+            .then(row["mean_with"] - row["mean_with_low"])
+            .otherwise(row["mean_without"] - row["mean_without_low"])
+            .alias("error_low"),
+        )
+        error_bars = {"error_y": "error_high", "error_y_minus": "error_low"}
+        title_suffix = f" (p = {row['p_value']:.3f})"
+    if period is not None:
+        title_suffix += f", {period}"
 
-#TODO: There must be a neater way of doing paragraphs than this.
-app.layout = html.Div([
-    html.Div(
-        className="app-header",
-        children=[
-            html.Div('BikePoint Data Review', className="app-header--title")
-        ]
-   ),
-    html.Div(
-        children=html.Div([
-            html.H2('Introduction'),
-
-            html.Div([
-                html.P('This interactive data visualization tool aims to show the reader the following:'),
-                html.P('1) The distribution of BikePoint today'),
-                html.P('2) The difference between Local Authorities with and without BikePoint (deprivation, adult/teen/childhood obesity)'),
-                html.P('3) Potential areas for BikePoint expansion'),
-        ]),
-        ])
-    ),
-    html.Div(
-        children=html.Div([
-            html.H2('Section 1: Distribution of BikePoint across London'),
-            html.Div([
-                html.P("The interactive map shows the current distribution of BikePoints in blue across central London"),
-        ]),
-            html.Iframe(id = "map", srcDoc= open(map_path + "map_1.html", "r").read(), height = 500, width = 1000),
-        ])
-    ),
-    html.Div(
-        children=html.Div([
-            html.H2('Section 2: Local Authority characteristics'),
-            html.Div([
-                html.P("This bar chart shows the difference between Local Authorities with and without BikePoint."),
-                html.P("To chose what is measured on the y-axis, please use to dropdown menu below."),
-            ]),
-            html.Div([
-            dcc.Dropdown(
-                options= graph_df.drop(["bikepoint_binary", "rank", "overweight_change", "obese_change"]).columns, 
-                id='obesity_bar_graph_control',
-                value= graph_df.drop(["bikepoint_binary", "rank"]).columns[0], 
-                style={"width": "40%", "padding-left": "5px"}),
-            dcc.Graph(figure = {}, id = "obesity_bar_graph", style={'width': '90vh', 'height': '80vh'}),
-
-        ]),
-            html.Div([
-                html.P("As can be seen above, adult overweight / obesity rates are significantly lower in LAs with BikePoints."),
-                html.P("Given that obesity correlates with deprivation, we would expect these areas to be less deprived"),
-                html.P("In fact, as can be seen below, local authorities with BikePoints have higher deprivation (they are closer to 1, representing the most deprived LA)"),
-        ]),
-            html.Div([
-                dcc.Graph(figure = deprivation_plot, style={'width': '90vh', 'height': '80vh'}),
-                html.P("This may indicate that BikePoints are an effective way of reducing obesity."),
-                html.P("Another indicator is that, since 2015, obesity (%) increased less and overweight (%) decreased in areas with BikePoints."),
-                html.P("Those without BikePoints saw rises in both metrics."),
-                dcc.Dropdown(
-                    options= ["overweight_change", "obese_change"], 
-                    id='cange_bar_graph_control',
-                    value= "overweight_change", 
-                    style={"width": "40%", "padding-left": "5px"}),
-                dcc.Graph(figure = {}, id = "change_bar_graph", style={'width': '90vh', 'height': '80vh'}),
-                html.P("This seems to indicate that BikePoints generate public health improvements in the overweight/obesity domain."),
-        ]),
-        ])
-    ),
-        html.Div(
-        children=html.Div([
-            html.H2('Section 3: Potential areas for BikePoint expansion'),
-                html.P("The interactive map shows recommendations for new BikePoint areas"),
-                html.P("Please click the circles to read more about why these areas are recommended or recommended against."),
-            html.Iframe(id = "map_2", srcDoc= open(map_path + "map_2.html", "r").read(), height = 500, width = 1000),
-        ])
-    ),
-])
-
-@callback(
-    Output(component_id="obesity_bar_graph", component_property='figure'),
-    Input(component_id='obesity_bar_graph_control', component_property='value'),
-)
-def update_graph(col_chosen):
     fig = px.bar(
-        graph_df.group_by(pl.col("bikepoint_binary")).mean(), 
+        aggregates, 
         x= "bikepoint_binary",
         y = col_chosen,
         color = "bikepoint_binary",
         color_discrete_map = {True : ONS_COLOURS["Dark blue"], False: ONS_COLOURS["Orange"]},
-        hover_data= None
+        hover_data= None,
+        **error_bars
     )
     fig.update_xaxes(categoryorder='array', categoryarray= [True, False])
     y_axis_name = (col_chosen.replace('_',' ')).title()
     fig.update_layout(
         showlegend=False,
-        title= f"{y_axis_name}(%) vs BikePoint (present/absent)",
+        title= f"{y_axis_name}(%) vs BikePoint (present/absent){title_suffix}",
         xaxis_title="Does the local authority have a bikepoint?",
         yaxis_title= f"{y_axis_name}(%)",
-        yaxis_range= [0, 60],
+        yaxis_range= yaxis_range,
         )
     return fig
 
-@callback(
-    Output(component_id ="change_bar_graph", component_property="figure"),
-    Input(component_id='cange_bar_graph_control', component_property='value')
-)
-def update_graph(col_chosen):
+def period_bar_chart(period_aggregates, col_chosen, period):
+    """
+    A function which plots the mean of col_chosen in one time period for local authorities with and without BikePoints.
+    """
+    aggregates = period_aggregates.filter((pl.col("indicator") == col_chosen) & (pl.col("period") == period)).select(
+        "bikepoint_binary", pl.col("value").alias(col_chosen)
+    )
+    return bar_chart(aggregates, col_chosen, BAR_GRAPHS["obesity_bar_graph"], period = period)
+
+def statistics_table(statistics):
+    """
+    A function which lays out the model statistics as a table: for each indicator, the difference between local
+    authorities with and without BikePoints, the logistic regression slope, their 95% intervals and the p-value.
+    Values which couldn't be worked out (with only one group of local authorities) are shown as dashes.
+    """
+    def number(value, format_spec):
+        return "-" if math.isnan(value) else format(value, format_spec)
+
+    def interval(low, high, format_spec):
+        return "-" if math.isnan(low) else f"{low:{format_spec}} to {high:{format_spec}}"
+
+    header = ["Measure", "Difference (with - without)", "95% interval", "p-value", "Log odds of a BikePoint per SD", "95% interval"]
+    rows = []
+    for row in statistics.iter_rows(named = True):
+        rows.append(html.Tr([
+            html.Td((row["indicator"].replace('_',' ')).title()),
+            html.Td(number(row["difference"], ",.2f")),
+            html.Td(interval(row["difference_low"], row["difference_high"], ",.2f")),
+            html.Td(number(row["p_value"], ".4f")),
+            html.Td(number(row["log_odds_per_sd"], ".2f")),
+            html.Td(interval(row["log_odds_per_sd_low"], row["log_odds_per_sd_high"], ".2f")),
+        ]))
+    return html.Table([html.Thead(html.Tr([html.Th(name) for name in header])), html.Tbody(rows)])
+
+def site_map(sites):
+    """
+    A function which plots the optimizer's recommended sites on a map of London, sized by score.
+    """
+    import plotly.express as px
+
+    fig = px.scatter_map(
+        sites.with_columns(pl.col("rank").cast(pl.Utf8)),
+        lat = "lat",
+        lon = "lon",
+        size = "score",
+        text = "rank",
+        hover_name = "la_name",
+        hover_data = {"lsoas_covered": True, "demand_covered": ":.2f", "network_distance_m": ":,.0f", "score": False, "lat": False, "lon": False},
+        color_discrete_sequence = [ONS_COLOURS["Dark pink"]],
+        zoom = 9.5,
+        center = {"lat": 51.5074, "lon": -0.1272},
+    )
+    fig.update_layout(margin = {"l": 0, "r": 0, "t": 0, "b": 0})
+    return fig
+
+def drill_down_chart(areas, measure, title):
+    """
+    A function which plots measure for each of the areas (a slice of the rollup cube), highest first.
+    """
+    import plotly.express as px
+
     fig = px.bar(
-        graph_df.group_by(pl.col("bikepoint_binary")).mean(), 
-        x= "bikepoint_binary",
-        y = col_chosen,
-        color = "bikepoint_binary",
-        color_discrete_map = {True : ONS_COLOURS["Dark blue"], False: ONS_COLOURS["Orange"]},
-        hover_data= None
+        areas.sort(measure, descending = True, nulls_last = True),
+        x = "name",
+        y = measure,
+        custom_data = ["level", "key"],
+        color_discrete_sequence = [ONS_COLOURS["Dark blue"]],
+        hover_data = {"lsoas": True, "bikepoints": True},
     )
-    fig.update_xaxes(categoryorder='array', categoryarray= [True, False])
-    y_axis_name = (col_chosen.replace('_',' ')).title()
-    fig.update_layout(
-        showlegend=False,
-        title= f"{y_axis_name}(%) vs BikePoint (present/absent)",
-        xaxis_title="Does the local authority have a bikepoint?",
-        yaxis_title= f"{y_axis_name}(%)",
-        yaxis_range= [-3, +3],
-        )
+    y_axis_name = (measure.replace('_',' ')).title()
+    fig.update_layout(title = title, xaxis_title = None, yaxis_title = y_axis_name)
     return fig
 
+def drill_down_summary(area):
+    """
+    A function which lays out every measure of one area of the rollup cube as a table.
+    """
+    rows = [html.Tr([html.Td("Area"), html.Td(f"{area['name']} ({DRILL_DOWN_LEVELS[area['level']]})")])]
+    for measure in ["lsoas"] + DRILL_DOWN_MEASURES:
+        value = area[measure]
+        rows.append(html.Tr([
+            html.Td((measure.replace('_',' ')).title()),
+            html.Td("-" if value is None else f"{value:,.2f}" if isinstance(value, float) else f"{value:,}"),
+        ]))
+    return html.Table(html.Tbody(rows))
+
+def site_controls():
+    """
+    The weight sliders, number of sites and button for re-running the site optimizer from the dashboard.
+    """
+    from modules.site_optimizer import DEFAULT_WEIGHTS
+
+    sliders = []
+    for name in SITE_WEIGHTS:
+        sliders.append(html.Div([
+            html.Label((name.replace('_',' ')).title()),
+            dcc.Slider(0, 2, 0.25, value = DEFAULT_WEIGHTS.get(name, 0), id = {"type": "site_weight", "index": name}),
+        ], style={"width": "40%", "padding-left": "5px"}))
+    return html.Div([
+        html.H3("Explore other expansion sites"),
+        html.P("Choose how much each measure matters, then find the best sites for new BikePoints."),
+        *sliders,
+        html.Label("Number of sites"),
+        dcc.Input(id = "site_count", type = "number", min = 1, max = 50, step = 1, value = 5),
+        html.Button("Find sites", id = "site_button"),
+        dcc.Graph(figure = {}, id = "site_map", style={'width': '90vh', 'height': '80vh'}),
+    ])
+
+def create_app(clientside = True):
+    """
+    A function which creates the Dash app from the prebuilt artifacts.
+
+    Parameters
+    ----------
+    clientside: bool
+        If True, every bar graph figure is sent with the page and the dropdowns swap between them in the
+        browser. If False, the server draws each figure on request, keeping the most recent ones in memory.
+
+    Returns
+    --------
+    app: Dash
+        The dashboard, ready to run.
+    """
+    aggregates = pl.read_ipc(artifact_path + "aggregates.arrow")
+    options = bar_graph_options(aggregates)
+    statistics = pl.read_ipc(artifact_path + "model_stats.arrow")
+    period_aggregates = pl.read_ipc(artifact_path + "period_aggregates.arrow")
+    periods = indicator_periods(period_aggregates)
+    with open(artifact_path + "deprivation_plot.json", "r") as f:
+        deprivation_plot = json.load(f)
+    # The maps are served as files rather than inlined, so the browser caches them.
+    # The version makes sure a rebuilt map is fetched again.
+    map_1_src = f"/maps/map_1.html?v={int(os.path.getmtime(map_path + 'map_1.html'))}"
+    map_2_src = f"/maps/map_2.html?v={int(os.path.getmtime(map_path + 'map_2.html'))}"
+
+    # Now the model can actually begin!
+    app = Dash(__name__)
+    serve_directory(app, "/maps", map_path)
+    instrumentation.instrument_app(app)
+
+    app.layout = html.Div([
+        html.Div(
+            className="app-header",
+            children=[
+                html.Div('BikePoint Data Review', className="app-header--title")
+            ]
+       ),
+        html.Div(
+            children=html.Div([
+                html.H2('Introduction'),
+
+                html.Div([
+                    html.P('This interactive data visualization tool aims to show the reader the following:'),
+                    html.P('1) The distribution of BikePoint today'),
+                    html.P('2) The difference between Local Authorities with and without BikePoint (deprivation, adult/teen/childhood obesity)'),
+                    html.P('3) Potential areas for BikePoint expansion'),
+            ]),
+            ])
+        ),
+        html.Div(
+            children=html.Div([
+                html.H2('Section 1: Distribution of BikePoint across London'),
+                html.Div([
+                    html.P("The interactive map shows the current distribution of BikePoints in blue across central London"),
+            ]),
+                html.Iframe(id = "map", src= map_1_src, height = 500, width = 1000),
+            ])
+        ),
+        html.Div(
+            children=html.Div([
+                html.H2('Section 2: Local Authority characteristics'),
+                html.Div([
+                    html.P("This bar chart shows the difference between Local Authorities with and without BikePoint."),
+                    html.P("To chose what is measured on the y-axis, please use to dropdown menu below."),
+                ]),
+                html.Div([
+                dcc.Dropdown(
+                    options= options["obesity_bar_graph"], 
+                    id='obesity_bar_graph_control',
+                    value= options["obesity_bar_graph"][0], 
+                    style={"width": "40%", "padding-left": "5px"}),
+                dcc.Dropdown(
+                    options= period_options(periods, options["obesity_bar_graph"][0]),
+                    id='obesity_period_control',
+                    value= LATEST,
+                    clearable= False,
+                    style={"width": "20%", "padding-left": "5px"}),
+                dcc.Graph(figure = {}, id = "obesity_bar_graph", style={'width': '90vh', 'height': '80vh'}),
+
+            ]),
+                html.Div([
+                    html.P("As can be seen above, adult overweight / obesity rates are significantly lower in LAs with BikePoints."),
+                    html.P("Given that obesity correlates with deprivation, we would expect these areas to be less deprived"),
+                    html.P("In fact, as can be seen below, local authorities with BikePoints have higher deprivation (they are closer to 1, representing the most deprived LA)"),
+            ]),
+                html.Div([
+                    dcc.Graph(figure = deprivation_plot, style={'width': '90vh', 'height': '80vh'}),
+                    html.P("This may indicate that BikePoints are an effective way of reducing obesity."),
+                    html.P("Another indicator is that, since 2015, obesity (%) increased less and overweight (%) decreased in areas with BikePoints."),
+                    html.P("Those without BikePoints saw rises in both metrics."),
+                    dcc.Dropdown(
+                        options= options["change_bar_graph"], 
+                        id='cange_bar_graph_control',
+                        value= "overweight_change", 
+                        style={"width": "40%", "padding-left": "5px"}),
+                    dcc.Graph(figure = {}, id = "change_bar_graph", style={'width': '90vh', 'height': '80vh'}),
+                    html.P("This seems to indicate that BikePoints generate public health improvements in the overweight/obesity domain."),
+                    html.P("How sure can we be? The table gives 95% bootstrap intervals for each difference and for the logistic regression of BikePoint presence on each measure, with permutation test p-values."),
+                    statistics_table(statistics),
+            ]),
+            ])
+        ),
+            html.Div(
+            children=html.Div([
+                html.H2('Section 3: Potential areas for BikePoint expansion'),
+                    html.P("The interactive map shows recommendations for new BikePoint areas"),
+                    html.P("Please click the circles to read more about each area."),
+                html.Iframe(id = "map_2", src= map_2_src, height = 500, width = 1000),
+            ])
+        ),
+    ])
+    if os.path.exists(file_path + "lsoa_centroids.csv"):
+        add_site_optimizer(app)
+    if os.path.exists(file_path + "rollup_cube.csv"):
+        from modules.rollup_cube import RollupCube
+        add_drill_down(app, RollupCube(data_store.load(file_path + "rollup_cube.csv")))
+    # The obesity graph has callbacks of its own, as it also has a time period
+    controls = {
+        "change_bar_graph": "cange_bar_graph_control",
+    }
+
+    if clientside:
+        with open(artifact_path + "bar_figures.json", "r") as f:
+            bar_figures = json.load(f)
+        app.layout.children.append(dcc.Store(id = "bar_figures", data = bar_figures))
+        # Falls back to the latest data if col_chosen doesn't have the period chosen
+        app.clientside_callback(
+            f"""function(col_chosen, period, store) {{
+                var figure = (store.periods[col_chosen] || {{}})[period] || store.figures["obesity_bar_graph"][col_chosen];
+                return {{data: figure.data, layout: Object.assign({{template: store.template}}, figure.layout)}};
+            }}""",
+            Output(component_id = "obesity_bar_graph", component_property = "figure"),
+            Input(component_id = "obesity_bar_graph_control", component_property = "value"),
+            Input(component_id = "obesity_period_control", component_property = "value"),
+            State(component_id = "bar_figures", component_property = "data"),
+        )
+        app.clientside_callback(
+            f"""function(col_chosen, store) {{
+                return [{{label: "Latest", value: {json.dumps(LATEST)}}}].concat(
+                    Object.keys(store.periods[col_chosen] || {{}}).map(function(period) {{ return {{label: period, value: period}}; }})
+                );
+            }}""",
+            Output(component_id = "obesity_period_control", component_property = "options"),
+            Input(component_id = "obesity_bar_graph_control", component_property = "value"),
+            State(component_id = "bar_figures", component_property = "data"),
+        )
+        for graph_id, control_id in controls.items():
+            app.clientside_callback(
+                f"""function(col_chosen, store) {{
+                    var figure = store.figures[{json.dumps(graph_id)}][col_chosen];
+                    return {{data: figure.data, layout: Object.assign({{template: store.template}}, figure.layout)}};
+                }}""",
+                Output(component_id = graph_id, component_property = "figure"),
+                Input(component_id = control_id, component_property = "value"),
+                State(component_id = "bar_figures", component_property = "data"),
+            )
+        return app
+
+    # The figures never change while the app runs, so each is only drawn once.
+    # Plain dicts rather than Figure objects, so Dash doesn't re-validate them on every request.
+    @lru_cache(maxsize = 64)
+    def cached_bar_chart(graph_id, col_chosen, period = LATEST):
+        if period not in periods.get(col_chosen, []):
+            return json.loads(bar_chart(aggregates, col_chosen, BAR_GRAPHS[graph_id], statistics).to_json())
+        return json.loads(period_bar_chart(period_aggregates, col_chosen, period).to_json())
+
+    @app.callback(
+        Output(component_id="obesity_bar_graph", component_property='figure'),
+        Input(component_id='obesity_bar_graph_control', component_property='value'),
+        Input(component_id='obesity_period_control', component_property='value'),
+    )
+    def update_obesity_graph(col_chosen, period):
+        return cached_bar_chart("obesity_bar_graph", col_chosen, period)
+
+    @app.callback(
+        Output(component_id="obesity_period_control", component_property='options'),
+        Input(component_id='obesity_bar_graph_control', component_property='value'),
+    )
+    def update_period_options(col_chosen):
+        return period_options(periods, col_chosen)
+
+    @app.callback(
+        Output(component_id ="change_bar_graph", component_property="figure"),
+        Input(component_id='cange_bar_graph_control', component_property='value')
+    )
+    def update_change_graph(col_chosen):
+        return cached_bar_chart("change_bar_graph", col_chosen)
+
+    return app
+
+def create_production_app(clientside = True):
+    """
+    A function which creates the dashboard for serving to real traffic: as create_app, with compressed responses.
+    Dash's debugger is only switched on by app.run(debug = True), which this never calls.
+    """
+    app = create_app(clientside)
+    compress_responses(app)
+    return app
+
+def add_drill_down(app, cube):
+    """
+    A function which adds a drill-down from London to its local authorities, MSOAs and LSOAs to the end of the dashboard.
+    Clicking a bar (or choosing from the dropdown) moves to that area, and the chart shows the areas inside it.
+    Every step is a lookup in the prebuilt cube, so nothing is aggregated while the app runs.
+
+    Parameters
+    ----------
+    cube: RollupCube
+        Built from data/rollup_cube.csv by clean_data.py.
+    """
+    from modules.rollup_cube import LEVELS, LONDON
+
+    start = f"{LEVELS[0]}|{LONDON}"
+    app.layout.children.append(html.Div([
+        html.H2("Section 4: Drilling down"),
+        html.P("Choose a measure, then click a bar to see the areas inside it. The dropdown goes back up."),
+        dcc.Dropdown(
+            options = DRILL_DOWN_MEASURES, id = "drill_down_measure", value = "bikepoints_per_lsoa",
+            clearable = False, style={"width": "40%", "padding-left": "5px"}),
+        dcc.Dropdown(id = "drill_down_area", value = start, clearable = False, style={"width": "40%", "padding-left": "5px"}),
+        dcc.Graph(figure = {}, id = "drill_down_graph", style={'width': '90vh', 'height': '80vh'}),
+        html.Div(id = "drill_down_summary"),
+    ]))
+
+    @app.callback(
+        Output(component_id = "drill_down_area", component_property = "value"),
+        Input(component_id = "drill_down_graph", component_property = "clickData"),
+        prevent_initial_call = True,
+    )
+    def drill_into(click):
+        level, key = click["points"][0]["customdata"]
+        return f"{level}|{key}"
+
+    # As with the bar graphs, each chart is only drawn once
+    @lru_cache(maxsize = 256)
+    def cached_drill_down(level, key, measure):
+        area = cube.area(level, key)
+        areas = cube.children(level, key)
+        title = f"{(measure.replace('_',' ')).title()} in {area['name']}"
+        if areas.height == 0:
+            # An LSOA has nothing inside it, so show it among its neighbours instead
+            parent_level, parent_key = cube.path(level, key)[-2]
+            areas = cube.children(parent_level, parent_key)
+            title = f"{(measure.replace('_',' ')).title()} in {parent_key}"
+        options = [
+            {"label": f"{DRILL_DOWN_LEVELS[step_level]}: {cube.area(step_level, step_key)['name']}", "value": f"{step_level}|{step_key}"}
+            for step_level, step_key in cube.path(level, key)
+        ]
+        return json.loads(drill_down_chart(areas, measure, title).to_json()), options
+
+    @app.callback(
+        Output(component_id = "drill_down_graph", component_property = "figure"),
+        Output(component_id = "drill_down_area", component_property = "options"),
+        Output(component_id = "drill_down_summary", component_property = "children"),
+        Input(component_id = "drill_down_area", component_property = "value"),
+        Input(component_id = "drill_down_measure", component_property = "value"),
+    )
+    def update_drill_down(chosen, measure):
+        level, key = (chosen or start).split("|", 1)
+        if (level, key) not in cube:
+            level, key = LEVELS[0], LONDON
+        figure, options = cached_drill_down(level, key, measure)
+        return figure, options, drill_down_summary(cube.area(level, key))
+
+
+def add_site_optimizer(app):
+    """
+    A function which adds the interactive site optimizer to the end of the dashboard.
+    The candidate grid is loaded (or built, if build_artifacts hasn't saved one) on the first request and reused,
+    so each re-run only re-solves it.
+    """
+    app.layout.children.append(site_controls())
+
+    @lru_cache(maxsize = 1)
+    def site_problem():
+        from modules.site_optimizer import SiteProblem, load_demand
+        demand = load_demand(file_path)
+        try:
+            return SiteProblem.load(site_problem_path, demand)
+        except (OSError, ValueError):
+            return SiteProblem(demand, data_store.load(file_path + "bikepoints.csv"))
+
+    @app.callback(
+        Output(component_id = "site_map", component_property = "figure"),
+        Input(component_id = "site_button", component_property = "n_clicks"),
+        State(component_id = {"type": "site_weight", "index": ALL}, component_property = "value"),
+        State(component_id = "site_count", component_property = "value"),
+    )
+    def update_site_map(n_clicks, weights, k):
+        sites = site_problem().solve(dict(zip(SITE_WEIGHTS, weights)), int(k or 5))
+        return json.loads(site_map(sites).to_json())
+
 if __name__ == '__main__':
-    Timer(1, open_browser).start()
-    app.run_server(debug=True, port=1222)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description = "Run the BikePoint dashboard.")
+    parser.add_argument("--build", action = "store_true", help = "Rebuild the maps and figures even if they are up to date.")
+    parser.add_argument("--server-callbacks", action = "store_true", help = "Draw the bar graphs on the server instead of in the browser.")
+    parser.add_argument("--map-mode", choices = ["layer", "cluster", "markers"], help = "How stations are drawn on the maps. Implies --build.")
+    parser.add_argument("--boundaries", help = "A GeoJSON of LSOA boundaries to cut into deprivation tiles for the maps. Implies --build.")
+    parser.add_argument("--production", action = "store_true", help = "Serve without the debugger, reloader or browser, with compressed responses.")
+    parser.add_argument("--host", default = "127.0.0.1", help = "The address to serve on with --production, e.g. 0.0.0.0 for every interface.")
+    args = parser.parse_args()
+
+    # The reloader runs this again in a child process, where the artifacts are already fresh
+    if args.boundaries and not os.environ.get("WERKZEUG_RUN_MAIN"):
+        build_deprivation_tiles(args.boundaries)
+    if not os.environ.get("WERKZEUG_RUN_MAIN") and (args.build or args.map_mode or args.boundaries or artifacts_stale()):
+        build_artifacts(args.map_mode or "layer")
+    if args.production:
+        app = create_production_app(clientside = not args.server_callbacks)
+        app.run(host = args.host, port = 1222, debug = False, threaded = True)
+    else:
+        app = create_app(clientside = not args.server_callbacks)
+        Timer(1, open_browser).start()
+        app.run(debug=True, port=1222)
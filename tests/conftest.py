@@ -0,0 +1,7 @@
+"""
+The scripts and modules/ are imported from the repository root, as when they are run.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
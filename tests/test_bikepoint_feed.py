@@ -0,0 +1,44 @@
+"""
+The conditional download of the BikePoint feed, against the stand-in TfL server from benchmarks/stand_in_servers.py.
+"""
+import get_data
+from benchmarks.stand_in_servers import StandInServer, TflHandler
+from benchmarks.synthetic import synthetic_bikepoints, synthetic_feed
+from modules.bikepoint_feed import fetch_bikepoints, load_validators
+
+
+def test_etag_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_data, "file_path", str(tmp_path) + "/")
+    with StandInServer(TflHandler, feed = synthetic_feed(synthetic_bikepoints(50))) as server:
+        api = server.url + "/BikePoint/"
+
+        bikepoints, changed = get_data.get_bikepoints(api)
+        assert changed
+        assert bikepoints.height == 50
+        assert (tmp_path / "bikepoints.csv").exists()
+
+        # Unchanged: the saved ETag gets a 304, and the previous download is handed back
+        validators = load_validators(str(tmp_path / "bikepoints_meta.json"), api)
+        assert fetch_bikepoints(api, validators)[0] is None
+        bikepoints, changed = get_data.get_bikepoints(api)
+        assert not changed
+        assert bikepoints.height == 50
+
+        server.httpd.feed = synthetic_feed(synthetic_bikepoints(60))
+        bikepoints, changed = get_data.get_bikepoints(api)
+        assert changed
+        assert bikepoints.height == 60
+        assert server.httpd.requests == 4
+
+
+def test_new_dock_counts_alone_are_not_a_change(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_data, "file_path", str(tmp_path) + "/")
+    stations = synthetic_bikepoints(20)
+    with StandInServer(TflHandler, feed = synthetic_feed(stations, seed = 0)) as server:
+        api = server.url + "/BikePoint/"
+        assert get_data.get_bikepoints(api)[1]
+        # A new ETag, so a full download, but the stations themselves are the same
+        server.httpd.feed = synthetic_feed(stations, seed = 1)
+        bikepoints, changed = get_data.get_bikepoints(api)
+        assert not changed
+        assert bikepoints.height == 20
@@ -0,0 +1,46 @@
+"""
+Refreshing la_counts.csv through the geocode cache, counting the lookups made of the stand-in postcodes.io server.
+"""
+import polars as pl
+
+import get_data
+from benchmarks.stand_in_servers import PostcodesHandler, StandInServer, stand_in_lsoa
+from benchmarks.synthetic import synthetic_bikepoints
+from modules.geocoding import reverse_geocode
+
+
+def expected_counts(bikepoints):
+    lsoas = [stand_in_lsoa(lat, lon) for lat, lon in zip(bikepoints["lat"], bikepoints["lon"])]
+    return dict(pl.DataFrame({"lsoa": lsoas})["lsoa"].value_counts().iter_rows())
+
+
+def test_only_new_and_moved_stations_are_looked_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_data, "file_path", str(tmp_path) + "/")
+    bikepoints = synthetic_bikepoints(40)
+    with StandInServer(PostcodesHandler, batch_sizes = []) as server:
+        api = server.url + "/postcodes"
+        lookup = lambda lats, lons: reverse_geocode(api, lats, lons, max_workers = 1)
+
+        def refresh(current, previous):
+            server.httpd.batch_sizes.clear()
+            counts = dict(get_data.refresh_la_counts(current, previous, lookup, source = api).iter_rows())
+            assert counts == expected_counts(current)
+            return sum(server.httpd.batch_sizes)
+
+        assert refresh(bikepoints, None) == 40
+        # Nothing changed, with or without the previous download to compare with
+        assert refresh(bikepoints, bikepoints) == 0
+        assert refresh(bikepoints, None) == 0
+
+        # Two stations move, three are added and one is removed
+        moved = bikepoints.with_columns(
+            pl.when(pl.col("id").is_in(["BikePoints_1", "BikePoints_2"])).then(pl.col("lat") + 0.05).otherwise(pl.col("lat")).alias("lat")
+        )
+        changed = pl.concat([moved.filter(pl.col("id") != "BikePoints_40"), synthetic_bikepoints(43).tail(3)])
+        assert refresh(changed, bikepoints) == 5
+        assert refresh(changed, changed) == 0
+
+        # A cache from another source is ignored
+        server.httpd.batch_sizes.clear()
+        get_data.refresh_la_counts(changed, changed, lookup, source = api + "/v2")
+        assert sum(server.httpd.batch_sizes) == changed.height
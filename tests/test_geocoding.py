@@ -0,0 +1,65 @@
+"""
+reverse_geocode against the stand-in postcodes.io server from benchmarks/stand_in_servers.py.
+"""
+import numpy as np
+import pytest
+
+from benchmarks.stand_in_servers import PostcodesHandler, StandInServer, stand_in_lsoa
+from modules import geocoding
+
+
+def points(n, seed = 0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(51.3, 51.7, n), rng.uniform(-0.5, 0.3, n)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # Record the client's waits rather than waiting (the server only ever sleeps 0 seconds)
+    waits = []
+    monkeypatch.setattr(geocoding.time, "sleep", lambda seconds: waits.append(seconds) if seconds else None)
+    return waits
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_retry_after_is_honoured(status, sleeps):
+    lats, lons = points(250)
+    with StandInServer(PostcodesHandler, fail_every = 2, fail_status = status, retry_after = "7") as server:
+        lsoas = geocoding.reverse_geocode(server.url + "/postcodes", lats, lons, max_workers = 1, backoff = 0.5)
+        # Every other request fails, so batches 2 and 3 are each retried once
+        assert server.httpd.requests == 5
+    assert sleeps == [7.0, 7.0]
+    assert lsoas == [stand_in_lsoa(lat, lon) for lat, lon in zip(lats, lons)]
+
+
+def test_backoff_without_retry_after(sleeps):
+    lats, lons = points(100)
+    with StandInServer(PostcodesHandler, fail_every = 1, fail_status = 502, retry_after = None) as server:
+        with pytest.raises(IndexError):
+            geocoding.reverse_geocode(server.url + "/postcodes", lats, lons, max_workers = 1, max_retries = 3, backoff = 0.5)
+        assert server.httpd.requests == 4
+    assert sleeps == [0.5, 1.0, 2.0]
+
+
+def test_client_errors_are_not_retried(sleeps):
+    lats, lons = points(10)
+    with StandInServer(PostcodesHandler, fail_every = 1, fail_status = 400) as server:
+        with pytest.raises(IndexError):
+            geocoding.reverse_geocode(server.url + "/postcodes", lats, lons, max_workers = 1)
+        assert server.httpd.requests == 1
+    assert sleeps == []
+
+
+def test_partial_batch_and_order_with_concurrent_batches(sleeps):
+    lats, lons = points(1234, seed = 1)
+    with StandInServer(PostcodesHandler, fail_every = 5, batch_sizes = []) as server:
+        lsoas = geocoding.reverse_geocode(server.url + "/postcodes", lats, lons, max_workers = 4, max_retries = 10)
+        batch_sizes = sorted(server.httpd.batch_sizes)
+    # Twelve full batches and the final 34 points
+    assert batch_sizes == [34] + [geocoding.BATCH_SIZE] * 12
+    assert lsoas == [stand_in_lsoa(lat, lon) for lat, lon in zip(lats, lons)]
+
+
+def test_mismatched_lengths():
+    with pytest.raises(ValueError):
+        geocoding.reverse_geocode("http://127.0.0.1:1/postcodes", [51.5, 51.6], [-0.1])
@@ -0,0 +1,26 @@
+"""
+The model statistics when every local authority is in one group.
+"""
+import math
+
+import numpy as np
+import polars as pl
+
+import run_model
+from modules.model_stats import model_statistics
+
+
+def test_one_group_gives_nan_instead_of_failing():
+    data = pl.DataFrame({"bikepoint_binary": [True] * 5, "obese": np.arange(5.0)})
+    statistics = model_statistics(data, resamples = 100, workers = 1)
+    row = statistics.row(0, named = True)
+    assert row["mean_with"] == 2.0
+    assert all(math.isnan(value) for name, value in row.items() if name not in ("indicator", "mean_with"))
+
+    # The bar chart goes without error bars and a p-value, and the table shows dashes
+    aggregates = data.group_by("bikepoint_binary").mean()
+    figure = run_model.bar_chart(aggregates, "obese", [0, 10], statistics)
+    assert "p =" not in figure.layout.title.text
+    assert figure.data[0].error_y.array is None
+    cells = run_model.statistics_table(statistics).children[1].children[0].children
+    assert [cell.children for cell in cells[1:]] == ["-"] * 5
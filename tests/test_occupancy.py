@@ -0,0 +1,84 @@
+"""
+The occupancy store: which rows each poll writes, and snapshots and windows read back from it.
+"""
+from datetime import datetime, timedelta, timezone
+
+import polars as pl
+
+from modules import occupancy
+from modules.occupancy import OCCUPANCY_COLUMNS, OccupancyStore
+
+START = datetime(2024, 1, 31, 8, 0, tzinfo = timezone.utc)
+MINUTE = timedelta(minutes = 1)
+
+
+def poll(counts):
+    """
+    A poll from parse_occupancy, from {id: bikes}. Every count column takes the bikes value (None for nulls).
+    """
+    schema = {"id": pl.Utf8, **{col: pl.Int16 for col in OCCUPANCY_COLUMNS}}
+    return pl.DataFrame({"id": list(counts), **{col: list(counts.values()) for col in OCCUPANCY_COLUMNS}}, schema = schema)
+
+
+def bikes(frame):
+    return dict(zip(frame["id"].to_list(), frame["nb_bikes"].to_list()))
+
+
+def test_only_changes_are_written(tmp_path):
+    with OccupancyStore(str(tmp_path)) as store:
+        assert store.append(poll({"a": 5, "b": 3}), START) == 2
+        assert store.append(poll({"a": 5, "b": 3}), START + MINUTE) == 0
+        assert store.append(poll({"a": 4, "b": 3}), START + 2 * MINUTE) == 1
+    assert bikes(occupancy.snapshot(str(tmp_path), START + 2 * MINUTE)) == {"a": 4, "b": 3}
+    assert bikes(occupancy.snapshot(str(tmp_path), START + MINUTE)) == {"a": 5, "b": 3}
+
+
+def test_null_counts(tmp_path):
+    with OccupancyStore(str(tmp_path)) as store:
+        store.append(poll({"a": 5, "b": 3}), START)
+        # a's counts come back unreadable, then stay that way, then recover
+        assert store.append(poll({"a": None, "b": 3}), START + MINUTE) == 1
+        assert store.append(poll({"a": None, "b": 3}), START + 2 * MINUTE) == 0
+        assert store.append(poll({"a": 6, "b": 3}), START + 3 * MINUTE) == 1
+    path = str(tmp_path)
+    assert bikes(occupancy.snapshot(path, START + 2 * MINUTE)) == {"b": 3}
+    assert bikes(occupancy.snapshot(path, START + 3 * MINUTE)) == {"a": 6, "b": 3}
+    # The time a's counts were null doesn't count towards its means
+    summary = occupancy.station_summary(path, START, START + 4 * MINUTE)
+    assert summary.filter(pl.col("id") == "a")["mean_bikes"].item() == (5 + 6) / 2
+
+
+def test_station_appearing_and_leaving(tmp_path):
+    with OccupancyStore(str(tmp_path)) as store:
+        store.append(poll({"a": 5}), START)
+        assert store.append(poll({"a": 5, "b": 3}), START + MINUTE) == 1
+        # b leaves the feed, which is written as a row of nulls
+        assert store.append(poll({"a": 5}), START + 2 * MINUTE) == 1
+    path = str(tmp_path)
+    assert bikes(occupancy.snapshot(path, START)) == {"a": 5}
+    assert bikes(occupancy.snapshot(path, START + MINUTE)) == {"a": 5, "b": 3}
+    assert bikes(occupancy.snapshot(path, START + 2 * MINUTE)) == {"a": 5}
+    window = occupancy._window(path, START, START + 3 * MINUTE).collect()
+    b = window.filter(pl.col("id") == "b")
+    assert b["time"].to_list() == [START + MINUTE, START + 2 * MINUTE]
+    assert b["held_ms"].to_list() == [60_000, 60_000]
+    totals = occupancy.network_totals(path, START, START + 2 * MINUTE, every = "1m")
+    assert totals["nb_bikes"].to_list() == [5, 8, 5]
+
+
+def test_window_starting_before_the_days_first_poll(tmp_path):
+    day_two = datetime(2024, 2, 1, tzinfo = timezone.utc)
+    with OccupancyStore(str(tmp_path)) as store:
+        store.append(poll({"a": 5, "b": 3}), START)
+        store.append(poll({"a": 2, "b": 3}), START + MINUTE)
+        store.append(poll({"a": 7, "b": 1}), day_two + timedelta(seconds = 30))
+    path = str(tmp_path)
+    # Between midnight and the day's first poll, the counts are where the previous day left them
+    window = occupancy._window(path, day_two + timedelta(seconds = 10), day_two + timedelta(seconds = 20)).collect()
+    assert bikes(window) == {"a": 2, "b": 3}
+    assert window["held_ms"].to_list() == [10_000, 10_000]
+    window = occupancy._window(path, day_two, day_two + MINUTE).collect().sort("id", "time")
+    assert window["nb_bikes"].to_list() == [2, 7, 3, 1]
+    assert window["held_ms"].to_list() == [30_000, 30_000, 30_000, 30_000]
+    # Before anything was stored there is nothing to report
+    assert occupancy._window(path, START - timedelta(days = 1), START - MINUTE).collect().height == 0
@@ -0,0 +1,33 @@
+"""
+Counting a table of stations per LSOA, in the boundaries and by the nearest centroid.
+"""
+import json
+
+import polars as pl
+
+from modules.out_of_core import count_stations, locate_stations
+from modules.spatial_join import load_index
+
+
+def square(code, west, south, size):
+    ring = [[west, south], [west + size, south], [west + size, south + size], [west, south + size], [west, south]]
+    return {"type": "Feature", "properties": {"LSOA11CD": code}, "geometry": {"type": "Polygon", "coordinates": [ring]}}
+
+
+def test_boundaries_and_centroids(tmp_path):
+    # A large LSOA with a small one beside it
+    boundary_path = tmp_path / "lsoas.geojson"
+    boundary_path.write_text(json.dumps({"type": "FeatureCollection", "features": [
+        square("E01000001", -0.2, 51.5, 0.04), square("E01000002", -0.16, 51.5, 0.01),
+    ]}))
+    centroids = pl.DataFrame({"lsoa": ["E01000001", "E01000002"], "lat": [51.52, 51.505], "lon": [-0.18, -0.155]})
+    # Inside the large LSOA but nearer the small one's centroid, in the small one, and far outside both
+    stations = tmp_path / "stations.arrow"
+    pl.DataFrame({"lat": [51.505, 51.506, 51.507, 52.5], "lon": [-0.162, -0.155, -0.156, -0.18]}).write_ipc(stations)
+
+    located = locate_stations(str(stations), load_index(str(boundary_path)), chunk_rows = 2)
+    assert dict(located.iter_rows()) == {"E01000001": 1, "E01000002": 2}
+    nearest = count_stations(str(stations), centroids, chunk_rows = 2)
+    assert dict(nearest.iter_rows()) == {"E01000002": 3}
+    nearest = count_stations(str(stations), centroids, chunk_rows = None, max_distance_m = float("inf"))
+    assert dict(nearest.iter_rows()) == {"E01000001": 1, "E01000002": 3}
@@ -0,0 +1,77 @@
+"""
+The pipeline's caching: a stage is skipped when its inputs, params, code and outputs are as it last left them,
+and re-run when any of them changes.
+"""
+import importlib
+import shutil
+import sys
+
+import pytest
+
+from modules.pipeline import Stage, run_pipeline
+
+STAGE_CODE = """
+def upper(source, target, suffix = ""):
+    with open(source, "r") as f:
+        text = f.read()
+    with open(target, "w") as f:
+        f.write(text.upper() + suffix)
+"""
+
+
+@pytest.fixture
+def build(tmp_path, monkeypatch):
+    """
+    Makes two stages: "upper" writes a.txt to b.txt in capitals, with code in a module of its own so it can be
+    changed, and "copy" copies b.txt to c.txt.
+    """
+    (tmp_path / "pipeline_stages.py").write_text(STAGE_CODE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module = importlib.import_module("pipeline_stages")
+    (tmp_path / "a.txt").write_text("a")
+    a, b, c = (str(tmp_path / name) for name in ["a.txt", "b.txt", "c.txt"])
+
+    def stages(suffix = ""):
+        return [
+            Stage("upper", module.upper, inputs = [a], outputs = [b], params = {"source": a, "target": b, "suffix": suffix}),
+            Stage("copy", shutil.copyfile, inputs = [b], outputs = [c], after = ["upper"], params = {"src": b, "dst": c}),
+        ]
+
+    yield stages
+    sys.modules.pop("pipeline_stages", None)
+
+
+def run(stages, tmp_path):
+    return run_pipeline(stages, str(tmp_path / "state.json"), max_workers = 1, log = lambda line: None)
+
+
+def test_skips_unchanged_stages(build, tmp_path):
+    assert run(build(), tmp_path) == ["upper", "copy"]
+    assert (tmp_path / "c.txt").read_text() == "A"
+    assert run(build(), tmp_path) == []
+
+
+def test_reruns_on_changes(build, tmp_path):
+    run(build(), tmp_path)
+
+    # A changed input
+    (tmp_path / "a.txt").write_text("b")
+    assert run(build(), tmp_path) == ["upper", "copy"]
+    assert (tmp_path / "c.txt").read_text() == "B"
+
+    # A changed parameter
+    assert run(build(suffix = "!"), tmp_path) == ["upper", "copy"]
+    assert (tmp_path / "c.txt").read_text() == "B!"
+
+    # A missing or changed output
+    (tmp_path / "c.txt").unlink()
+    assert run(build(suffix = "!"), tmp_path) == ["copy"]
+    (tmp_path / "c.txt").write_text("edited")
+    assert run(build(suffix = "!"), tmp_path) == ["copy"]
+    assert (tmp_path / "c.txt").read_text() == "B!"
+
+    # Changed code, whose output comes out the same, so the stage after it is still up to date
+    with open(tmp_path / "pipeline_stages.py", "a") as f:
+        f.write("\n# A comment\n")
+    assert run(build(suffix = "!"), tmp_path) == ["upper"]
+    assert run(build(suffix = "!"), tmp_path) == []
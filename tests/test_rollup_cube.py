@@ -0,0 +1,63 @@
+"""
+Summing LSOAs up to MSOAs, local authorities and London, and drilling down through the result.
+"""
+import polars as pl
+import pytest
+
+from modules.rollup_cube import LONDON, RollupCube, msoa_name, scan_cube
+
+LSOAS = pl.DataFrame({
+    "lsoa": ["E01000001", "E01000002", "E01000003", "E01000004"],
+    "lsoa_name": ["Camden 001A", "Camden 001B", "Camden 002A", "Hackney 001A"],
+    "la_name": ["Camden", "Camden", "Camden", "Hackney"],
+    "bikepoints": [2, 0, 1, 0],
+    "rank": [10.0, 20.0, 30.0, 40.0],
+})
+
+
+@pytest.fixture
+def cube():
+    return RollupCube(scan_cube(LSOAS.lazy(), ["rank"]).collect())
+
+
+def test_msoa_names():
+    names = pl.Series(["Camden 001A", "City of London 001F", "Kensington and Chelsea 012E"])
+    assert pl.select(msoa_name(pl.lit(names))).to_series().to_list() == ["Camden 001", "City of London 001", "Kensington and Chelsea 012"]
+
+
+def test_every_level_sums_and_averages(cube):
+    london = cube.area("london", LONDON)
+    assert london["parent"] is None
+    assert (london["lsoas"], london["bikepoints"], london["lsoas_with_bikepoint"]) == (4, 3, 2)
+    assert london["rank"] == 25
+    assert london["bikepoints_per_lsoa"] == 0.75
+    assert london["share_with_bikepoint"] == 0.5
+
+    camden = cube.area("la", "Camden")
+    assert (camden["parent"], camden["lsoas"], camden["bikepoints"], camden["lsoas_with_bikepoint"]) == (LONDON, 3, 3, 2)
+    assert camden["rank"] == 20
+
+    msoa = cube.area("msoa", "Camden 001")
+    assert (msoa["parent"], msoa["lsoas"], msoa["bikepoints"], msoa["rank"]) == ("Camden", 2, 2, 15)
+
+    lsoa = cube.area("lsoa", "E01000003")
+    assert (lsoa["name"], lsoa["parent"], lsoa["lsoas"], lsoa["bikepoints"], lsoa["rank"]) == ("Camden 002A", "Camden 002", 1, 1, 30)
+
+    # Each level adds up to the whole of London
+    for level in ["la", "msoa", "lsoa"]:
+        areas = cube.cube.filter(pl.col("level") == level)
+        assert (areas["lsoas"].sum(), areas["bikepoints"].sum()) == (4, 3)
+
+
+def test_drill_down(cube):
+    assert cube.children("london", LONDON)["key"].to_list() == ["Camden", "Hackney"]
+    assert cube.children("la", "Camden")["key"].to_list() == ["Camden 001", "Camden 002"]
+    assert cube.children("la", "Hackney")["key"].to_list() == ["Hackney 001"]
+    assert cube.children("msoa", "Camden 001")["key"].to_list() == ["E01000001", "E01000002"]
+    assert cube.children("lsoa", "E01000001").height == 0
+    assert cube.children("la", "Islington").height == 0
+    assert cube.path("lsoa", "E01000002") == [("london", LONDON), ("la", "Camden"), ("msoa", "Camden 001"), ("lsoa", "E01000002")]
+    assert ("msoa", "Camden 002") in cube
+    assert ("la", "Islington") not in cube
+    with pytest.raises(KeyError):
+        cube.area("la", "Islington")
@@ -0,0 +1,92 @@
+"""
+Point in polygon lookups with LsoaIndex, and the index cached next to a boundary file.
+"""
+import json
+import os
+
+import numpy as np
+import pytest
+
+from modules.spatial_join import INDEX_VERSION, LSOA_PROPERTY, count_lsoas, load_index
+
+
+def square(west, south, size):
+    return [[west, south], [west + size, south], [west + size, south + size], [west, south + size], [west, south]]
+
+
+def feature(code, geometry_type, coordinates):
+    return {"type": "Feature", "properties": {LSOA_PROPERTY: code}, "geometry": {"type": geometry_type, "coordinates": coordinates}}
+
+
+# x is longitude and y latitude. A has a hole with D inside it, B shares A's eastern border, and C is in two parts.
+FEATURES = [
+    feature("A", "Polygon", [square(0, 0, 1), square(0.4, 0.4, 0.2)[::-1]]),
+    feature("B", "Polygon", [square(1, 0, 1)]),
+    feature("C", "MultiPolygon", [[square(3, 0, 1)], [square(5, 0, 1)]]),
+    feature("D", "Polygon", [square(0.45, 0.45, 0.1)]),
+]
+
+
+def write_boundaries(path, features):
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+
+@pytest.fixture
+def boundary_path(tmp_path):
+    path = str(tmp_path / "lsoas.geojson")
+    write_boundaries(path, FEATURES)
+    return path
+
+
+def locate(index, points):
+    lons, lats = np.array(points, dtype = np.float64).T
+    return index.locate(lats, lons).tolist()
+
+
+def test_holes_and_multipolygons(boundary_path):
+    index = load_index(boundary_path)
+    assert locate(index, [(0.2, 0.2), (0.9, 0.5), (1.5, 0.5)]) == ["A", "A", "B"]
+    # In A's hole, and on the island in it
+    assert locate(index, [(0.42, 0.42), (0.5, 0.5)]) == [None, "D"]
+    # Both parts of C, and the gap between them
+    assert locate(index, [(3.5, 0.5), (5.5, 0.5), (4.5, 0.5)]) == ["C", "C", None]
+
+
+def test_points_outside_every_lsoa(boundary_path):
+    index = load_index(boundary_path)
+    assert locate(index, [(-1, 0.5), (2.5, 0.5), (0.5, 2), (10, 10), (-10, -10)]) == [None] * 5
+    # Including a chunk which starts with one
+    counts = count_lsoas(index, [0.5, 0.5, 0.5], [-1, 0.2, 1.5], chunk_size = 2)
+    assert dict(counts.iter_rows()) == {"A": 1, "B": 1}
+
+
+def test_shared_borders_count_once(boundary_path):
+    index = load_index(boundary_path)
+    on_border = [(1, 0.25), (1, 0.5), (1, 0.75)]
+    lsoas = locate(index, on_border)
+    assert all(lsoa in ("A", "B") for lsoa in lsoas)
+    assert len(set(lsoas)) == 1
+    lons, lats = np.array(on_border).T
+    assert count_lsoas(index, lats, lons)["count"].sum() == 3
+
+
+def test_stale_index_is_rebuilt(boundary_path):
+    index_path = os.path.splitext(boundary_path)[0] + ".index.npz"
+    load_index(boundary_path)
+    assert os.path.exists(index_path)
+
+    # A boundary file newer than its index
+    write_boundaries(boundary_path, [feature("E", "Polygon", [square(0, 0, 2)])])
+    os.utime(boundary_path, (os.path.getmtime(index_path) + 10,) * 2)
+    assert locate(load_index(boundary_path), [(1.5, 0.5)]) == ["E"]
+
+    # An index from another version
+    with np.load(index_path) as saved:
+        arrays = dict(saved)
+    arrays["version"] = INDEX_VERSION + 1
+    np.savez(index_path, **arrays)
+    os.utime(index_path, (os.path.getmtime(boundary_path) + 10,) * 2)
+    assert locate(load_index(boundary_path), [(1.5, 0.5)]) == ["E"]
+    with np.load(index_path) as saved:
+        assert int(saved["version"]) == INDEX_VERSION
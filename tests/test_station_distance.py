@@ -0,0 +1,35 @@
+"""
+StationIndex's great-circle distances, checked against haversine.
+"""
+import numpy as np
+
+from modules.station_distance import EARTH_RADIUS_M, StationIndex
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(value) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def test_nearest_and_count_within_match_haversine():
+    rng = np.random.default_rng(0)
+    station_lats, station_lons = rng.uniform(51.3, 51.7, 300), rng.uniform(-0.5, 0.3, 300)
+    lats, lons = rng.uniform(51.25, 51.75, 200), rng.uniform(-0.6, 0.4, 200)
+    distances = haversine(lats[:, None], lons[:, None], station_lats[None, :], station_lons[None, :])
+
+    index = StationIndex(station_lats, station_lons)
+    distance, nearest = index.nearest(lats, lons)
+    np.testing.assert_array_equal(nearest, distances.argmin(axis = 1))
+    np.testing.assert_allclose(distance, distances.min(axis = 1), rtol = 1e-9, atol = 1e-6)
+    for radius in [200, 500, 2000]:
+        np.testing.assert_array_equal(index.count_within(lats, lons, radius), (distances <= radius).sum(axis = 1))
+
+
+def test_known_distances():
+    # One degree of latitude, and a station at the query point itself
+    index = StationIndex([51.0, 52.0], [0.0, 0.0])
+    distance, nearest = index.nearest([52.0, 51.4], [0.0, 0.0])
+    assert nearest.tolist() == [1, 0]
+    np.testing.assert_allclose(distance, [0, 0.4 * np.pi / 180 * EARTH_RADIUS_M], atol = 1e-6)
+    assert index.count_within([51.5], [0.0], np.pi / 360 * EARTH_RADIUS_M + 1).tolist() == [2]
@@ -0,0 +1,29 @@
+"""
+wsgi.py
+--------
+The dashboard as a WSGI application, for serving real traffic with several worker processes, e.g.
+
+    gunicorn --workers 4 --bind 0.0.0.0:1222 wsgi:application
+
+or on Windows
+
+    waitress-serve --port=1222 --threads=8 wsgi:application
+
+The artifacts are never built here, so workers can't race to write them: build them first with
+python pipeline.py or python run_model.py --build. Each worker creates the app itself; don't use --preload,
+as forking a process which has already used Polars' thread pool can deadlock (see modules/pipeline.py).
+The site optimizer's grid (artifacts/site_problem/), much the largest artifact, is memory-mapped, so the
+workers still share the one copy of it the operating system caches rather than each loading their own.
+
+Set BIKEPOINT_SERVER_CALLBACKS=1 to draw the bar graphs on the server instead of in the browser.
+"""
+import os
+
+import run_model
+
+missing = [path for path in run_model.ARTIFACTS if not os.path.exists(path)]
+if missing:
+    raise FileNotFoundError("Build the artifacts before serving (python run_model.py --build). Missing: " + ", ".join(missing))
+
+app = run_model.create_production_app(clientside = os.environ.get("BIKEPOINT_SERVER_CALLBACKS", "0") in ("", "0"))
+application = app.server